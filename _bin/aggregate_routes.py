@@ -0,0 +1,228 @@
+"""Build every quarter's route aggregates in a single process.
+
+For each quarter schedule this writes the same files as running
+``extract_schedule_route_ids.py`` followed by ``merge_geojson.py`` (with and
+without ``--topology``):
+
+  <output-dir>/<quarter>.txt       route IDs run that quarter
+  <output-dir>/<quarter>.geojson   FeatureCollection of those routes
+  <output-dir>/<quarter>.topojson  the same routes as a TopoJSON topology
+
+and optionally one FeatureCollection of every route that has a GPX file in
+``routes/_gpx``, with its route IDs listed next to it (``routes.txt`` for
+``routes.geojson``). Each per-route GeoJSON
+file is read at most once, however many quarters it appears in. A quarter is
+only rewritten when its route list changed or one of its inputs (or the code
+that writes it) is newer than its outputs.
+
+Pointing ``--geojson-dir`` at a level-of-detail directory (see
+``gpx_to_geojson.py --lod-dir``) with ``--no-topology`` builds the simplified
+quarter aggregates the same way.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Sequence
+
+import extract_schedule_route_ids
+import merge_geojson
+import rcr
+import topology
+
+# The code that shapes the outputs; a change to any of it makes every output out of date
+SOURCES = [Path(__file__), Path(extract_schedule_route_ids.__file__), Path(merge_geojson.__file__),
+           Path(topology.__file__)]
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Aggregate per-route GeoJSON files for every quarter schedule.",
+    )
+    parser.add_argument(
+        "--schedules",
+        nargs="+",
+        metavar="PATH",
+        type=Path,
+        required=True,
+        help="Quarter schedule YAML files; outputs are named after each file's stem.",
+    )
+    parser.add_argument(
+        "--geojson-dir",
+        metavar="DIR",
+        type=Path,
+        required=True,
+        help="Directory containing per-route GeoJSON files named <route_id>.geojson.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        metavar="DIR",
+        type=Path,
+        required=True,
+        help="Directory to write the quarter aggregates to.",
+    )
+    parser.add_argument(
+        "--all-routes",
+        metavar="PATH",
+        type=Path,
+        help="Also write a FeatureCollection of every route with a GPX file to PATH "
+             "(and its route IDs to PATH with a .txt suffix).",
+    )
+    parser.add_argument(
+        "--quantization",
+        type=int,
+        default=topology.DEFAULT_QUANTIZATION,
+        help="Grid size per axis for TopoJSON coordinates (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--no-topology",
+        dest="topology",
+        action="store_false",
+        help="Only write the route ID lists and GeoJSON aggregates, not the TopoJSON ones.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rewrite every output, even if it looks up to date.",
+    )
+    return parser.parse_args(argv)
+
+
+class FeatureMemo:
+    """Per-route features, read from disk at most once per run.
+
+    The minified bytes are kept for the GeoJSON aggregates, which splice them
+    together without parsing. Parsed features are only built (once) for the
+    TopoJSON encoding, which needs the coordinates.
+    """
+
+    def __init__(self, geojson_dir: Path):
+        self.geojson_dir = geojson_dir
+        self._bytes: dict[str, list[bytes]] = {}
+        self._parsed: dict[str, list[dict]] = {}
+
+    def path(self, route_id: str) -> Path:
+        return self.geojson_dir / f"{route_id}.geojson"
+
+    def check_exists(self, route_ids: Sequence[str], context: str) -> None:
+        missing = [route_id for route_id in route_ids if not self.path(route_id).is_file()]
+        if missing:
+            raise ValueError(
+                f"Missing GeoJSON file(s) for route ID(s) in {context}: {', '.join(missing)}. "
+                f"Expected files at {self.geojson_dir}/<route_id>.geojson."
+            )
+
+    def feature_bytes(self, route_id: str) -> list[bytes]:
+        if route_id not in self._bytes:
+            self._bytes[route_id] = list(merge_geojson.iter_feature_bytes(self.path(route_id)))
+        return self._bytes[route_id]
+
+    def features(self, route_id: str) -> list[dict]:
+        if route_id not in self._parsed:
+            self._parsed[route_id] = [json.loads(feature) for feature in self.feature_bytes(route_id)]
+        return self._parsed[route_id]
+
+    @property
+    def files_read(self) -> int:
+        return len(self._bytes)
+
+
+def is_up_to_date(outputs: Sequence[Path], inputs: Sequence[Path]) -> bool:
+    """True if every output exists and is at least as new as every input."""
+    try:
+        oldest_output = min(path.stat().st_mtime_ns for path in outputs)
+    except FileNotFoundError:
+        return False
+    return all(path.stat().st_mtime_ns <= oldest_output for path in inputs)
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """Write ``text`` to ``path`` unless it already has that content (keeping its mtime)."""
+    if path.is_file() and path.read_text(encoding="utf-8") == text:
+        return False
+    path.write_text(text, encoding="utf-8")
+    return True
+
+
+def write_geojson_aggregate(memo: FeatureMemo, route_ids: Sequence[str], destination: Path) -> None:
+    with destination.open("wb") as fh:
+        merge_geojson.write_feature_bytes(
+            (feature for route_id in route_ids for feature in memo.feature_bytes(route_id)), fh
+        )
+
+
+def aggregate_quarter(memo: FeatureMemo, schedule: Path, output_dir: Path,
+                      quantization: int | None, force: bool) -> bool:
+    """Write the aggregates for one quarter. Returns False if they were already up to date.
+
+    The TopoJSON aggregate is skipped when ``quantization`` is None.
+    """
+    stem = schedule.stem
+    try:
+        route_ids = extract_schedule_route_ids.collect_route_ids(
+            extract_schedule_route_ids.load_schedule(schedule)
+        )
+    except extract_schedule_route_ids.ScheduleError as exc:
+        raise ValueError(f"{schedule}: {exc}") from exc
+    memo.check_exists(route_ids, str(schedule))
+
+    txt_path = output_dir / f"{stem}.txt"
+    geojson_path = output_dir / f"{stem}.geojson"
+    topojson_path = output_dir / f"{stem}.topojson"
+
+    ids_changed = write_if_changed(txt_path, "".join(f"{route_id}\n" for route_id in route_ids))
+    inputs = SOURCES + [schedule] + [memo.path(route_id) for route_id in route_ids]
+    outputs = [geojson_path] if quantization is None else [geojson_path, topojson_path]
+    if not (force or ids_changed) and is_up_to_date(outputs, inputs):
+        return False
+
+    write_geojson_aggregate(memo, route_ids, geojson_path)
+    if quantization is None:
+        return True
+    features = [feature for route_id in route_ids for feature in memo.features(route_id)]
+    merge_geojson.write_geojson(topology.build_topology(features, quantization=quantization), topojson_path)
+    return True
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    if not args.geojson_dir.is_dir():
+        raise SystemExit(f"GeoJSON directory does not exist: {args.geojson_dir}")
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    memo = FeatureMemo(args.geojson_dir)
+    rebuilt = 0
+    try:
+        for schedule in sorted(args.schedules):
+            quantization = args.quantization if args.topology else None
+            if aggregate_quarter(memo, schedule, args.output_dir, quantization, args.force):
+                print(f"Aggregated {schedule.stem}")
+                rebuilt += 1
+
+        if args.all_routes:
+            # routes whose GPX file was deleted or renamed may still have stale GeoJSON lying around
+            route_ids = [path.stem for path in rcr.gpx_paths()]
+            memo.check_exists(route_ids, str(rcr.ROUTES_GPX))
+            args.all_routes.parent.mkdir(parents=True, exist_ok=True)
+            ids_changed = write_if_changed(args.all_routes.with_suffix(".txt"),
+                                           "".join(f"{route_id}\n" for route_id in route_ids))
+            inputs = SOURCES + [memo.path(route_id) for route_id in route_ids]
+            if args.force or ids_changed or not is_up_to_date([args.all_routes], inputs):
+                write_geojson_aggregate(memo, route_ids, args.all_routes)
+                print(f"Aggregated {len(route_ids)} routes into {args.all_routes}")
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    print(f"{rebuilt} of {len(args.schedules)} quarters rebuilt, {memo.files_read} route files read "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
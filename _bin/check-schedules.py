@@ -1,7 +1,17 @@
+import argparse
+import json
 import re
 
+import gis
 import rcr
 
+# a leg whose notes say it is run the other way round starts at the route's end
+REVERSED_RE = re.compile(r'\brevers|\bbackwards', re.IGNORECASE)
+
+# per-quarter results of the last run, for --incremental
+STATE_FILE = rcr.ROOT / 'cache' / 'check-schedules.json'
+STATE_VERSION = 1
+
 warnings = False
 def warn(msg):
     global warnings
@@ -11,49 +21,138 @@ def warn(msg):
 def warn_sc(path, msg):
     warn(f"schedule {path}: {msg}")
 
-def check_schedule(schedule, route_ids):
+def check_schedule(schedule, routes):
+    """Warnings for one quarter's entries; routes maps route ID -> (start, end) location."""
+    found = []
     for entry in schedule:
         if 'plan' not in entry:
-            warn_sc(entry, "missing plan")
+            found.append((entry, "missing plan"))
             continue
 
         if re.match(r'\d{4}-\d{2}-\d{2}', entry['date']) is None:
             # Dates in ISO 8601 should be zero padded
-            warn_sc(entry, "date must be in format 'YYYY-MM-DD'")
+            found.append((entry, "date must be in format 'YYYY-MM-DD'"))
 
         for phase in entry['plan']:
           if 'route_id' in phase:
               if type(phase['route_id']) != str:
-                  warn_sc(entry, "route_id must be a string")
+                  found.append((entry, "route_id must be a string"))
                   continue
 
-              if phase['route_id'] not in route_ids:
-                  warn_sc(entry, f"unknown route_id '{phase['route_id']}'")
+              if phase['route_id'] not in routes:
+                  found.append((entry, f"unknown route_id '{phase['route_id']}'"))
+    return [f"schedule {entry}: {msg}" for entry, msg in found]
+
+def check_legs_connect(schedule, routes):
+    """Legs of a run that don't start where the leg before them ended.
+
+    Not fatal: a few runs have legs that start together (e.g. a half and a
+    full marathon) or a regroup somewhere else.
+    """
+    found = []
+    for entry in schedule:
+        if 'cancelled' in entry or 'plan' not in entry:
+            continue
+        legs = []
+        for phase in entry['plan']:
+            if 'cancelled' in phase or phase.get('route_id') not in routes:
+                legs.append(None)
+                continue
+            start, end = routes[phase['route_id']]
+            if REVERSED_RE.search(str(phase.get('notes', ''))):
+                start, end = end, start
+            legs.append((phase['route_id'], start, end))
+        for previous, leg in zip(legs, legs[1:]):
+            if previous and leg and previous[2] != leg[1]:
+                found.append(f"schedule {entry['date']}: leg '{leg[0]}' starts at {leg[1]} "
+                             f"but the leg before it, '{previous[0]}', ends at {previous[2]}")
+    return found
 
-def check_schedule_dates_ordered(schedules):
+def summarize(schedule):
+    """What the cross-quarter checks need to know about a quarter: its dates, in order."""
+    dates = [entry['date'] for entry in schedule]
+    return {'dates': sorted(set(dates)), 'first': dates[0] if dates else None, 'last': dates[-1] if dates else None,
+            'unordered': [date for previous, date in zip(dates, dates[1:]) if date < previous]}
+
+def check_schedule_dates_ordered(quarters):
+    """quarters maps quarter -> summarize() of its schedule, in chronological order."""
     last_date = None
     previous_set = set()
-    for path, schedule in schedules.items():
+    for quarter, summary in quarters.items():
         # Quarter schedules can have multiple entries with the same date, but quarters should be disjoint
-        schedule_date_set = set([entry['date'] for entry in schedule])
+        schedule_date_set = set(summary['dates'])
         if previous_set.intersection(schedule_date_set):
-            warn_sc(path, "schedule contains date from previous schedule")
+            warn_sc(quarter, "schedule contains date from previous schedule")
         previous_set = schedule_date_set
-        for entry in schedule:
-            date = entry['date']
-            if last_date is not None and date < last_date:
-                warn_sc(path, f"date '{date}' is not in chronological order")
-            last_date = date
+        if last_date is not None and summary['first'] is not None and summary['first'] < last_date:
+            warn_sc(quarter, f"date '{summary['first']}' is not in chronological order")
+        for date in summary['unordered']:
+            warn_sc(quarter, f"date '{date}' is not in chronological order")
+        if summary['last'] is not None:
+            last_date = summary['last']
+
+def load_state(routes):
+    try:
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # a route change can make any quarter (in)valid, so start over
+    if state.get('version') != STATE_VERSION or state.get('routes') != routes_key(routes):
+        return {}
+    return state['quarters']
+
+def save_state(routes, quarters):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(STATE_FILE, 'w') as f:
+        json.dump({'version': STATE_VERSION, 'routes': routes_key(routes), 'quarters': quarters}, f)
+
+def routes_key(routes):
+    return sorted([route_id, *ends] for route_id, ends in routes.items())
+
+def load_route_ends():
+    """Route ID -> (start, end) location, parsed from the GPX files like Warehouse.route_ends."""
+    locations = rcr.load_loc_db()
+    ends = {}
+    for route in rcr.load_routes():
+        points = route['track'].points
+        ends[route['id']] = (route['start'] or gis.get_nearest_loc(locations, points[0].latitude, points[0].longitude)[0],
+                             route['end'] or gis.get_nearest_loc(locations, points[-1].latitude, points[-1].longitude)[0])
+    return ends
 
 
 def main():
-    routes = rcr.load_routes()
-    route_ids = set([route['id'] for route in routes])
-    schedules = rcr.load_schedules()
-    for _, schedule in schedules.items():
-        check_schedule(schedule, route_ids)
+    parser = argparse.ArgumentParser(description="Check the quarter schedules for unknown routes, bad dates and disconnected legs.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-check schedule files changed since the last run (routes and cross-quarter order are always checked)")
+    args = parser.parse_args()
+
+    if args.incremental:
+        # route IDs and start/end locations, from the warehouse so unchanged GPX isn't parsed again
+        with rcr.load_warehouse() as warehouse:
+            routes = warehouse.route_ends()
+        previous = load_state(routes)
+    else:
+        routes = load_route_ends()
+        previous = {}
+    quarters = {}
+    for path in rcr.schedule_paths():
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        result = previous.get(path.stem)
+        if result is None or result['stamp'] != stamp:
+            schedule = rcr.load_yaml(path)
+            result = {'stamp': stamp, 'warnings': check_schedule(schedule, routes),
+                      'disconnected': check_legs_connect(schedule, routes), **summarize(schedule)}
+        for msg in result['warnings']:
+            warn(msg)
+        for msg in result['disconnected']:
+            print(f"WARNING (not fatal): {msg}")
+        quarters[path.stem] = result
 
-    check_schedule_dates_ordered(schedules)
+    check_schedule_dates_ordered(quarters)
+    if args.incremental:
+        save_state(routes, quarters)
 
     if warnings:
         exit(1)
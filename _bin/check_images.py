@@ -0,0 +1,412 @@
+"""Check that site images fit the size and dimension budget, optionally fixing them.
+
+Dimensions and format are read from each file's header without decoding any
+pixels, so scanning the whole image tree is I/O bound and runs on a thread
+pool. ``--fix`` downscales and recompresses offending raster images in a
+process pool (requires Pillow: ``uv sync --extra route-images``). A
+content-hash cache records every image ``--fix`` has already recompressed, so
+an image that is still over budget afterwards is reported for fixing by hand
+instead of being lossily re-encoded again on every run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Sequence
+
+import rcr
+
+IMAGE_SUFFIXES = {".webp", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".avif"}
+# Formats Pillow can re-encode in place without changing the file's extension
+PILLOW_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "avif": "AVIF", "gif": "GIF"}
+
+DEFAULT_CACHE = rcr.ROOT / ".image-budget-cache.json"
+
+
+class ImageHeaderError(ValueError):
+    """Raised when an image header cannot be parsed."""
+
+
+@dataclass
+class ImageInfo:
+    path: Path
+    size_bytes: int
+    format: str | None
+    width: int | None
+    height: int | None
+
+    @property
+    def max_edge(self) -> int | None:
+        if self.width is None or self.height is None:
+            return None
+        return max(self.width, self.height)
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Check that images under <site>/img fit the size budget.",
+    )
+    parser.add_argument("root", type=Path, help="Path to the root of the site (images are read from <root>/img).")
+    parser.add_argument(
+        "--max-kb",
+        type=int,
+        default=3000,
+        help="Maximum file size in KB (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--max-edge",
+        type=int,
+        default=None,
+        help="Maximum width or height in pixels (default: not enforced).",
+    )
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="Downscale/recompress offending raster images in place.",
+    )
+    parser.add_argument(
+        "--fix-edge",
+        type=int,
+        default=2000,
+        help="Longest edge to downscale to when fixing an oversized image (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=90,
+        help="Starting encoder quality when fixing (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        default=DEFAULT_CACHE,
+        help="Content-hash cache of already-recompressed images (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker count for scanning and fixing (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def _read_exact(fh: BinaryIO, n: int) -> bytes:
+    data = fh.read(n)
+    if len(data) != n:
+        raise ImageHeaderError("unexpected end of file")
+    return data
+
+
+def _png_size(fh: BinaryIO) -> tuple[int, int]:
+    header = _read_exact(fh, 24)
+    if header[12:16] != b"IHDR":
+        raise ImageHeaderError("PNG missing IHDR")
+    return struct.unpack(">II", header[16:24])
+
+
+def _gif_size(fh: BinaryIO) -> tuple[int, int]:
+    header = _read_exact(fh, 10)
+    return struct.unpack("<HH", header[6:10])
+
+
+# SOFn markers carry the frame dimensions; C4 (DHT), C8 (JPG) and CC (DAC) share the range but don't
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(fh: BinaryIO) -> tuple[int, int]:
+    fh.seek(2)
+    while True:
+        byte = _read_exact(fh, 1)
+        if byte != b"\xff":
+            continue
+        marker = _read_exact(fh, 1)[0]
+        while marker == 0xFF:  # fill bytes
+            marker = _read_exact(fh, 1)[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue  # standalone markers without a length
+        (length,) = struct.unpack(">H", _read_exact(fh, 2))
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack(">xHH", _read_exact(fh, 5))
+            return width, height
+        fh.seek(length - 2, os.SEEK_CUR)
+
+
+def _webp_size(fh: BinaryIO) -> tuple[int, int]:
+    header = _read_exact(fh, 30)
+    chunk = header[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(header[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(header[24:27], "little") + 1, int.from_bytes(header[27:30], "little") + 1
+    raise ImageHeaderError(f"unknown WebP chunk {chunk!r}")
+
+
+def _iter_boxes(data: bytes, start: int, end: int):
+    """Yield (type, payload_start, box_end) for ISOBMFF boxes in data[start:end]."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ImageHeaderError("corrupt ISOBMFF box")
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _avif_size(fh: BinaryIO) -> tuple[int, int]:
+    # The meta box (with the item properties) precedes the pixel data, so a
+    # bounded read is enough; mdat is never inspected.
+    data = fh.read(256 * 1024)
+    for box_type, payload, box_end in _iter_boxes(data, 0, len(data)):
+        if box_type != b"meta":
+            continue
+        # meta is a FullBox: skip version/flags
+        for child, child_payload, child_end in _iter_boxes(data, payload + 4, box_end):
+            if child != b"iprp":
+                continue
+            for prop, prop_payload, prop_end in _iter_boxes(data, child_payload, child_end):
+                if prop != b"ipco":
+                    continue
+                extents = [
+                    struct.unpack(">II", data[p + 4:p + 12])
+                    for kind, p, _ in _iter_boxes(data, prop_payload, prop_end)
+                    if kind == b"ispe"
+                ]
+                if extents:
+                    # The primary image is the largest; smaller extents are thumbnails or grid tiles
+                    return max(extents, key=lambda wh: wh[0] * wh[1])
+    raise ImageHeaderError("AVIF missing ispe property")
+
+
+def sniff_format(head: bytes) -> str | None:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8"):
+        return "jpeg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis", b"mif1"):
+        return "avif"
+    if b"<svg" in head or head.lstrip().startswith(b"<?xml"):
+        return "svg"
+    return None
+
+
+_SIZE_READERS = {
+    "png": _png_size,
+    "gif": _gif_size,
+    "jpeg": _jpeg_size,
+    "webp": _webp_size,
+    "avif": _avif_size,
+}
+
+
+def read_image_info(path: Path) -> ImageInfo:
+    """Read format and dimensions from the header of the image at ``path``."""
+    size_bytes = path.stat().st_size
+    with path.open("rb") as fh:
+        image_format = sniff_format(fh.read(512))
+        width = height = None
+        reader = _SIZE_READERS.get(image_format)
+        if reader is not None:
+            fh.seek(0)
+            try:
+                width, height = reader(fh)
+            except (ImageHeaderError, struct.error) as exc:
+                raise ImageHeaderError(f"{path}: {exc}") from exc
+    return ImageInfo(path, size_bytes, image_format, width, height)
+
+
+def find_images(root: Path) -> list[Path]:
+    images = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES:
+                images.append(Path(dirpath) / name)
+    return sorted(images)
+
+
+def budget_problems(info: ImageInfo, max_bytes: int, max_edge: int | None) -> list[str]:
+    problems = []
+    if info.size_bytes > max_bytes:
+        problems.append(f"{info.size_bytes // 1024}KB exceeds {max_bytes // 1024}KB")
+    if max_edge is not None and info.max_edge is not None and info.max_edge > max_edge:
+        problems.append(f"{info.width}x{info.height} exceeds {max_edge}px")
+    return problems
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_cache(path: Path) -> dict[str, str]:
+    if not path.is_file():
+        return {}
+    with path.open("r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def write_cache(cache: dict[str, str], path: Path) -> None:
+    with path.open("w", encoding="utf-8") as fh:
+        json.dump(cache, fh, indent=2, sort_keys=True)
+        fh.write("\n")
+
+
+def fix_image(path: Path, image_format: str, max_bytes: int, fix_edge: int, quality: int) -> tuple[int, int]:
+    """Downscale and recompress ``path`` in place. Returns (old_bytes, new_bytes).
+
+    Animated images keep all their frames, and the ICC profile and EXIF data are carried over.
+    """
+    from PIL import Image, ImageOps, ImageSequence
+
+    old_bytes = path.stat().st_size
+    with Image.open(path) as original:
+        animated = getattr(original, "n_frames", 1) > 1
+        icc_profile = original.info.get("icc_profile")
+        loop = original.info.get("loop", 0)
+        if animated:
+            frames = [frame.copy() for frame in ImageSequence.Iterator(original)]
+            durations = [frame.info.get("duration", original.info.get("duration", 100)) for frame in frames]
+            exif = original.getexif()
+        else:
+            # Bake the EXIF orientation into the pixels, like `mogrify -auto-orient`; the
+            # transposed image's EXIF has the orientation tag reset to match
+            frames = [ImageOps.exif_transpose(original)]
+            exif = frames[0].getexif()
+    for frame in frames:
+        if max(frame.size) > fix_edge:
+            frame.thumbnail((fix_edge, fix_edge), Image.Resampling.LANCZOS)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    pil_format = PILLOW_FORMATS[image_format]
+    save_kwargs: dict[str, object] = {"optimize": True}
+    if icc_profile:
+        save_kwargs["icc_profile"] = icc_profile
+    if len(exif) and pil_format != "GIF":
+        save_kwargs["exif"] = exif
+    if animated:
+        save_kwargs.update(save_all=True, append_images=frames[1:], duration=durations, loop=loop)
+    # Step quality down until the image fits the budget (lossless formats only get one pass)
+    for q in range(quality, 49, -10):
+        if pil_format in ("JPEG", "WEBP", "AVIF"):
+            save_kwargs["quality"] = q
+        frames[0].save(tmp_path, pil_format, **save_kwargs)
+        if tmp_path.stat().st_size <= max_bytes or pil_format in ("PNG", "GIF"):
+            break
+
+    new_bytes = tmp_path.stat().st_size
+    if new_bytes < old_bytes:
+        os.replace(tmp_path, path)
+        return old_bytes, new_bytes
+    tmp_path.unlink()
+    return old_bytes, old_bytes
+
+
+def _safe_read_image_info(path: Path) -> ImageInfo | ImageHeaderError:
+    try:
+        return read_image_info(path)
+    except ImageHeaderError as exc:
+        return exc
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    assets_root = args.root / "img"
+    if not assets_root.is_dir():
+        print(f"Error: no image directory at '{assets_root}'", file=sys.stderr)
+        return 1
+    max_bytes = args.max_kb * 1024
+
+    paths = find_images(assets_root)
+    failed = False
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        infos = []
+        for path, result in zip(paths, pool.map(_safe_read_image_info, paths)):
+            if isinstance(result, ImageHeaderError):
+                print(f"Image {path} has an unreadable header: {result}", file=sys.stderr)
+                failed = True
+            else:
+                infos.append(result)
+
+    offending = [(info, problems) for info in infos
+                 if (problems := budget_problems(info, max_bytes, args.max_edge))]
+
+    if not args.fix:
+        for info, problems in offending:
+            print(f"Image {info.path} ({info.format}, {'; '.join(problems)}) is over budget.", file=sys.stderr)
+        return 1 if failed or offending else 0
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("--fix requires Pillow. Install it with `uv sync --extra route-images`.", file=sys.stderr)
+        return 1
+
+    cache = load_cache(args.cache)
+    to_fix = []
+    for info, problems in offending:
+        if info.format not in PILLOW_FORMATS:
+            print(f"Image {info.path} ({info.format}, {'; '.join(problems)}) can't be fixed automatically.", file=sys.stderr)
+            failed = True
+            continue
+        digest = file_digest(info.path)
+        if digest in cache:
+            print(f"Image {info.path} was already recompressed; fix it by hand ({'; '.join(problems)}).", file=sys.stderr)
+            failed = True
+            continue
+        to_fix.append(info)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            info.path: pool.submit(fix_image, info.path, info.format, max_bytes, args.fix_edge, args.quality)
+            for info in to_fix
+        }
+    for info in to_fix:
+        try:
+            old_bytes, new_bytes = futures[info.path].result()
+            remaining = budget_problems(read_image_info(info.path), max_bytes, args.max_edge)
+        except Exception as exc:
+            print(f"Image {info.path} could not be fixed: {exc}", file=sys.stderr)
+            failed = True
+            continue
+        print(f"Fixed {info.path}: {old_bytes // 1024}KB -> {new_bytes // 1024}KB")
+        # Record the result whether or not it fits: recompressing it again would only lose more
+        # quality, so an image still over budget is left to be fixed by hand
+        cache[file_digest(info.path)] = info.path.as_posix()
+        if remaining:
+            print(f"Image {info.path} is still over budget ({'; '.join(remaining)}); fix it by hand.", file=sys.stderr)
+            failed = True
+
+    if to_fix:
+        write_cache(cache, args.cache)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
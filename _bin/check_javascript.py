@@ -1,87 +1,286 @@
+"""Check every page of a built site for JavaScript console errors.
+
+The build directory is served from a local threaded HTTP server and pages are
+loaded by concurrent workers, each in a fresh browser context, so no manually
+started server is needed. With ``--changed-since`` only pages whose HTML or referenced local
+scripts changed since the manifest was last written are tested.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import http.server
+import json
 import os
+import re
 import sys
+import threading
 from pathlib import Path
-from playwright.sync_api import sync_playwright
+from typing import Sequence
+from urllib.parse import urlsplit
+
+from playwright.async_api import async_playwright
+
+# <script src="..."> in HTML and static `import ... from "..."` / `import("...")` in scripts
+SCRIPT_SRC_RE = re.compile(rb"""<script\b[^>]*?\bsrc\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+IMPORT_RE = re.compile(rb"""\bimport\s*(?:[^"'();]*?\bfrom\s*)?\(?\s*["']([^"']+)["']""")
 
 
-def find_html_files(build_dir):
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Test all .html files of a built site for JavaScript errors.",
+    )
+    parser.add_argument("build_dir", type=Path, help="Path to the compiled site directory.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(8, os.cpu_count() or 1),
+        help="Number of pages loaded concurrently (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--base-path",
+        default="",
+        help="Base path the site was built for (e.g. __rcr__), stripped when serving.",
+    )
+    parser.add_argument(
+        "--changed-since",
+        metavar="MANIFEST",
+        type=Path,
+        help="Only test pages whose HTML or referenced scripts changed since MANIFEST was written. "
+             "The manifest is created if missing and updated with every page that passes.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for each page's load event (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def find_html_files(build_dir: Path) -> list[Path]:
     """Recursively find all .html files in the build directory."""
     html_files = []
     for root, _, files in os.walk(build_dir):
         for file in files:
             if file.endswith(".html"):
-                full_path = os.path.join(root, file)
-                html_files.append(full_path)
-    return html_files
+                html_files.append(Path(root) / file)
+    return sorted(html_files)
+
+
+def page_url(base_url: str, build_dir: Path, file_path: Path) -> str:
+    """Convert a local file path to a URL on the local server."""
+    relative_path = file_path.relative_to(build_dir).as_posix()
+    return f"{base_url}/{relative_path}"
+
+
+class PageDigests:
+    """Content digests for pages, covering the local scripts they pull in.
+
+    Script digests are memoized so shared modules are only read and hashed once
+    per run, however many pages import them.
+    """
+
+    def __init__(self, build_dir: Path, base_path: str):
+        self.build_dir = build_dir.resolve()
+        self.base_prefix = f"/{base_path}" if base_path else ""
+        self._scripts: dict[Path, str] = {}
+
+    def resolve(self, reference: bytes, referrer: Path) -> Path | None:
+        """Map a script reference to a file in the build directory, if it is local."""
+        try:
+            ref = reference.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        parts = urlsplit(ref)
+        if parts.scheme or parts.netloc or not parts.path:
+            return None
+        path = parts.path
+        if path.startswith("/"):
+            if self.base_prefix and path.startswith(self.base_prefix + "/"):
+                path = path[len(self.base_prefix):]
+            candidate = self.build_dir / path.lstrip("/")
+        elif path.startswith("."):
+            candidate = referrer.parent / path
+        else:
+            # Bare specifiers resolve through the import map to a CDN
+            return None
+        candidate = candidate.resolve()
+        if candidate.is_file() and candidate.is_relative_to(self.build_dir):
+            return candidate
+        return None
+
+    def script_digest(self, path: Path, _active: frozenset[Path] = frozenset()) -> str:
+        """Digest of a script and, recursively, the local modules it imports."""
+        if path in self._scripts:
+            return self._scripts[path]
+        data = path.read_bytes()
+        digest = hashlib.sha256(data)
+        active = _active | {path}
+        for reference in sorted(set(IMPORT_RE.findall(data))):
+            dependency = self.resolve(reference, path)
+            if dependency is not None and dependency not in active:
+                digest.update(self.script_digest(dependency, active).encode())
+        self._scripts[path] = digest.hexdigest()
+        return self._scripts[path]
+
+    def page_digest(self, path: Path) -> str:
+        """Digest of a page's HTML and every local script it references."""
+        data = path.read_bytes()
+        digest = hashlib.sha256(data)
+        references = set(SCRIPT_SRC_RE.findall(data)) | set(IMPORT_RE.findall(data))
+        scripts = {self.resolve(reference, path) for reference in references}
+        for script in sorted(s for s in scripts if s is not None):
+            digest.update(script.relative_to(self.build_dir).as_posix().encode())
+            digest.update(self.script_digest(script).encode())
+        return digest.hexdigest()
+
+
+def load_manifest(path: Path) -> dict[str, str]:
+    if not path.is_file():
+        return {}
+    with path.open("r", encoding="utf-8") as fh:
+        return json.load(fh)
 
 
-def local_file_to_url(build_dir, file_path):
-    """Convert a local file path to a URL for a locally served site."""
-    relative_path = os.path.relpath(file_path, build_dir)
-    url = f"http://localhost:4000/{relative_path.replace(os.path.sep, '/')}"
-    return url
+def write_manifest(manifest: dict[str, str], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+        fh.write("\n")
 
 
-def test_pages(build_dir):
-    """Test all pages for JavaScript errors."""
-    html_files = find_html_files(build_dir)
-    pages = [local_file_to_url(build_dir, f) for f in html_files]
+def start_server(build_dir: Path, base_path: str) -> http.server.ThreadingHTTPServer:
+    """Serve ``build_dir`` on a free localhost port from a background thread."""
+    prefix = f"/{base_path}" if base_path else ""
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        results = []
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            if prefix and (path == prefix or path.startswith(prefix + "/")):
+                path = path[len(prefix):] or "/"
+            return super().translate_path(path)
 
-        for page_url in pages:
-            errors = []
-            page = browser.new_page()
+        def log_message(self, format, *args):
+            # Suppress server logs to avoid cluttering the output
+            pass
+
+    handler = functools.partial(Handler, directory=str(build_dir))
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+async def test_pages(urls: list[str], workers: int, timeout: float) -> dict[str, list[str]]:
+    """Load each URL in its own browser context, ``workers`` at a time, and collect console errors."""
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+    results: dict[str, list[str]] = {}
+
+    async def test_page(browser, url: str) -> list[str]:
+        # A fresh context per page, so storage, cookies and cache never carry over between pages
+        errors: list[str] = []
+        context = await browser.new_context()
+        try:
+            page = await context.new_page()
 
-            # Capture console errors
             def on_console_message(msg):
                 if msg.type == "error":
                     errors.append(msg.text)
 
             page.on("console", on_console_message)
-
+            page.on("pageerror", lambda exc: errors.append(str(exc)))
             try:
-                print(f"Testing {page_url}...")
-                page.goto(page_url, wait_until="load")
+                await page.goto(url, wait_until="load", timeout=timeout * 1000)
             except Exception as e:
                 errors.append(f"Failed to load page: {e}")
+            # Copy before closing so late console messages aren't counted
+            return list(errors)
+        finally:
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    async def worker(browser):
+        while True:
+            try:
+                url = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            try:
+                results[url] = await test_page(browser, url)
+            except Exception as e:
+                results[url] = [f"Failed to test page: {e}"]
 
-            results.append({"page_url": page_url, "errors": errors})
-            page.close()
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        await asyncio.gather(*(worker(browser) for _ in range(max(1, min(workers, len(urls))))))
+        await browser.close()
 
-        browser.close()
+    return results
 
-        # Output results
-        for result in results:
 
-            if not result["errors"]:
-                pass
-                # Quiet
-                #print(f"\nPage: {result['page_url']}")
-                #print("✔ No JavaScript errors.")
-            else:
-                print(f"\nPage: {result['page_url']}")
-                print("✖ JavaScript errors:")
-                for error in result["errors"]:
-                    print(f"  - {error}")
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    build_dir = args.build_dir.resolve()
+    if not build_dir.is_dir():
+        print(f"Error: {args.build_dir} is not a valid directory.")
+        return 1
+    base_path = args.base_path.strip("/")
 
-        # Exit with non-zero code if errors found
-        if any(result["errors"] for result in results):
-            exit(1)
+    html_files = {path.relative_to(build_dir).as_posix(): path for path in find_html_files(build_dir)}
+    manifest: dict[str, str] = {}
+    current: dict[str, str] = {}
+    to_test = list(html_files.values())
+    if args.changed_since:
+        digests = PageDigests(build_dir, base_path)
+        current = {page: digests.page_digest(path) for page, path in html_files.items()}
+        manifest = load_manifest(args.changed_since)
+        to_test = [path for page, path in html_files.items() if manifest.get(page) != current[page]]
+        print(f"{len(to_test)} of {len(html_files)} pages changed since {args.changed_since}")
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python test_site.py <build_directory>")
-        sys.exit(1)
+    results: dict[str, list[str]] = {}
+    if to_test:
+        httpd = start_server(build_dir, base_path)
+        base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        if base_path:
+            base_url += f"/{base_path}"
+        print(f"Testing {len(to_test)} .html files in {build_dir} with {args.workers} workers")
+        try:
+            urls = {page_url(base_url, build_dir, path): path for path in to_test}
+            by_url = asyncio.run(test_pages(list(urls), args.workers, args.timeout))
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        results = {urls[url].relative_to(build_dir).as_posix(): errors for url, errors in by_url.items()}
 
-    build_directory = sys.argv[1]
+    failed = False
+    for page in sorted(results):
+        if results[page]:
+            failed = True
+            print(f"\nPage: {page}")
+            print("✖ JavaScript errors:")
+            for error in results[page]:
+                print(f"  - {error}")
 
-    if not os.path.isdir(build_directory):
-        print(f"Error: {build_directory} is not a valid directory.")
-        sys.exit(1)
+    if args.changed_since:
+        # Keep digests only for pages that are known good; failures stay "changed" until fixed
+        manifest = {page: digest for page, digest in manifest.items() if page in current}
+        for page, errors in results.items():
+            if errors:
+                manifest.pop(page, None)
+            else:
+                manifest[page] = current[page]
+        write_manifest(manifest, args.changed_since)
+
+    return 1 if failed else 0
 
-    print(f"Testing all .html files in: {build_directory}")
-    print("Make sure a local server is running on http://localhost:4000")
-    test_pages(build_directory)
\ No newline at end of file
+
+if __name__ == "__main__":
+    sys.exit(main())
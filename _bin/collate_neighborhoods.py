@@ -4,15 +4,22 @@ nearby cities we run through. It is used to determine the neighborhoods that a r
 up in the routes table and in keywords attached to each route's webpage.
 
 We track the output in the repo because it changes so infrequently. Modify this script if you're changing up the way
-we handle neighborhoods or if you want to add new cities to the list.
+we handle neighborhoods or if you want to add new cities to the list. The source datasets are cached in
+cache/neighborhoods and only downloaded again when they change upstream, so re-running works offline too.
 """
 
 import json
+import math
 import requests
 from typing import Any, Dict, List
+import numpy as np
+import shapely
 from shapely.geometry import Polygon, MultiPolygon
 import haversine
 
+import gis
+import rcr
+
 # Configuration constants
 SEATTLE_NEIGHBORHOODS_ATLAS = "https://hub.arcgis.com/api/v3/datasets/b4a142f592e94d39a3bf787f3c112c1d_0/downloads/data?format=geojson&spatialRefId=4326&where=1%3D1"
 WA_CITY_BOUNDARIES = "https://hub.arcgis.com/api/v3/datasets/69fcb668dc8d49ea8010b6e33e42a13a_0/downloads/data?format=geojson&spatialRefId=4326&where=1%3D1"
@@ -25,6 +32,9 @@ COORDINATE_PRECISION = 6
 RDP_TOLERANCE = 0.0001
 MAX_DISTANCE_MILES = 30
 
+# Downloaded datasets, revalidated with ETag/Last-Modified and used as-is when offline
+DOWNLOAD_CACHE = rcr.ROOT / "cache" / "neighborhoods"
+
 # Whitespace characters end up being around half the file size if we do normal indentation for coordinates arrays
 def dump_geojson_with_compact_geometry(geojson, f):
     if geojson.get("type") == "FeatureCollection":
@@ -76,7 +86,7 @@ def dump_feature_with_compact_geometry(feature, f, indent=''):
 
 def _round_coords(coords_ring):
     """Helper to round coordinate precision in a coordinate ring."""
-    return [[round(x, COORDINATE_PRECISION), round(y, COORDINATE_PRECISION)] for x, y in coords_ring]
+    return [[round(x, COORDINATE_PRECISION), round(y, COORDINATE_PRECISION)] for x, y in np.asarray(coords_ring).tolist()]
 
 
 def _polygon_to_geojson_coords(polygon):
@@ -86,16 +96,25 @@ def _polygon_to_geojson_coords(polygon):
     return [exterior_coords] + holes_coords
 
 
-def simplify_geometry_rdp(geometry: Dict[str, Any], tolerance: float = RDP_TOLERANCE) -> Dict[str, Any]:
-    """
-    Simplify a GeoJSON geometry using Ramer-Douglas-Peucker algorithm with precision reduction.
-    """
+def _polygon_parts(geometry: Dict[str, Any]) -> List[Polygon] | None:
+    """Shapely polygons for the non-empty parts of a GeoJSON Polygon or MultiPolygon, None for other geometries."""
     if geometry.get("type") == "Polygon":
-        coords = geometry["coordinates"]
-        if coords:
-            shapely_poly = Polygon(coords[0], holes=coords[1:] if len(coords) > 1 else None)
-            simplified = shapely_poly.simplify(tolerance, preserve_topology=True)
+        polygons = [geometry["coordinates"]] if geometry["coordinates"] else []
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = [coords for coords in geometry["coordinates"] if coords]
+    else:
+        return None
+    # building from coordinate arrays skips shapely's point-by-point handling of nested lists
+    return [shapely.polygons(np.asarray(coords[0], dtype=float),
+                             holes=[np.asarray(hole, dtype=float) for hole in coords[1:]] or None)
+            for coords in polygons]
+
 
+def _simplified_geometry(geometry: Dict[str, Any], simplified_parts) -> Dict[str, Any]:
+    """GeoJSON for a Polygon or MultiPolygon from its simplified parts."""
+    if geometry.get("type") == "Polygon":
+        if simplified_parts:
+            simplified = simplified_parts[0]
             if isinstance(simplified, Polygon):
                 return {
                     "type": "Polygon",
@@ -110,19 +129,13 @@ def simplify_geometry_rdp(geometry: Dict[str, Any], tolerance: float = RDP_TOLER
                 }
 
     elif geometry.get("type") == "MultiPolygon":
-        coords = geometry["coordinates"]
         simplified_polygons = []
-
-        for poly_coords in coords:
-            if poly_coords:
-                shapely_poly = Polygon(poly_coords[0], holes=poly_coords[1:] if len(poly_coords) > 1 else None)
-                simplified = shapely_poly.simplify(tolerance, preserve_topology=True)
-
-                if isinstance(simplified, Polygon):
-                    simplified_polygons.append(_polygon_to_geojson_coords(simplified))
-                elif isinstance(simplified, MultiPolygon):
-                    for geom in simplified.geoms:
-                        simplified_polygons.append(_polygon_to_geojson_coords(geom))
+        for simplified in simplified_parts:
+            if isinstance(simplified, Polygon):
+                simplified_polygons.append(_polygon_to_geojson_coords(simplified))
+            elif isinstance(simplified, MultiPolygon):
+                for geom in simplified.geoms:
+                    simplified_polygons.append(_polygon_to_geojson_coords(geom))
 
         return {
             "type": "MultiPolygon",
@@ -133,18 +146,46 @@ def simplify_geometry_rdp(geometry: Dict[str, Any], tolerance: float = RDP_TOLER
     return geometry
 
 
+def simplify_geometry_rdp(geometry: Dict[str, Any], tolerance: float = RDP_TOLERANCE) -> Dict[str, Any]:
+    """
+    Simplify a GeoJSON geometry using Ramer-Douglas-Peucker algorithm with precision reduction.
+    """
+    parts = _polygon_parts(geometry) or []
+    return _simplified_geometry(geometry, list(shapely.simplify(parts, tolerance, preserve_topology=True)))
+
+
 def simplify_boundaries(geojson_data: Dict[str, Any], tolerance: float = RDP_TOLERANCE) -> Dict[str, Any]:
     """
     Apply RDP simplification to all boundaries in a FeatureCollection.
+
+    Every polygon part of every feature goes through a single vectorized shapely.simplify call.
     """
     if geojson_data.get("type") == "FeatureCollection":
-        for feature in geojson_data.get("features", []):
-            if "geometry" in feature:
-                feature["geometry"] = simplify_geometry_rdp(feature["geometry"], tolerance)
+        features = [feature for feature in geojson_data.get("features", []) if "geometry" in feature]
+        parts = []
+        owners = []
+        for i, feature in enumerate(features):
+            for part in _polygon_parts(feature["geometry"] or {}) or []:
+                parts.append(part)
+                owners.append(i)
+
+        simplified = shapely.simplify(np.array(parts, dtype=object), tolerance, preserve_topology=True)
+        feature_parts = [[] for _ in features]
+        for owner, geom in zip(owners, simplified):
+            feature_parts[owner].append(geom)
+        for feature, simplified_parts in zip(features, feature_parts):
+            if feature["geometry"]:
+                feature["geometry"] = _simplified_geometry(feature["geometry"], simplified_parts)
 
     return geojson_data
 
 
+def _geometry_shape(geometry: Dict[str, Any] | None):
+    """A GeoJSON Polygon or MultiPolygon as a shapely geometry, None if it has no polygons."""
+    parts = _polygon_parts(geometry or {})
+    if not parts:
+        return None
+    return parts[0] if geometry["type"] == "Polygon" else MultiPolygon(parts)
 
 
 def get_geometry_centroid(geometry: Dict[str, Any]) -> tuple[float, float]:
@@ -152,39 +193,62 @@ def get_geometry_centroid(geometry: Dict[str, Any]) -> tuple[float, float]:
     Get the centroid of a GeoJSON geometry using Shapely.
     Returns (longitude, latitude).
     """
-    if geometry.get("type") == "Polygon":
-        coords = geometry["coordinates"]
-        if coords:
-            shapely_poly = Polygon(coords[0], holes=coords[1:] if len(coords) > 1 else None)
-            centroid = shapely_poly.centroid
-            return (centroid.x, centroid.y)
-
-    elif geometry.get("type") == "MultiPolygon":
-        coords = geometry["coordinates"]
-        polygons = []
-        for poly_coords in coords:
-            if poly_coords:
-                shapely_poly = Polygon(poly_coords[0], holes=poly_coords[1:] if len(poly_coords) > 1 else None)
-                polygons.append(shapely_poly)
-
-        if polygons:
-            # Create MultiPolygon and get centroid
-            from shapely.geometry import MultiPolygon as ShapelyMultiPolygon
-            multi_poly = ShapelyMultiPolygon(polygons)
-            centroid = multi_poly.centroid
-            return (centroid.x, centroid.y)
+    shape = _geometry_shape(geometry)
+    if shape is not None:
+        centroid = shape.centroid
+        return (centroid.x, centroid.y)
 
     # Fallback: return Seattle center if we can't calculate centroid
     return SEATTLE_CENTER
 
 
+def fetch_cached(url: str, name: str) -> Dict[str, Any]:
+    """
+    Fetch a GeoJSON dataset, revalidating a cached copy with its ETag/Last-Modified headers.
+
+    The cached copy is used if the server reports it unchanged, or if the server can't be reached.
+    """
+    data_path = DOWNLOAD_CACHE / f"{name}.geojson"
+    meta_path = DOWNLOAD_CACHE / f"{name}.headers.json"
+    headers = {}
+    if data_path.exists() and meta_path.exists():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("url") == url:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = requests.get(url, headers=headers, timeout=120)
+        if response.status_code == 304:
+            print(f"  {name}: unchanged, using cached copy")
+        else:
+            response.raise_for_status()
+            data = response.json()
+            DOWNLOAD_CACHE.mkdir(parents=True, exist_ok=True)
+            with open(data_path, "w") as f:
+                json.dump(data, f)
+            with open(meta_path, "w") as f:
+                json.dump({"url": url,
+                           "etag": response.headers.get("ETag"),
+                           "last_modified": response.headers.get("Last-Modified")}, f)
+            return data
+    except requests.RequestException as e:
+        if not data_path.exists():
+            raise
+        print(f"  {name}: download failed ({e}), using cached copy")
+
+    with open(data_path) as f:
+        return json.load(f)
+
+
 def fetch_wa_city_boundaries() -> Dict[str, Any]:
     """
     Fetch Washington state city boundaries from the official source.
     """
-    response = requests.get(WA_CITY_BOUNDARIES)
-    response.raise_for_status()
-    return response.json()
+    return fetch_cached(WA_CITY_BOUNDARIES, "wa_city_boundaries")
 
 
 def merge_duplicate_cities(city_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -254,8 +318,26 @@ def filter_city_boundaries(city_data: Dict[str, Any], exclude_cities: List[str]
     exclude_cities_lower = [city.lower() for city in exclude_cities]
     filtered_features = []
     seattle_lon, seattle_lat = SEATTLE_CENTER
-
-    for feature in city_data.get("features", []):
+    features = city_data.get("features", [])
+
+    # Centroids of every city at once; an STRtree over them narrows the distance check to the
+    # cities inside a box around the max distance circle. Cities without a polygon stay in.
+    shapes = [_geometry_shape(feature.get("geometry")) for feature in features]
+    with_shape = [i for i, shape in enumerate(shapes) if shape is not None]
+    centroids = shapely.centroid(np.array([shapes[i] for i in with_shape], dtype=object))
+    # padded a little so the box always covers the circle
+    lat_delta = max_distance_miles * 1609.344 / (gis.EARTH_RADIUS_M * math.pi / 180) * 1.01
+    lon_delta = lat_delta / math.cos(math.radians(min(abs(seattle_lat) + lat_delta, 89.0)))
+    search_box = shapely.box(seattle_lon - lon_delta, seattle_lat - lat_delta,
+                             seattle_lon + lon_delta, seattle_lat + lat_delta)
+    near = set(i for i in range(len(features)) if shapes[i] is None)
+    for i in shapely.STRtree(centroids).query(search_box):
+        centroid = centroids[i]
+        distance = haversine.haversine((seattle_lat, seattle_lon), (centroid.y, centroid.x), unit=haversine.Unit.MILES)
+        if distance <= max_distance_miles:
+            near.add(with_shape[i])
+
+    for i, feature in enumerate(features):
         props = feature.get("properties", {})
         city_name = props.get("CITY_DISSOLVE", "").strip()
 
@@ -263,15 +345,9 @@ def filter_city_boundaries(city_data: Dict[str, Any], exclude_cities: List[str]
         if city_name.lower() in exclude_cities_lower:
             continue
 
-        # Calculate distance from Seattle center
-        geometry = feature.get("geometry")
-        if geometry:
-            city_lon, city_lat = get_geometry_centroid(geometry)
-            distance = haversine.haversine((seattle_lat, seattle_lon), (city_lat, city_lon), unit=haversine.Unit.MILES)
-
-            # Skip if city is too far from Seattle
-            if distance > max_distance_miles:
-                continue
+        # Skip if city is too far from Seattle
+        if i not in near:
+            continue
 
         # Add S_HOOD and L_HOOD properties
         feature["properties"]["S_HOOD"] = city_name
@@ -290,9 +366,7 @@ def fetch_seattle_neighborhoods() -> Dict[str, Any]:
     """
     Fetch Seattle neighborhood map as GeoJSON from the official source.
     """
-    response = requests.get(SEATTLE_NEIGHBORHOODS_ATLAS)
-    response.raise_for_status()
-    return response.json()
+    return fetch_cached(SEATTLE_NEIGHBORHOODS_ATLAS, "seattle_neighborhoods")
 
 
 def combine_geojson_features(seattle_data: Dict[str, Any], city_data: Dict[str, Any]) -> Dict[str, Any]:
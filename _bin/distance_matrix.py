@@ -0,0 +1,251 @@
+"""Batched, cached client for the Google Routes API route matrix.
+
+``computeRouteMatrix`` takes many origins and destinations per request, up to
+a limit on origins x destinations (100 elements for transit), so
+:meth:`MatrixClient.matrix` packs every origin that still needs a duration
+into as few requests as that allows. Requests run on a small thread pool
+behind a shared rate limiter, and are retried with backoff on 429 and 5xx
+responses.
+
+Durations are cached in ``cache/distance_matrix.json`` by origin,
+destination, travel mode and time-of-week bucket (e.g. Saturday 8:30 in
+15-minute buckets, in Seattle time) instead of the exact time, so a weekly
+re-run hits the cache. Entries expire after ``max_age_days`` as timetables change.
+
+``base_url`` points the client at a local stand-in for the API, e.g. to
+exercise it without a key or network.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Sequence
+from zoneinfo import ZoneInfo
+
+import requests
+
+import rcr
+
+ROUTES_URL = "https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix"
+CACHE_PATH = rcr.ROOT / "cache" / "distance_matrix.json"
+# origins x destinations per request; transit matrices are capped lower than the other modes
+MAX_ELEMENTS = {"TRANSIT": 100}
+DEFAULT_MAX_ELEMENTS = 625
+BUCKET_MINUTES = 15
+# naive arrival times, and the time-of-week buckets, are in this zone
+LOCAL_TIMEZONE = ZoneInfo("America/Los_Angeles")
+RETRIES = 3
+RETRY_BACKOFF_S = 1.0  # doubled after each retry
+
+LatLon = tuple[float, float]
+
+
+class DistanceMatrixError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces calls to :meth:`wait` at least ``1 / per_second`` apart, across threads."""
+
+    def __init__(self, per_second: float) -> None:
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def local_time(when: datetime) -> datetime:
+    """``when`` in LOCAL_TIMEZONE; naive times are taken to be local already."""
+    if when.tzinfo is None:
+        return when.replace(tzinfo=LOCAL_TIMEZONE)
+    return when.astimezone(LOCAL_TIMEZONE)
+
+
+def time_bucket(when: datetime) -> str:
+    """Local time-of-week bucket of a time, e.g. ``sat-08:30``."""
+    when = local_time(when)
+    minutes = when.hour * 60 + when.minute
+    minutes -= minutes % BUCKET_MINUTES
+    return f"{when.strftime('%a').lower()}-{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _point_key(point: LatLon) -> str:
+    return f"{point[0]:.5f},{point[1]:.5f}"
+
+
+class MatrixClient:
+    def __init__(self, api_key: str | None = None, base_url: str = ROUTES_URL, workers: int = 4,
+                 requests_per_second: float = 5.0, cache_path: Path | None = CACHE_PATH,
+                 max_age_days: float = 90.0) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.workers = workers
+        self.limiter = RateLimiter(requests_per_second)
+        self.cache_path = cache_path
+        self.max_age_s = max_age_days * 86400
+        self.cache: dict[str, list] = {}
+        self.requests_sent = 0
+        self.cache_hits = 0
+        if cache_path is not None:
+            try:
+                with open(cache_path) as fh:
+                    self.cache = json.load(fh)
+            except (OSError, ValueError):
+                pass
+
+    def _key(self, origin: LatLon, destination: LatLon, mode: str, bucket: str) -> str:
+        return f"{mode}|{_point_key(origin)}|{_point_key(destination)}|{bucket}"
+
+    def matrix(self, origins: Sequence[LatLon], destinations: Sequence[LatLon], arrive_time: datetime,
+               mode: str = "TRANSIT") -> list[list[int | None]]:
+        """Seconds from each origin to each destination arriving by ``arrive_time`` (naive times are Seattle time),
+        None where there is no route. An origin at a destination is 0 s away without asking."""
+        bucket = time_bucket(arrive_time)
+        now = time.time()
+        out: list[list[int | None]] = [[None] * len(destinations) for _ in origins]
+        # origins grouped by the destinations they still need, so each request is a full rectangle
+        needed: dict[tuple[int, ...], list[int]] = {}
+        for i, origin in enumerate(origins):
+            missing = []
+            for j, destination in enumerate(destinations):
+                if _point_key(origin) == _point_key(destination):
+                    out[i][j] = 0
+                    continue
+                cached = self.cache.get(self._key(origin, destination, mode, bucket))
+                if cached is not None and now - cached[1] <= self.max_age_s:
+                    out[i][j] = cached[0]
+                    self.cache_hits += 1
+                else:
+                    missing.append(j)
+            if missing:
+                needed.setdefault(tuple(missing), []).append(i)
+
+        batches = []
+        max_elements = MAX_ELEMENTS.get(mode, DEFAULT_MAX_ELEMENTS)
+        for columns, rows in needed.items():
+            per_request = max(1, max_elements // len(columns))
+            for start in range(0, len(rows), per_request):
+                batches.append((rows[start:start + per_request], list(columns)))
+
+        # durations from every batch that succeeds are cached, even if another one fails
+        error = None
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._request, [origins[i] for i in rows], [destinations[j] for j in columns],
+                                       arrive_time, mode): (rows, columns)
+                           for rows, columns in batches}
+                for future in as_completed(futures):
+                    try:
+                        durations = future.result()
+                    except Exception as exc:
+                        error = error or exc
+                        continue
+                    rows, columns = futures[future]
+                    for (a, b), seconds in durations.items():
+                        i, j = rows[a], columns[b]
+                        out[i][j] = seconds
+                        self.cache[self._key(origins[i], destinations[j], mode, bucket)] = [seconds, now]
+        finally:
+            if batches:
+                self.save()
+        if error is not None:
+            raise error
+        return out
+
+    def _request(self, origins: Sequence[LatLon], destinations: Sequence[LatLon], arrive_time: datetime,
+                 mode: str) -> dict[tuple[int, int], int | None]:
+        arrive_time = local_time(arrive_time)
+        body = {
+            "origins": [{"waypoint": {"location": {"latLng": {"latitude": lat, "longitude": lon}}}}
+                        for lat, lon in origins],
+            "destinations": [{"waypoint": {"location": {"latLng": {"latitude": lat, "longitude": lon}}}}
+                             for lat, lon in destinations],
+            "travelMode": mode,
+            "arrivalTime": arrive_time.astimezone(timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+        headers = {"Content-Type": "application/json",
+                   "X-Goog-FieldMask": "originIndex,destinationIndex,duration,condition"}
+        if self.api_key:
+            headers["X-Goog-Api-Key"] = self.api_key
+
+        for attempt in range(RETRIES + 1):
+            self.limiter.wait()
+            response = requests.post(self.base_url, json=body, headers=headers, timeout=60)
+            self.requests_sent += 1
+            if response.status_code == 200:
+                break
+            if response.status_code != 429 and response.status_code < 500 or attempt == RETRIES:
+                raise DistanceMatrixError(f"Route matrix request failed: {response.status_code} {response.text[:500]}")
+            time.sleep(RETRY_BACKOFF_S * 2 ** attempt)
+
+        durations: dict[tuple[int, int], int | None] = {
+            (a, b): None for a in range(len(origins)) for b in range(len(destinations))}
+        for element in response.json():
+            # elements without a route have no duration; originIndex 0 may be omitted as a default value
+            key = (element.get("originIndex", 0), element.get("destinationIndex", 0))
+            if "duration" in element:
+                durations[key] = int(element["duration"].rstrip("s"))
+        return durations
+
+    def save(self) -> None:
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}")
+        with open(tmp_path, "w") as fh:
+            json.dump(self.cache, fh)
+        os.replace(tmp_path, self.cache_path)
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Print transit durations between locations from the Google Routes API route matrix.",
+    )
+    parser.add_argument("--base-url", default=os.environ.get("ROUTES_API_URL", ROUTES_URL),
+                        help="Route matrix endpoint (default: $ROUTES_API_URL or the Google endpoint).")
+    parser.add_argument("--arrive", type=datetime.fromisoformat, required=True,
+                        help="Arrival time, ISO 8601, e.g. 2026-10-24T08:30 (Seattle time without a UTC offset).")
+    parser.add_argument("--mode", default="TRANSIT", help="Travel mode (default: %(default)s).")
+    parser.add_argument("--origins", nargs="+", required=True, metavar="LOCATION", help="Origin location IDs.")
+    parser.add_argument("--destinations", nargs="+", required=True, metavar="LOCATION",
+                        help="Destination location IDs.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    locations = {loc["id"]: (loc["lat"], loc["lon"]) for loc in rcr.load_loc_db()}
+    unknown = [name for name in args.origins + args.destinations if name not in locations]
+    if unknown:
+        raise SystemExit(f"Unknown locations: {', '.join(unknown)}")
+
+    client = MatrixClient(os.environ.get("GOOGLE_MAPS_API_KEY"), args.base_url)
+    try:
+        rows = client.matrix([locations[name] for name in args.origins],
+                             [locations[name] for name in args.destinations], args.arrive, args.mode)
+    except (DistanceMatrixError, requests.RequestException) as exc:
+        raise SystemExit(str(exc)) from exc
+    for name, row in zip(args.origins, rows):
+        print(name.ljust(16) + "".join(("-" if s is None else f"{math.ceil(s / 60)} min").rjust(10) for s in row))
+    print(f"{client.requests_sent} requests, {client.cache_hits} cached durations")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
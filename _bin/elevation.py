@@ -0,0 +1,445 @@
+"""Elevation lookups for route points, from local DEM rasters or the USGS point service.
+
+A backend maps arrays of latitudes and longitudes to elevations in metres,
+with NaN wherever it has no answer:
+
+  RasterBackend    samples local DEM tiles with bilinear interpolation. Tiles
+                   are GeoTIFFs (uncompressed, single band, in geographic
+                   coordinates, like the USGS 3DEP 1/3 arc-second products
+                   once decompressed with ``gdal_translate -co COMPRESS=NONE``)
+                   or GridFloat ``.flt``/``.hdr`` pairs. Pixels are
+                   memory-mapped, so only the parts of a tile a route
+                   passes over are read, and every point of a route is
+                   sampled in one vectorized pass.
+  ElevationStore   interpolates between elevations already known nearby,
+                   e.g. the points of other routes on the same streets, and
+                   remembers every elevation fetched through it.
+  USGSBackend      queries the USGS Elevation Point Query Service, one HTTP
+                   request per point (cached on disk).
+  FallbackBackend  asks each backend in turn for the points the previous
+                   ones could not answer, e.g. the rasters first and USGS
+                   for anything outside them.
+"""
+
+from __future__ import annotations
+
+import math
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import gpxpy
+import numpy as np
+import requests
+from joblib import Memory
+
+import gis
+
+cache = Memory("cache", verbose=0).cache
+
+RASTER_SUFFIXES = (".tif", ".tiff", ".flt")
+
+# TIFF tags
+_WIDTH, _HEIGHT, _BITS, _COMPRESSION = 256, 257, 258, 259
+_STRIP_OFFSETS, _SAMPLES, _ROWS_PER_STRIP, _STRIP_BYTES = 273, 277, 278, 279
+_TILE_WIDTH, _TILE_HEIGHT, _TILE_OFFSETS, _TILE_BYTES = 322, 323, 324, 325
+_SAMPLE_FORMAT = 339
+_PIXEL_SCALE, _TIEPOINT, _GEOKEYS, _GDAL_NODATA = 33550, 33922, 34735, 42113
+_RASTER_TYPE_GEOKEY, _PIXEL_IS_POINT = 1025, 2
+# TIFF field type -> struct format
+_FIELD_FORMATS = {1: "B", 2: "c", 3: "H", 4: "I", 5: "II", 6: "b", 8: "h", 9: "i", 10: "ii", 11: "f", 12: "d"}
+_SAMPLE_DTYPES = {(1, 8): "u1", (1, 16): "u2", (1, 32): "u4", (2, 8): "i1", (2, 16): "i2", (2, 32): "i4",
+                  (3, 32): "f4", (3, 64): "f8"}
+
+
+class ElevationError(ValueError):
+    """Raised when a DEM file cannot be read or elevations cannot be fetched."""
+
+
+class ElevationBackend:
+    """Source of elevations. Subclasses implement :meth:`elevations`."""
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Elevation in metres at each point, or NaN where this backend has none."""
+        raise NotImplementedError
+
+
+@dataclass
+class DemTile:
+    path: Path
+    # height x width pixels, or (tiles down, tiles across, tile height, tile width) for tiled GeoTIFFs
+    pixels: np.ndarray
+    width: int
+    height: int
+    # lon/lat of the centre of pixel (0, 0) and the pixel size (dy is negative for north-up rasters)
+    x0: float
+    y0: float
+    dx: float
+    dy: float
+    nodata: float | None
+
+    @property
+    def bounds(self) -> tuple[float, float, float, float]:
+        """(west, south, east, north) of the pixel centres; sampling needs a pixel on each side."""
+        xs = (self.x0, self.x0 + (self.width - 1) * self.dx)
+        ys = (self.y0, self.y0 + (self.height - 1) * self.dy)
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def values(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        if self.pixels.ndim == 2:
+            return self.pixels[rows, cols]
+        tile_height, tile_width = self.pixels.shape[2:]
+        return self.pixels[rows // tile_height, cols // tile_width, rows % tile_height, cols % tile_width]
+
+    def sample(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Bilinear interpolation between the four pixel centres around each point.
+
+        Points outside the tile, or next to a no-data pixel, get NaN.
+        """
+        out = np.full(len(lats), np.nan)
+        col = (lons - self.x0) / self.dx
+        row = (lats - self.y0) / self.dy
+        inside = (col >= 0) & (col <= self.width - 1) & (row >= 0) & (row <= self.height - 1)
+        if not inside.any():
+            return out
+        col, row = col[inside], row[inside]
+        c0 = np.minimum(np.floor(col).astype(np.int64), self.width - 2)
+        r0 = np.minimum(np.floor(row).astype(np.int64), self.height - 2)
+        fx, fy = col - c0, row - r0
+        corners = [self.values(r0 + dr, c0 + dc).astype(float) for dr in (0, 1) for dc in (0, 1)]
+        if self.nodata is not None:
+            for corner in corners:
+                corner[corner == self.nodata] = np.nan
+        top = corners[0] * (1 - fx) + corners[1] * fx
+        bottom = corners[2] * (1 - fx) + corners[3] * fx
+        out[inside] = top * (1 - fy) + bottom * fy
+        return out
+
+
+def _read_ifd(data: np.memmap, endian: str) -> dict[int, tuple]:
+    (offset,) = struct.unpack_from(endian + "I", data, 4)
+    (count,) = struct.unpack_from(endian + "H", data, offset)
+    tags = {}
+    for index in range(count):
+        tag, field_type, length, value = struct.unpack_from(endian + "HHI4s", data, offset + 2 + index * 12)
+        if field_type not in _FIELD_FORMATS:
+            continue
+        fmt = endian + _FIELD_FORMATS[field_type] * length
+        size = struct.calcsize(fmt)
+        source, start = (value, 0) if size <= 4 else (data, struct.unpack(endian + "I", value)[0])
+        values = struct.unpack_from(fmt, source, start)
+        tags[tag] = (b"".join(values).rstrip(b"\0").decode("ascii"),) if field_type == 2 else values
+    return tags
+
+
+def _contiguous(offsets: Sequence[int], byte_counts: Sequence[int]) -> bool:
+    return all(offsets[i] + byte_counts[i] == offsets[i + 1] for i in range(len(offsets) - 1))
+
+
+def load_geotiff(path: Path) -> DemTile:
+    """Memory-map a single-band, uncompressed GeoTIFF in geographic coordinates."""
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    endian = {b"II": "<", b"MM": ">"}.get(bytes(data[:2]))
+    if endian is None or struct.unpack_from(endian + "H", data, 2)[0] != 42:
+        raise ElevationError(f"{path} is not a (classic, non-BigTIFF) TIFF file")
+    tags = _read_ifd(data, endian)
+
+    def tag(number: int, default=None):
+        return tags.get(number, (default,))[0]
+
+    if tag(_COMPRESSION, 1) != 1:
+        raise ElevationError(f"{path} is compressed; decompress it first, e.g. gdal_translate -co COMPRESS=NONE")
+    if tag(_SAMPLES, 1) != 1:
+        raise ElevationError(f"{path} has more than one band")
+    dtype = _SAMPLE_DTYPES.get((tag(_SAMPLE_FORMAT, 1), tag(_BITS)))
+    if dtype is None:
+        raise ElevationError(f"{path} has an unsupported sample type")
+    dtype = np.dtype(endian + dtype)
+    if _PIXEL_SCALE not in tags or _TIEPOINT not in tags:
+        raise ElevationError(f"{path} has no GeoTIFF georeferencing (pixel scale and tiepoint)")
+
+    width, height = tag(_WIDTH), tag(_HEIGHT)
+    if _TILE_OFFSETS in tags:
+        offsets, byte_counts = tags[_TILE_OFFSETS], tags[_TILE_BYTES]
+        tile_width, tile_height = tag(_TILE_WIDTH), tag(_TILE_HEIGHT)
+        shape = (math.ceil(height / tile_height), math.ceil(width / tile_width), tile_height, tile_width)
+    else:
+        offsets, byte_counts = tags[_STRIP_OFFSETS], tags[_STRIP_BYTES]
+        shape = (height, width)
+    if not _contiguous(offsets, byte_counts):
+        raise ElevationError(f"{path} stores its pixels out of order; rewrite it with gdal_translate")
+    pixels = np.memmap(path, dtype=dtype, mode="r", offset=offsets[0], shape=shape)
+
+    scale_x, scale_y = tags[_PIXEL_SCALE][:2]
+    i, j, _k, x, y = tags[_TIEPOINT][:5]
+    geokeys = tags.get(_GEOKEYS, ())
+    keys = {geokeys[n]: geokeys[n + 3] for n in range(4, len(geokeys) - 3, 4)}
+    # by default the tiepoint is the corner of its pixel, not its centre
+    half = 0.0 if keys.get(_RASTER_TYPE_GEOKEY) == _PIXEL_IS_POINT else 0.5
+    nodata = tag(_GDAL_NODATA)
+    return DemTile(
+        path, pixels, width, height,
+        x0=x + (half - i) * scale_x,
+        y0=y - (half - j) * scale_y,
+        dx=scale_x,
+        dy=-scale_y,
+        nodata=float(nodata) if nodata not in (None, "") else None,
+    )
+
+
+def load_gridfloat(path: Path) -> DemTile:
+    """Memory-map a GridFloat raster: ``path`` (.flt) plus the ``.hdr`` header next to it."""
+    header_path = path.with_suffix(".hdr")
+    try:
+        header = dict(line.split(None, 1) for line in header_path.read_text().splitlines() if line.strip())
+    except (OSError, ValueError) as exc:
+        raise ElevationError(f"Could not read the header {header_path}: {exc}") from exc
+    header = {key.lower(): value.strip() for key, value in header.items()}
+    try:
+        width, height = int(header["ncols"]), int(header["nrows"])
+        size = float(header["cellsize"])
+        if "xllcenter" in header:
+            x0, south = float(header["xllcenter"]), float(header["yllcenter"])
+        else:
+            x0, south = float(header["xllcorner"]) + size / 2, float(header["yllcorner"]) + size / 2
+    except (KeyError, ValueError) as exc:
+        raise ElevationError(f"{header_path} is missing or has an invalid {exc}") from exc
+    endian = ">" if header.get("byteorder", "LSBFIRST").upper() == "MSBFIRST" else "<"
+    pixels = np.memmap(path, dtype=np.dtype(endian + "f4"), mode="r", shape=(height, width))
+    nodata = header.get("nodata_value")
+    return DemTile(path, pixels, width, height, x0=x0, y0=south + (height - 1) * size, dx=size, dy=-size,
+                   nodata=float(nodata) if nodata is not None else None)
+
+
+def load_tile(path: Path) -> DemTile:
+    if path.suffix.lower() == ".flt":
+        return load_gridfloat(path)
+    return load_geotiff(path)
+
+
+def raster_paths(paths: Iterable[Path]) -> list[Path]:
+    """The DEM files among ``paths``, expanding directories to the rasters inside them."""
+    found = []
+    for path in paths:
+        if path.is_dir():
+            found.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in RASTER_SUFFIXES))
+        elif path.suffix.lower() in RASTER_SUFFIXES:
+            found.append(path)
+        else:
+            raise ElevationError(f"{path} is not a GeoTIFF (.tif) or GridFloat (.flt) DEM")
+    return found
+
+
+class RasterBackend(ElevationBackend):
+    """Bilinear samples from local DEM tiles; where tiles overlap, the first listed wins."""
+
+    def __init__(self, paths: Iterable[Path]):
+        self.tiles = [load_tile(path) for path in raster_paths(paths)]
+        if not self.tiles:
+            raise ElevationError("No DEM tiles found")
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        out = np.full(len(lats), np.nan)
+        if not len(lats):
+            return out
+        west, south, east, north = lons.min(), lats.min(), lons.max(), lats.max()
+        for tile in self.tiles:
+            tile_west, tile_south, tile_east, tile_north = tile.bounds
+            # skip tiles that don't overlap the route's bounding box without touching their pixels
+            if tile_west > east or tile_east < west or tile_south > north or tile_north < south:
+                continue
+            missing = np.isnan(out)
+            if not missing.any():
+                break
+            out[missing] = tile.sample(lats[missing], lons[missing])
+        return out
+
+
+class ElevationStore(ElevationBackend):
+    """Known elevations with a grid index, answering points within ``radius_m`` of them.
+
+    Points with samples in range get the inverse-distance-weighted mean of
+    those samples; the rest get NaN and are left to the next backend, or are
+    fetched from one by :meth:`lookup`. The grid cells are ``radius_m``
+    wide, so a point's samples are all in its own and the 8 neighbouring
+    cells. Lookups and hits are counted for :meth:`hit_rate`.
+
+    Only fetched samples (and those loaded from a previous :meth:`save`) are
+    saved; samples added from GPX files are re-read each run, so replacing a
+    route's elevations never reuses its own old values.
+    """
+
+    def __init__(self, radius_m: float = 10.0, latitude: float = 47.6):
+        if radius_m <= 0:
+            raise ElevationError("The elevation reuse radius must be positive")
+        self.radius_m = radius_m
+        self.ky = math.radians(1) * gis.EARTH_RADIUS_M
+        self.kx = self.ky * math.cos(math.radians(latitude))
+        self.xs: list[float] = []
+        self.ys: list[float] = []
+        self.eles: list[float] = []
+        self.saved: list[bool] = []
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self.eles)
+
+    def add(self, lats: Iterable[float], lons: Iterable[float], eles: Iterable[float], save: bool = False) -> None:
+        """Remember elevations, to be written by :meth:`save` if ``save``; NaN elevations are skipped."""
+        for lat, lon, ele in zip(lats, lons, eles):
+            if ele is None or math.isnan(ele):
+                continue
+            x, y = lon * self.kx, lat * self.ky
+            cell = (math.floor(x / self.radius_m), math.floor(y / self.radius_m))
+            self.cells.setdefault(cell, []).append(len(self.eles))
+            self.xs.append(x)
+            self.ys.append(y)
+            self.eles.append(float(ele))
+            self.saved.append(save)
+
+    def add_gpx(self, paths: Iterable[Path]) -> None:
+        """Remember the elevations of every track point and waypoint in the GPX files."""
+        for path in paths:
+            with open(path, "r") as f:
+                gpx = gpxpy.parse(f)
+            points = [point for track in gpx.tracks for segment in track.segments for point in segment.points]
+            points += gpx.waypoints
+            points = [point for point in points if point.elevation is not None]
+            self.add([p.latitude for p in points], [p.longitude for p in points], [p.elevation for p in points])
+
+    def load(self, path: Path) -> None:
+        """Add the samples saved by :meth:`save`, if ``path`` exists."""
+        if path.is_file():
+            with np.load(path) as saved:
+                self.add(saved["lat"].tolist(), saved["lon"].tolist(), saved["ele"].tolist(), save=True)
+
+    def save(self, path: Path) -> None:
+        keep = np.array(self.saved, dtype=bool)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, lat=np.array(self.ys)[keep] / self.ky, lon=np.array(self.xs)[keep] / self.kx,
+                            ele=np.array(self.eles)[keep])
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        out = np.full(len(lats), np.nan)
+        xs_known, ys_known, eles_known = np.array(self.xs), np.array(self.ys), np.array(self.eles)
+        for index, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+            x, y = lon * self.kx, lat * self.ky
+            i, j = math.floor(x / self.radius_m), math.floor(y / self.radius_m)
+            candidates = [n for di in (-1, 0, 1) for dj in (-1, 0, 1) for n in self.cells.get((i + di, j + dj), ())]
+            if not candidates:
+                continue
+            distances = np.hypot(xs_known[candidates] - x, ys_known[candidates] - y)
+            near = distances <= self.radius_m
+            if not near.any():
+                continue
+            distances, eles = distances[near], eles_known[candidates][near]
+            if distances.min() < 0.01:
+                out[index] = eles[distances.argmin()]
+            else:
+                weights = 1 / distances ** 2
+                out[index] = float(np.dot(weights, eles) / weights.sum())
+        self.lookups += len(lats)
+        self.hits += int(np.count_nonzero(~np.isnan(out)))
+        return out
+
+    def lookup(self, lats: np.ndarray, lons: np.ndarray, fallback: ElevationBackend) -> np.ndarray:
+        """Elevations from the store where possible, fetching (and remembering) the rest from ``fallback``."""
+        out = self.elevations(lats, lons)
+        missing = np.isnan(out)
+        if missing.any():
+            fetched = fallback.elevations(lats[missing], lons[missing])
+            self.add(lats[missing].tolist(), lons[missing].tolist(), fetched.tolist(), save=True)
+            out[missing] = fetched
+        return out
+
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+# joblib keys its cache on where the function lives and on its exact source, so this is kept
+# byte-for-byte as it was in replace_route_elevations.py; migrate_usgs_cache() moves the
+# responses cached under that script into this module's cache directory
+@cache
+def query_usgs_elevation(lat, lon, wait_time=0.0):
+    url = f'https://epqs.nationalmap.gov/v1/json'
+    params = {
+        'x': lon,
+        'y': lat,
+        'units': 'Meters',
+    }
+
+    # Use this param to avoid slamming the server
+    time.sleep(wait_time)
+
+    # sometimes the USGS server returns a 200 but with an empty body?!
+    # hypothesis: this is some kind of bad rate limiting
+    resp = requests.get(url, params=params)
+    try:
+        return float(resp.json()['value'])
+    except Exception as e:
+        print(f"Error querying elevation for {lat}, {lon}")
+        print(f"Exception: {e}")
+        print(f"Response code: {resp.status_code} ({resp.reason})")
+        print(f"Response text: {resp.text}")
+        print(f"Response content: {resp.content}")
+        print(f"Consider waiting an hour and increasing --wait")
+        sys.exit(1)
+
+
+def migrate_usgs_cache(location: Path = Path("cache")) -> int:
+    """Move USGS responses cached when query_usgs_elevation lived in replace_route_elevations.py.
+
+    joblib filed those under the script's path (as ``__main__--<path>-replace_route_elevations``);
+    they're moved, not copied, into this module's directory. Returns the number of entries moved.
+    """
+    root = location / "joblib"
+    new_dir = root / "elevation" / "query_usgs_elevation"
+    moved = 0
+    for old_dir in root.glob("*replace_route_elevations/query_usgs_elevation"):
+        new_dir.mkdir(parents=True, exist_ok=True)
+        for entry in old_dir.iterdir():
+            # the cached source (func_code.py) is identical, so it is valid for the new location too
+            if not (new_dir / entry.name).exists():
+                entry.rename(new_dir / entry.name)
+                moved += entry.name != "func_code.py"
+    return moved
+
+
+class USGSBackend(ElevationBackend):
+    """The USGS Elevation Point Query Service, one (cached) request per point."""
+
+    def __init__(self, wait_time: float = 0.0, progress: bool = True):
+        self.wait_time = wait_time
+        self.progress = progress
+        moved = migrate_usgs_cache()
+        if moved:
+            print(f"Moved {moved} cached USGS elevations from replace_route_elevations.py's cache")
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        points = zip(lats.tolist(), lons.tolist())
+        if self.progress:
+            import tqdm
+            points = tqdm.tqdm(points, total=len(lats))
+        return np.array([query_usgs_elevation(lat, lon, wait_time=self.wait_time) for lat, lon in points],
+                        dtype=float)
+
+
+class FallbackBackend(ElevationBackend):
+    """Each backend in turn, for the points the ones before it had no elevation for."""
+
+    def __init__(self, backends: Sequence[ElevationBackend]):
+        self.backends = list(backends)
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        out = np.full(len(lats), np.nan)
+        for backend in self.backends:
+            missing = np.isnan(out)
+            if not missing.any():
+                break
+            out[missing] = backend.elevations(lats[missing], lons[missing])
+        return out
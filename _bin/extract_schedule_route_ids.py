@@ -8,6 +8,8 @@ from typing import Any, Sequence
 
 import yaml
 
+import rcr
+
 
 class ScheduleError(ValueError):
     """Raised when a schedule file is missing required data."""
@@ -45,8 +47,7 @@ def load_schedule(path: Path) -> list[dict[str, Any]]:
         raise ScheduleError(f"Schedule path is not a file: {path}")
 
     try:
-        with path.open("r", encoding="utf-8") as fh:
-            data = yaml.safe_load(fh)
+        data = rcr.load_yaml(path)
     except yaml.YAMLError as exc:
         raise ScheduleError(f"Failed to parse YAML from {path}: {exc}") from exc
 
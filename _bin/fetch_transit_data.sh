@@ -15,18 +15,25 @@ LIGHT_RAIL_PATH=https://www.soundtransit.org/GTFS-rail/40_gtfs.zip
 BUS_PATH=https://www.soundtransit.org/GTFS-KCM/google_transit.zip
 FERRY_PATH=https://gtfs.sound.obaweb.org/prod/95_gtfs.zip
 
-mkdir -p $SCRIPT_DIR/tmp/ $SCRIPT_DIR/../routes/transit_data/
+# full feeds, for offline travel times (gtfs.py); stops.txt of each also goes in transit_data/<system>.csv.
+# The feeds are hundreds of MB, so they go under an underscore directory Jekyll doesn't publish
+GTFS_DIR=$SCRIPT_DIR/../routes/_transit_data/gtfs
+
+mkdir -p $SCRIPT_DIR/tmp/ $SCRIPT_DIR/../routes/transit_data/ $GTFS_DIR
 
 wget -c $FERRY_PATH -O $SCRIPT_DIR/tmp/ferry.zip
 unzip -o $SCRIPT_DIR/tmp/ferry.zip -d $SCRIPT_DIR/tmp/ferry
+rm -rf $GTFS_DIR/ferry && cp -r $SCRIPT_DIR/tmp/ferry $GTFS_DIR/ferry
 mv $SCRIPT_DIR/tmp/ferry/stops.txt $SCRIPT_DIR/../routes/transit_data/ferry.csv
 
 wget -c $BUS_PATH -O $SCRIPT_DIR/tmp/bus.zip
 unzip -o $SCRIPT_DIR/tmp/bus.zip -d $SCRIPT_DIR/tmp/bus
+rm -rf $GTFS_DIR/bus && cp -r $SCRIPT_DIR/tmp/bus $GTFS_DIR/bus
 mv $SCRIPT_DIR/tmp/bus/stops.txt $SCRIPT_DIR/../routes/transit_data/bus.csv
 
 wget -c $LIGHT_RAIL_PATH -O $SCRIPT_DIR/tmp/light_rail.zip
 unzip -o $SCRIPT_DIR/tmp/light_rail.zip -d $SCRIPT_DIR/tmp/light_rail
+rm -rf $GTFS_DIR/light_rail && cp -r $SCRIPT_DIR/tmp/light_rail $GTFS_DIR/light_rail
 mv $SCRIPT_DIR/tmp/light_rail/stops.txt $SCRIPT_DIR/../routes/transit_data/light_rail.csv
 
 rm -rf $SCRIPT_DIR/tmp/
\ No newline at end of file
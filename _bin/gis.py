@@ -1,7 +1,9 @@
 import math
+import re
 
 import gpxpy.gpx
 import haversine
+import numpy as np
 from gpxpy.gpx import GPXTrackPoint
 from typing import List, Callable
 
@@ -38,6 +40,87 @@ def get_nearest_loc(locs, lat, lon):
     return nearest['id'], nearest_dist
 
 
+class PointIndex:
+    # Grid index of (lat, lon) points for nearest-point and radius queries. Points are bucketed into square
+    # cells ``cell_m`` wide on a local equirectangular plane, so a query only measures the points in the
+    # cells around it. Distances are haversine metres.
+
+    def __init__(self, points, cell_m=250.0):
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        self.cell_m = cell_m
+        lat0 = math.radians(sum(lat for lat, _ in self.points) / len(self.points)) if self.points else 0.0
+        self.kx = math.radians(1) * EARTH_RADIUS_M * math.cos(lat0)
+        self.ky = math.radians(1) * EARTH_RADIUS_M
+        self.cells = {}
+        for i, (lat, lon) in enumerate(self.points):
+            self.cells.setdefault(self._cell(lat, lon), []).append(i)
+        # extent of the occupied cells, so nearest() knows when no ring further out can hold a point
+        self.bounds = (min((i for i, _ in self.cells), default=0), max((i for i, _ in self.cells), default=0),
+                       min((j for _, j in self.cells), default=0), max((j for _, j in self.cells), default=0))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, lat, lon):
+        return math.floor(lon * self.kx / self.cell_m), math.floor(lat * self.ky / self.cell_m)
+
+    def _ring(self, cell, r):
+        # indices of the points in the cells exactly r cells (in either direction) from ``cell``,
+        # skipping the part of the ring outside the occupied cells
+        i, j = cell
+        min_i, max_i, min_j, max_j = self.bounds
+        for di in range(max(-r, min_i - i), min(r, max_i - i) + 1):
+            if abs(di) == r:
+                columns = range(max(-r, min_j - j), min(r, max_j - j) + 1)
+            else:
+                columns = [dj for dj in (-r, r) if min_j <= j + dj <= max_j]
+            for dj in columns:
+                yield from self.cells.get((i + di, j + dj), ())
+
+    def _distance(self, lat, lon, i):
+        return haversine.haversine((lat, lon), self.points[i], unit=haversine.Unit.METERS)
+
+    def within(self, lat, lon, radius_m, k=None):
+        # (distance, index) of the points within ``radius_m`` of (lat, lon), nearest first; at most ``k``
+        cell = self._cell(lat, lon)
+        found = []
+        for r in range(math.ceil(radius_m / self.cell_m) + 1):
+            for i in self._ring(cell, r):
+                distance = self._distance(lat, lon, i)
+                if distance <= radius_m:
+                    found.append((distance, i))
+        found.sort()
+        return found[:k] if k is not None else found
+
+    def nearest(self, lat, lon, max_m=math.inf):
+        # (distance, index) of the point nearest (lat, lon), or None if there is none within ``max_m``.
+        # Rings of cells are searched outwards until the nearest point found so far is closer than
+        # anything further out could be: a point r + 1 rings out is at least r cells away.
+        cell = self._cell(lat, lon)
+        min_i, max_i, min_j, max_j = self.bounds
+        # rings closer than the occupied cells are empty, and none beyond them hold anything
+        r = max(min_i - cell[0], cell[0] - max_i, min_j - cell[1], cell[1] - max_j, 0)
+        last_ring = max(abs(cell[0] - min_i), abs(cell[0] - max_i), abs(cell[1] - min_j), abs(cell[1] - max_j))
+        best = None
+        while self.points and r <= last_ring and r * self.cell_m <= max_m + self.cell_m:
+            for i in self._ring(cell, r):
+                distance = self._distance(lat, lon, i)
+                if distance <= max_m and (best is None or (distance, i) < best):
+                    best = (distance, i)
+            if best is not None and best[0] <= r * self.cell_m:
+                break
+            r += 1
+        return best
+
+    def nearest_all(self, queries, max_m=math.inf):
+        # nearest() for every (lat, lon) in ``queries``
+        return [self.nearest(lat, lon, max_m) for lat, lon in queries]
+
+    def within_all(self, queries, radius_m, k=None):
+        # within() for every (lat, lon) in ``queries``
+        return [self.within(lat, lon, radius_m, k) for lat, lon in queries]
+
+
 def out_and_backness(route: list[GPXTrackPoint]):
     # Calculate cumulative distances
     cumulative_distances = [0]
@@ -104,3 +187,186 @@ def is_point_in_polygon(x, y, geometry):
 
 def is_point_in_bbox(x, y, bbox):
     return bbox[0] <= x <= bbox[1] and bbox[2] <= y <= bbox[3]
+
+
+# Trailing zeros (and a bare trailing ".") of fixed-point numbers inside a JSON array
+_TRAILING_ZEROS = re.compile(r"\.0+(?=[,\]])|(\.\d*?[1-9])0+(?=[,\]])")
+
+
+def coordinates_json(coordinates, precision=5, elevation_precision=2):
+    # Format every position with a fixed number of decimals in a single %-format call, which is much
+    # cheaper than rounding each float and taking its repr, then drop the zeros the fixed format pads with
+    if not coordinates:
+        return "[]"
+    position_2d = f"[%.{precision}f,%.{precision}f]"
+    position_3d = f"[%.{precision}f,%.{precision}f,%.{elevation_precision}f]"
+    template = ",".join([position_3d if len(c) > 2 else position_2d for c in coordinates])
+    values = tuple(v for c in coordinates for v in c[:3])
+    return "[" + _TRAILING_ZEROS.sub(r"\1", template % values) + "]"
+
+
+def encode_polyline(points, precision=5):
+    # Google's encoded polyline algorithm, generalised to any number of dimensions per point:
+    # each value is scaled to an integer, delta-encoded against the previous point and written as
+    # zigzag-encoded 5-bit chunks offset into printable ASCII
+    scale = 10 ** precision
+    previous = None
+    chunks = []
+    for point in points:
+        # Round in decimal first so values agree with coordinates_json at ties like 47.647715
+        current = [round(round(v, precision) * scale) for v in point]
+        deltas = current if previous is None else [c - p for c, p in zip(current, previous)]
+        previous = current
+        for delta in deltas:
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def decode_polyline(encoded, precision=5, dimensions=2):
+    scale = 10 ** precision
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    points = []
+    current = [0] * dimensions
+    for i in range(0, len(values) - dimensions + 1, dimensions):
+        current = [c + d for c, d in zip(current, values[i:i + dimensions])]
+        points.append([c / scale for c in current])
+    return points
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat, lon, lats, lons):
+    # Haversine metres from one point to each of the points in the arrays ``lats`` and ``lons``, in one
+    # vectorized pass; haversine.haversine does one pair at a time
+    phi, phis = math.radians(lat), np.radians(lats)
+    a = (np.sin((phis - phi) / 2) ** 2
+         + math.cos(phi) * np.cos(phis) * np.sin(np.radians(lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def douglas_peucker(xs, ys, tolerance):
+    # Douglas-Peucker over planar points, returning which points to keep. Distances are to the segment
+    # rather than the infinite line so loops, whose first and last points coincide, simplify correctly.
+    n = len(xs)
+    if n < 3:
+        return [True] * n
+    tolerance_sq = tolerance * tolerance
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length_sq = dx * dx + dy * dy
+        max_sq, index = -1.0, first
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            t = (px * dx + py * dy) / length_sq if length_sq else 0.0
+            if t < 0.0:
+                t = 0.0
+            elif t > 1.0:
+                t = 1.0
+            ex, ey = px - t * dx, py - t * dy
+            dist_sq = ex * ex + ey * ey
+            if dist_sq > max_sq:
+                max_sq, index = dist_sq, i
+        if max_sq > tolerance_sq:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return keep
+
+
+def simplify_line(coordinates, tolerance_m):
+    # Simplify [lon, lat(, ele)] positions with the tolerance in metres. Positions are projected onto a
+    # local equirectangular plane, which is accurate to well under a metre at the scale of a route.
+    if len(coordinates) < 3:
+        return list(coordinates)
+    lat0 = math.radians(sum(c[1] for c in coordinates) / len(coordinates))
+    kx = math.radians(1) * EARTH_RADIUS_M * math.cos(lat0)
+    ky = math.radians(1) * EARTH_RADIUS_M
+    keep = douglas_peucker([c[0] * kx for c in coordinates], [c[1] * ky for c in coordinates], tolerance_m)
+    return [c for c, kept in zip(coordinates, keep) if kept]
+
+
+def max_zoom_for_tolerance(tolerance_m, latitude=47.6):
+    # Highest web-map zoom at which a line simplified to ``tolerance_m`` stays within about a pixel of
+    # the original: the ground resolution at zoom z is 2*pi*R*cos(lat) / (256 * 2**z) metres per pixel
+    metres_per_pixel_z0 = 2 * math.pi * EARTH_RADIUS_M * math.cos(math.radians(latitude)) / 256
+    return max(0, math.floor(math.log2(metres_per_pixel_z0 / tolerance_m)))
+
+
+def cumulative_distances(coordinates):
+    # Distance in metres from the start to each [lon, lat, ...] position
+    distances = [0.0]
+    for a, b in zip(coordinates, coordinates[1:]):
+        distances.append(distances[-1] + haversine.haversine((a[1], a[0]), (b[1], b[0]), unit=haversine.Unit.METERS))
+    return distances
+
+
+def resample_uniform(xs, ys, step):
+    # Linearly interpolate ys at every multiple of ``step`` along the increasing xs (plus the last x)
+    if not xs:
+        return [], []
+    out_x, out_y = [], []
+    i = 0
+    target = xs[0]
+    while target < xs[-1]:
+        while xs[i + 1] < target:
+            i += 1
+        span = xs[i + 1] - xs[i]
+        t = (target - xs[i]) / span if span else 0.0
+        out_x.append(target)
+        out_y.append(ys[i] + t * (ys[i + 1] - ys[i]))
+        target += step
+    out_x.append(xs[-1])
+    out_y.append(ys[-1])
+    return out_x, out_y
+
+
+def lttb(xs, ys, threshold):
+    # Largest-Triangle-Three-Buckets downsampling: keeps the first and last points, and from each of
+    # threshold - 2 equal buckets in between the point forming the largest triangle with the point kept
+    # from the previous bucket and the average of the next bucket. Preserves peaks and dips far better
+    # than taking every nth point.
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(xs), list(ys)
+    bucket_size = (n - 2) / (threshold - 2)
+    out_x, out_y = [xs[0]], [ys[0]]
+    a = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, n)
+        if end >= next_end:
+            avg_x, avg_y = xs[-1], ys[-1]
+        else:
+            avg_x = sum(xs[end:next_end]) / (next_end - end)
+            avg_y = sum(ys[end:next_end]) / (next_end - end)
+        ax, ay = xs[a], ys[a]
+        best_area, best = -1.0, start
+        for i in range(start, end):
+            area = abs((ax - avg_x) * (ys[i] - ay) - (ax - xs[i]) * (avg_y - ay))
+            if area > best_area:
+                best_area, best = area, i
+        out_x.append(xs[best])
+        out_y.append(ys[best])
+        a = best
+    out_x.append(xs[-1])
+    out_y.append(ys[-1])
+    return out_x, out_y
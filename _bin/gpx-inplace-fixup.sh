@@ -12,14 +12,19 @@ while [ -L "$src" ]; do
 done
 SDIR="$(cd -P "$(dirname "$src")" && pwd)"
 
-# parse optional --wait argument
+# parse optional --wait and --dem arguments
 WAIT=""
+DEM=""
 while [[ $# -gt 0 ]]; do
   case $1 in
     --wait)
       WAIT="$2"
       shift 2
       ;;
+    --dem)
+      DEM="$2"
+      shift 2
+      ;;
     *)
       GPX_FILE="$1"
       shift
@@ -46,7 +51,7 @@ if [[ "$GPX_FILE" != *.gpx ]]; then
 fi
 
 # inject the elevation data into the GPX file
-uv run python3 ${SDIR}/replace_route_elevations.py ${WAIT:+--wait "$WAIT"} --normalize-after --input "$GPX_FILE" --output "$GPX_FILE"
+uv run python3 ${SDIR}/replace_route_elevations.py ${WAIT:+--wait "$WAIT"} ${DEM:+--dem "$DEM"} --normalize-after --input "$GPX_FILE" --output "$GPX_FILE"
 
 # add surface metadata to the GPX file
 uv run python3 ${SDIR}/add_surface_to_gpx.py --input "$GPX_FILE" --output "$GPX_FILE"
@@ -1,6 +1,8 @@
 import argparse
 import json
 import pathlib
+
+import gis
 import rcr
 
 def route_geojson(route):
@@ -31,8 +33,21 @@ def route_geojson(route):
         },
     }
 
+def polyline_geojson(geojson, precision=5, elevation_precision=2):
+    # Variant of the feature with the geometry replaced by encoded polylines (lat/lon, and elevation
+    # in its own 1-D polyline when every point has one), several times smaller than coordinate arrays
+    coordinates = geojson['geometry']['coordinates']
+    properties = dict(geojson['properties'])
+    properties['polyline'] = gis.encode_polyline([(c[1], c[0]) for c in coordinates], precision)
+    properties['polyline_precision'] = precision
+    if coordinates and all(len(c) > 2 for c in coordinates):
+        properties['elevation_polyline'] = gis.encode_polyline([(c[2],) for c in coordinates], elevation_precision)
+        properties['elevation_polyline_precision'] = elevation_precision
+    return {**geojson, 'properties': properties, 'geometry': None}
+
+
 # Whitespace characters end up being around half the file size if we do normal indentation for coordinates arrays
-def dump_geojson_with_compact_geometry(geojson, f):
+def dump_geojson_with_compact_geometry(geojson, f, precision=5, elevation_precision=2):
     # Create a copy of the feature without the geometry
     feature_copy = geojson.copy()
     geometry = feature_copy.pop('geometry')
@@ -40,15 +55,96 @@ def dump_geojson_with_compact_geometry(geojson, f):
     # Dump the feature without geometry
     f.write(json.dumps(feature_copy, indent=2)[:-2])  # Remove the closing `}` of the feature
 
-    # Add the compact geometry inside the feature
-    compact_geometry = json.dumps(geometry, separators=(',', ':'))
+    # Add the compact geometry inside the feature, with coordinates at a fixed precision
+    if geometry is None:
+        compact_geometry = 'null'
+    else:
+        coordinates = gis.coordinates_json(geometry['coordinates'], precision, elevation_precision)
+        compact_geometry = f'{{"type":{json.dumps(geometry["type"])},"coordinates":{coordinates}}}'
     f.write(f', "geometry":{compact_geometry}\n}}')
 
 
+def lod_level_name(tolerance_m):
+    return f"{tolerance_m:g}m"
+
+
+def simplified_geojson(geojson, tolerance_m):
+    geometry = geojson['geometry']
+    coordinates = gis.simplify_line(geometry['coordinates'], tolerance_m)
+    return {**geojson, 'geometry': {**geometry, 'coordinates': coordinates}}
+
+
+def write_lod_manifest(lod_dir, tolerances):
+    # Levels are listed coarsest first, each with the highest zoom it still looks right at, so maps
+    # can draw the first level straight away and fetch finer ones as the user zooms in
+    manifest = {
+        'levels': [
+            {'name': lod_level_name(t), 'tolerance_m': t, 'max_zoom': gis.max_zoom_for_tolerance(t)}
+            for t in sorted(tolerances, reverse=True)
+        ],
+    }
+    path = lod_dir / 'manifest.json'
+    text = json.dumps(manifest, indent=2) + '\n'
+    # Every conversion rewrites the manifest; leave it untouched (and its mtime alone) if nothing changed
+    if not path.is_file() or path.read_text() != text:
+        path.write_text(text)
+
+
+def route_profile(geojson, step_m=10, max_points=300, grade_window_m=100):
+    # Compact elevation profile for charts: elevation resampled every ``step_m`` metres along the route,
+    # downsampled with LTTB to at most ``max_points``, plus summary statistics. Grades are measured over
+    # ``grade_window_m`` so GPS and DEM noise between neighbouring points doesn't dominate them.
+    coordinates = geojson['geometry']['coordinates']
+    if len(coordinates) < 2 or not all(len(c) > 2 for c in coordinates):
+        return None
+    elevations = [c[2] for c in coordinates]
+    distances, resampled = gis.resample_uniform(gis.cumulative_distances(coordinates), elevations, step_m)
+    chart_x, chart_y = gis.lttb(distances, resampled, max_points)
+
+    window = max(1, round(grade_window_m / step_m))
+    grades = [
+        (resampled[i + window] - resampled[i]) / (distances[i + window] - distances[i])
+        for i in range(len(resampled) - window)
+        if distances[i + window] > distances[i]
+    ]
+    return {
+        'id': geojson['properties']['id'],
+        'distance_m': round(distances[-1], 1),
+        'min_m': round(min(elevations), 1),
+        'max_m': round(max(elevations), 1),
+        'ascent_m': round(sum(max(0., b - a) for a, b in zip(elevations, elevations[1:])), 1),
+        'descent_m': round(sum(max(0., a - b) for a, b in zip(elevations, elevations[1:])), 1),
+        'max_grade_pct': round(100 * max(grades, default=0.), 1),
+        'min_grade_pct': round(100 * min(grades, default=0.), 1),
+        'mean_abs_grade_pct': round(100 * sum(map(abs, grades)) / len(grades), 1) if grades else 0.,
+        # Parallel arrays: distance from the start (m) and elevation (m) of each chart point
+        'd': [round(x) for x in chart_x],
+        'e': [round(y, 1) for y in chart_y],
+    }
+
+
 def main():
     parser = argparse.ArgumentParser(description="Convert RCR Route GPX to GeoJSON.")
     parser.add_argument("--input", required=True, nargs="+", help="Input GPX file(s).")
     parser.add_argument("--output", required=True, nargs="+", help="Output GPX file(s).")
+    parser.add_argument("--precision", type=int, default=5,
+                        help="Decimal places for longitude/latitude (default: %(default)s, about a metre).")
+    parser.add_argument("--elevation-precision", type=int, default=2,
+                        help="Decimal places for elevations in metres (default: %(default)s).")
+    parser.add_argument("--encoding", choices=["coordinates", "polyline"], default="coordinates",
+                        help="Write the geometry as a GeoJSON coordinate array, or as encoded polylines "
+                             "in the feature's properties (default: %(default)s).")
+    parser.add_argument("--lod-dir", type=pathlib.Path,
+                        help="Also write simplified level-of-detail copies of each route to "
+                             "LOD_DIR/<tolerance>m/, plus LOD_DIR/manifest.json describing the levels.")
+    parser.add_argument("--lod-tolerances", type=float, nargs="+", default=[1, 5, 25],
+                        help="Simplification tolerances in metres for --lod-dir (default: %(default)s).")
+    parser.add_argument("--profile-dir", type=pathlib.Path,
+                        help="Also write a compact elevation profile of each route to PROFILE_DIR/<id>.json.")
+    parser.add_argument("--profile-step", type=float, default=10,
+                        help="Resampling interval in metres for --profile-dir (default: %(default)s).")
+    parser.add_argument("--profile-points", type=int, default=300,
+                        help="Maximum number of chart points in each profile (default: %(default)s).")
     args = parser.parse_args()
 
     if len(args.input) != len(args.output):
@@ -56,8 +152,31 @@ def main():
 
     for inpath, outpath in zip(args.input, args.output):
         route = rcr.load_route(pathlib.Path(inpath))
-        with open(outpath, 'w') as f:
-            dump_geojson_with_compact_geometry(route_geojson(route), f)
+        variants = [(pathlib.Path(outpath), route_geojson(route))]
+        if args.lod_dir:
+            for tolerance in args.lod_tolerances:
+                lod_path = args.lod_dir / lod_level_name(tolerance) / pathlib.Path(outpath).name
+                variants.append((lod_path, simplified_geojson(variants[0][1], tolerance)))
+
+        for path, geojson in variants:
+            if args.encoding == "polyline":
+                geojson = polyline_geojson(geojson, args.precision, args.elevation_precision)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w') as f:
+                dump_geojson_with_compact_geometry(geojson, f, args.precision, args.elevation_precision)
+
+        if args.profile_dir:
+            profile = route_profile(variants[0][1], args.profile_step, args.profile_points)
+            profile_path = args.profile_dir / (pathlib.Path(outpath).stem + '.json')
+            if profile is None:
+                # Routes without elevations get no profile; the route page then hides the chart
+                profile_path.unlink(missing_ok=True)
+            else:
+                profile_path.parent.mkdir(parents=True, exist_ok=True)
+                profile_path.write_text(json.dumps(profile, separators=(',', ':')) + '\n')
+
+    if args.lod_dir:
+        write_lod_manifest(args.lod_dir, args.lod_tolerances)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,399 @@
+"""Offline transit travel times from GTFS feeds with RAPTOR.
+
+Ingest. ``load_feed`` reads the stops, trips, stop_times and service
+calendars of one or more GTFS feeds (directories or zip files, as
+``fetch_transit_data.sh`` downloads them) for a single service date, and
+packs the trips running that day into compact arrays:
+
+  stops     coordinates and names of every stop some trip serves
+  patterns  trips with the same stop sequence, each an (n_trips, n_stops)
+            array of arrival and of departure times (seconds after midnight),
+            trips in order of departure so a binary search finds the next one;
+            a trip that overtakes another starts a pattern of its own
+  footpaths walking transfers between stops within ``MAX_TRANSFER_M``
+
+Routing. :func:`earliest_arrival` is RAPTOR (Delling, Pajor, Werneck,
+"Round-Based Public Transit Routing"): round *k* finds the earliest arrival
+at every stop using at most *k* vehicles, by scanning each pattern that
+serves a stop improved in the previous round once, then relaxing footpaths.
+:meth:`Feed.reversed` swaps the direction of travel and negates the
+clock, so the same search answers "when is the latest I can leave each stop
+and still arrive by 8:30", which is what :func:`travel_times` uses to time
+every location's trip to each destination with one search per destination.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import datetime as dt
+import io
+import math
+import zipfile
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
+
+import gis
+import rcr
+
+GTFS_DIR = rcr.ROUTES / "_transit_data" / "gtfs"
+WALK_SPEED_MPS = 1.2
+# longest walk between two stops to change vehicles, and to or from the first and last stop
+MAX_TRANSFER_M = 400.0
+MAX_ACCESS_M = 800.0
+MAX_ROUNDS = 4
+UNREACHED = np.iinfo(np.int64).max
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+class GTFSError(ValueError):
+    """Raised when a feed is missing files or has no service on the requested date."""
+
+
+@dataclass
+class Pattern:
+    stops: np.ndarray  # stop indices, in order of travel
+    arrivals: np.ndarray  # (n_trips, n_stops) seconds after midnight
+    departures: np.ndarray
+
+
+@dataclass
+class Feed:
+    stop_ids: list[str]
+    stop_names: list[str]
+    stop_lat: np.ndarray
+    stop_lon: np.ndarray
+    patterns: list[Pattern]
+    # for each stop, (pattern, position in pattern) pairs, flattened with offsets
+    stop_pattern_offsets: np.ndarray
+    stop_patterns: np.ndarray
+    # walking transfers as a sparse matrix: targets and durations of stop i are [offsets[i]:offsets[i + 1]]
+    footpath_offsets: np.ndarray
+    footpath_targets: np.ndarray
+    footpath_seconds: np.ndarray
+
+    def patterns_at(self, stop: int) -> np.ndarray:
+        return self.stop_patterns[self.stop_pattern_offsets[stop]:self.stop_pattern_offsets[stop + 1]]
+
+    def footpaths(self, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.footpath_offsets[stop], self.footpath_offsets[stop + 1]
+        return self.footpath_targets[start:end], self.footpath_seconds[start:end]
+
+    def reversed(self) -> Feed:
+        """The same feed with time running backwards: trips run from their last stop to their first,
+        and every time t becomes -t. Earliest arrival in it is latest departure in this feed."""
+        patterns = [Pattern(p.stops[::-1].copy(), -p.departures[::-1, ::-1], -p.arrivals[::-1, ::-1])
+                    for p in self.patterns]
+        stop_patterns = self.stop_patterns.copy()
+        lengths = np.array([len(p.stops) for p in self.patterns])
+        stop_patterns[:, 1] = lengths[stop_patterns[:, 0]] - 1 - stop_patterns[:, 1]
+        return Feed(self.stop_ids, self.stop_names, self.stop_lat, self.stop_lon, patterns,
+                    self.stop_pattern_offsets, stop_patterns,
+                    self.footpath_offsets, self.footpath_targets, self.footpath_seconds)
+
+    def stops_near(self, lat: float, lon: float, radius_m: float = MAX_ACCESS_M) -> dict[int, int]:
+        """Stop index -> walking time in seconds, for stops within ``radius_m`` of a point."""
+        distances = gis.haversine_m(lat, lon, self.stop_lat, self.stop_lon)
+        near = np.flatnonzero(distances <= radius_m)
+        return {int(stop): math.ceil(distances[stop] / WALK_SPEED_MPS) for stop in near}
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Print transit travel times from every location to the given ones, computed offline from GTFS.",
+    )
+    parser.add_argument(
+        "--gtfs",
+        nargs="+",
+        metavar="PATH",
+        type=Path,
+        help="GTFS feed directories or zip files (default: every feed in %s)." % GTFS_DIR,
+    )
+    parser.add_argument(
+        "--date",
+        type=dt.date.fromisoformat,
+        default=next_saturday(),
+        help="Service date, YYYY-MM-DD (default: next Saturday, %(default)s).",
+    )
+    parser.add_argument(
+        "--arrive-by",
+        default="08:30",
+        help="Time to arrive at the destinations by, HH:MM (default: %(default)s).",
+    )
+    parser.add_argument(
+        "destinations",
+        nargs="*",
+        default=["CSE", "GreenLake", "Beacon"],
+        help="Location IDs to travel to (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def next_saturday(today: dt.date | None = None) -> dt.date:
+    today = today or dt.date.today()
+    return today + dt.timedelta(days=(5 - today.weekday()) % 7)
+
+
+def parse_time(value: str) -> int | None:
+    """Seconds after midnight of a GTFS time ("25:10:00" is 1:10 the next morning), or None if blank."""
+    value = value.strip()
+    if not value:
+        return None
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def feed_paths(directory: Path = GTFS_DIR) -> list[Path]:
+    """The feeds (subdirectories or zip files) in a directory."""
+    return sorted(path for path in directory.iterdir() if path.is_dir() or path.suffix == ".zip")
+
+
+def _read_table(feed: Path, name: str, required: bool = True) -> Iterable[dict[str, str]]:
+    if feed.suffix == ".zip":
+        with zipfile.ZipFile(feed) as archive:
+            if name not in archive.namelist():
+                if required:
+                    raise GTFSError(f"{feed} has no {name}")
+                return
+            with archive.open(name) as raw:
+                yield from csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8-sig"))
+    else:
+        path = feed / name
+        if not path.exists():
+            if required:
+                raise GTFSError(f"{feed} has no {name}")
+            return
+        with path.open(encoding="utf-8-sig", newline="") as fh:
+            yield from csv.DictReader(fh)
+
+
+def active_services(feed: Path, date: dt.date) -> set[str]:
+    """Service IDs running on ``date``, from calendar.txt and its calendar_dates.txt exceptions."""
+    day = date.strftime("%Y%m%d")
+    weekday = WEEKDAYS[date.weekday()]
+    services = {row["service_id"] for row in _read_table(feed, "calendar.txt", required=False)
+                if row["start_date"] <= day <= row["end_date"] and row[weekday] == "1"}
+    for row in _read_table(feed, "calendar_dates.txt", required=False):
+        if row["date"] == day:
+            if row["exception_type"] == "1":
+                services.add(row["service_id"])
+            elif row["exception_type"] == "2":
+                services.discard(row["service_id"])
+    return services
+
+
+def _fill_times(times: list[int | None]) -> list[int] | None:
+    # stops without a scheduled time get one interpolated between the scheduled stops around them
+    known = [i for i, time in enumerate(times) if time is not None]
+    if len(known) < 2 or known[0] != 0 or known[-1] != len(times) - 1:
+        return None
+    return [round(t) for t in np.interp(range(len(times)), known, [times[i] for i in known])]
+
+
+def load_feed(feeds: Sequence[Path], date: dt.date) -> Feed:
+    """Pack the trips running on ``date`` in ``feeds`` into a :class:`Feed`."""
+    stop_index: dict[str, int] = {}
+    stop_ids, stop_names, stop_lat, stop_lon = [], [], [], []
+    trip_stops: dict[tuple[int, ...], list[tuple[list[int], list[int]]]] = defaultdict(list)
+
+    for feed in feeds:
+        prefix = feed.stem
+        stops = {row["stop_id"]: row for row in _read_table(feed, "stops.txt")}
+        services = active_services(feed, date)
+        trips = {row["trip_id"] for row in _read_table(feed, "trips.txt") if row["service_id"] in services}
+        rows: dict[str, list[tuple[int, str, int | None, int | None]]] = defaultdict(list)
+        for row in _read_table(feed, "stop_times.txt"):
+            if row["trip_id"] in trips:
+                rows[row["trip_id"]].append((int(row["stop_sequence"]), row["stop_id"],
+                                             parse_time(row["arrival_time"]), parse_time(row["departure_time"])))
+
+        for trip in rows.values():
+            trip.sort()
+            arrivals = _fill_times([arrival if arrival is not None else departure
+                                    for _seq, _stop, arrival, departure in trip])
+            departures = _fill_times([departure if departure is not None else arrival
+                                      for _seq, _stop, arrival, departure in trip])
+            if arrivals is None or departures is None:
+                continue
+            indices = []
+            for _seq, stop_id, _arrival, _departure in trip:
+                key = f"{prefix}:{stop_id}"
+                if key not in stop_index:
+                    stop = stops[stop_id]
+                    stop_index[key] = len(stop_ids)
+                    stop_ids.append(key)
+                    stop_names.append(stop.get("stop_name", ""))
+                    stop_lat.append(float(stop["stop_lat"]))
+                    stop_lon.append(float(stop["stop_lon"]))
+                indices.append(stop_index[key])
+            trip_stops[tuple(indices)].append((arrivals, departures))
+
+    if not trip_stops:
+        raise GTFSError(f"No trips run on {date} in {', '.join(str(feed) for feed in feeds)}")
+
+    patterns = []
+    for stops, trips in trip_stops.items():
+        trips.sort(key=lambda trip: trip[1])
+        # split into first-in-first-out groups so the next trip from a stop is always found by binary search
+        groups: list[list[tuple[list[int], list[int]]]] = []
+        for trip in trips:
+            for group in groups:
+                last = group[-1]
+                if all(a >= b for a, b in zip(trip[0], last[0])) and all(a >= b for a, b in zip(trip[1], last[1])):
+                    group.append(trip)
+                    break
+            else:
+                groups.append([trip])
+        for group in groups:
+            patterns.append(Pattern(np.array(stops, dtype=np.int32),
+                                    np.array([arrivals for arrivals, _ in group], dtype=np.int64),
+                                    np.array([departures for _, departures in group], dtype=np.int64)))
+
+    lat, lon = np.array(stop_lat), np.array(stop_lon)
+    pattern_offsets, pattern_entries = _stop_patterns(patterns, len(stop_ids))
+    footpath_offsets, footpath_targets, footpath_seconds = _footpaths(lat, lon)
+    return Feed(stop_ids, stop_names, lat, lon, patterns, pattern_offsets, pattern_entries,
+                footpath_offsets, footpath_targets, footpath_seconds)
+
+
+def _stop_patterns(patterns: Sequence[Pattern], n_stops: int) -> tuple[np.ndarray, np.ndarray]:
+    entries = np.array([(stop, index, position) for index, pattern in enumerate(patterns)
+                        for position, stop in enumerate(pattern.stops)], dtype=np.int64).reshape(-1, 3)
+    entries = entries[np.argsort(entries[:, 0], kind="stable")]
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(entries[:, 0], minlength=n_stops))))
+    return offsets, entries[:, 1:]
+
+
+def _footpaths(lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # bucket stops into cells MAX_TRANSFER_M wide, so each stop's neighbours are in the 3x3 cells around it
+    cell_deg = math.degrees(MAX_TRANSFER_M / gis.EARTH_RADIUS_M)
+    kx = math.cos(math.radians(float(np.mean(lat)))) if len(lat) else 1.0
+    cells: dict[tuple[int, int], list[int]] = defaultdict(list)
+    keys = list(zip((lon * kx // cell_deg).astype(int).tolist(), (lat // cell_deg).astype(int).tolist()))
+    for stop, key in enumerate(keys):
+        cells[key].append(stop)
+    offsets, targets, seconds = [0], [], []
+    for stop, (i, j) in enumerate(keys):
+        candidates = np.array([other for di in (-1, 0, 1) for dj in (-1, 0, 1)
+                               for other in cells.get((i + di, j + dj), ()) if other != stop], dtype=np.int64)
+        if len(candidates):
+            distances = gis.haversine_m(lat[stop], lon[stop], lat[candidates], lon[candidates])
+            near = distances <= MAX_TRANSFER_M
+            targets.extend(candidates[near].tolist())
+            seconds.extend(np.ceil(distances[near] / WALK_SPEED_MPS).astype(np.int64).tolist())
+        offsets.append(len(targets))
+    return np.array(offsets), np.array(targets, dtype=np.int64), np.array(seconds, dtype=np.int64)
+
+
+def earliest_arrival(feed: Feed, sources: Mapping[int, int], max_rounds: int = MAX_ROUNDS) -> np.ndarray:
+    """Earliest arrival time at every stop (``UNREACHED`` if none), starting from stop -> time ``sources``
+    and riding at most ``max_rounds`` vehicles."""
+    best = np.full(len(feed.stop_ids), UNREACHED, dtype=np.int64)
+    marked = set()
+    for stop, time in sources.items():
+        if time < best[stop]:
+            best[stop] = time
+            marked.add(stop)
+    marked |= _relax_footpaths(feed, best, marked)
+
+    for _round in range(max_rounds):
+        # each pattern serving an improved stop is scanned once, from the first such stop
+        queue: dict[int, int] = {}
+        for stop in marked:
+            for pattern, position in feed.patterns_at(stop).tolist():
+                if position < queue.get(pattern, len(feed.patterns[pattern].stops)):
+                    queue[pattern] = position
+        previous = best.copy()
+        marked = set()
+        for index, start in queue.items():
+            pattern = feed.patterns[index]
+            stops = pattern.stops.tolist()
+            trip = -1
+            for position in range(start, len(stops)):
+                stop = stops[position]
+                if trip >= 0:
+                    arrival = pattern.arrivals[trip, position]
+                    if arrival < best[stop]:
+                        best[stop] = arrival
+                        marked.add(stop)
+                # board (or switch to) the earliest trip leaving after we could have got here last round
+                ready = previous[stop]
+                if ready != UNREACHED and (trip < 0 or ready <= pattern.departures[trip, position]):
+                    earliest = int(np.searchsorted(pattern.departures[:, position], ready))
+                    if earliest < len(pattern.departures) and (trip < 0 or earliest < trip):
+                        trip = earliest
+        marked |= _relax_footpaths(feed, best, marked)
+        if not marked:
+            break
+    return best
+
+
+def _relax_footpaths(feed: Feed, best: np.ndarray, marked: set[int]) -> set[int]:
+    improved = set()
+    for stop in list(marked):
+        targets, seconds = feed.footpaths(stop)
+        if not len(targets):
+            continue
+        arrivals = best[stop] + seconds
+        better = arrivals < best[targets]
+        best[targets[better]] = arrivals[better]
+        improved.update(targets[better].tolist())
+    return improved
+
+
+def travel_times(feed: Feed, origins: Mapping[str, tuple[float, float]], destination: tuple[float, float],
+                 arrive_by: int, max_rounds: int = MAX_ROUNDS) -> dict[str, int | None]:
+    """Seconds from leaving each origin (name -> lat, lon) to arriving at ``destination`` by ``arrive_by``
+    (seconds after midnight), walking or by transit; None if it can't be reached by then.
+
+    One search on the reversed feed finds the latest time to leave every
+    stop; each origin then takes the best of the stops within walking
+    distance of it.
+    """
+    reverse = feed.reversed()
+    egress = feed.stops_near(*destination)
+    latest = earliest_arrival(reverse, {stop: -(arrive_by - walk) for stop, walk in egress.items()}, max_rounds)
+    times = {}
+    for name, (lat, lon) in origins.items():
+        best = None
+        walk = float(gis.haversine_m(lat, lon, np.array([destination[0]]), np.array([destination[1]]))[0])
+        if walk <= MAX_ACCESS_M:
+            best = math.ceil(walk / WALK_SPEED_MPS)
+        for stop, access in feed.stops_near(lat, lon).items():
+            if latest[stop] != UNREACHED:
+                duration = arrive_by - (-int(latest[stop]) - access)
+                best = duration if best is None else min(best, duration)
+        times[name] = best
+    return times
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        hours, minutes = args.arrive_by.split(":")
+        arrive_by = int(hours) * 3600 + int(minutes) * 60
+        feed = load_feed(args.gtfs or feed_paths(), args.date)
+    except (OSError, ValueError) as exc:
+        raise SystemExit(str(exc)) from exc
+
+    locations = {loc["id"]: (loc["lat"], loc["lon"]) for loc in rcr.load_loc_db()}
+    missing = [name for name in args.destinations if name not in locations]
+    if missing:
+        raise SystemExit(f"Unknown locations: {', '.join(missing)}")
+    print(f"{len(feed.stop_ids):,} stops, {len(feed.patterns):,} patterns, "
+          f"{sum(len(p.departures) for p in feed.patterns):,} trips on {args.date}")
+    columns = {name: travel_times(feed, locations, locations[name], arrive_by) for name in args.destinations}
+    print("location".ljust(16) + "".join(name.rjust(12) for name in args.destinations))
+    for location in locations:
+        cells = [columns[name][location] for name in args.destinations]
+        print(location.ljust(16) + "".join(("-" if cell is None else f"{cell // 60} min").rjust(12) for cell in cells))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
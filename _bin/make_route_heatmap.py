@@ -0,0 +1,247 @@
+"""Rasterize every route into a city-wide coverage heatmap.
+
+Each cell of a Web Mercator pixel grid (at ``--zoom``, so the images line up
+with map tiles) counts:
+
+  routes  how many distinct routes pass through it
+  runs    how many scheduled runs did, i.e. each route weighted by the number
+          of dates it appears on in the quarter schedules
+
+Tracks are projected and rasterized with numpy: every segment is sampled at
+half-pixel steps in one vectorized pass, a route's cells are deduplicated so
+it counts once per cell, and the counts of all routes are accumulated with
+``unique``. Only cells some route passes through are ever stored, so memory
+grows with the length of the routes rather than the area they span. The
+output directory gets:
+
+  heatmap.npz                 the global pixel x and y of every such cell with
+                              both counts, plus the zoom, for analysis
+  routes/<z>/<x>/<y>.png      colour-mapped 256 px PNG tiles (transparent where
+  runs/<z>/<x>/<y>.png        nothing passes) on a log scale so quiet streets
+                              still show, only for tiles some route crosses
+  heatmap.json                tile URL templates, bounds and the largest counts
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import struct
+import time
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+import rcr
+
+TILE_SIZE = 256
+# colour ramp for the overlays: (position on the log scale, RGBA)
+RAMP = [
+    (0.0, (255, 237, 160, 120)),
+    (0.4, (254, 178, 76, 180)),
+    (0.7, (240, 59, 32, 220)),
+    (1.0, (128, 0, 38, 255)),
+]
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Rasterize route tracks into route and run count heatmaps.",
+    )
+    parser.add_argument(
+        "--gpx",
+        nargs="+",
+        metavar="PATH",
+        type=Path,
+        required=True,
+        help="Route GPX files to rasterize.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        metavar="DIR",
+        type=Path,
+        required=True,
+        help="Directory to write the heatmap files to.",
+    )
+    parser.add_argument(
+        "--zoom",
+        type=int,
+        default=13,
+        help="Web Mercator zoom level of the pixel grid; 13 is about 13 m per pixel here (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def project(lons: np.ndarray, lats: np.ndarray, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    """Web Mercator pixel coordinates at ``zoom``, with (0, 0) at the top-left of the world."""
+    size = TILE_SIZE * 2 ** zoom
+    sin_lat = np.sin(np.radians(np.clip(lats, -85.0511, 85.0511)))
+    x = (lons + 180.0) / 360.0 * size
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * size
+    return x, y
+
+
+def unproject(x: float, y: float, zoom: int) -> tuple[float, float]:
+    """(lon, lat) of Web Mercator pixel coordinates at ``zoom``."""
+    size = TILE_SIZE * 2 ** zoom
+    lon = x / size * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+    return lon, lat
+
+
+def densify(x: np.ndarray, y: np.ndarray, step: float = 0.5) -> tuple[np.ndarray, np.ndarray]:
+    """Points every ``step`` pixels (or closer) along the polyline, including every vertex."""
+    if len(x) < 2:
+        return x, y
+    dx, dy = np.diff(x), np.diff(y)
+    samples = np.maximum(1, np.ceil(np.hypot(dx, dy) / step)).astype(np.int64)
+    segment = np.repeat(np.arange(len(dx)), samples)
+    starts = np.repeat(np.cumsum(samples) - samples, samples)
+    t = (np.arange(samples.sum()) - starts) / samples[segment]
+    return (np.append(x[segment] + t * dx[segment], x[-1]),
+            np.append(y[segment] + t * dy[segment], y[-1]))
+
+
+def rasterize(tracks: Sequence[tuple[np.ndarray, np.ndarray]], weights: Sequence[float], zoom: int) -> dict:
+    """Counts for [lon], [lat] arrays per route in every cell at least one passes through.
+
+    Returns the cells' global pixel ``x`` and ``y``, and per cell the distinct ``routes``
+    and ``runs`` (routes times weight).
+    """
+    size = TILE_SIZE * 2 ** zoom
+    cells, cell_weights = [], []
+    for (lons, lats), weight in zip(tracks, weights):
+        x, y = densify(*project(lons, lats, zoom))
+        x = np.clip(np.floor(x).astype(np.int64), 0, size - 1)
+        y = np.clip(np.floor(y).astype(np.int64), 0, size - 1)
+        route_cells = np.unique(y * size + x)
+        cells.append(route_cells)
+        cell_weights.append(np.full(len(route_cells), weight, dtype=np.float32))
+    cells, inverse, routes = np.unique(np.concatenate(cells), return_inverse=True, return_counts=True)
+    runs = np.bincount(inverse, weights=np.concatenate(cell_weights), minlength=len(cells))
+    return {
+        "zoom": zoom,
+        "x": (cells % size).astype(np.uint32),
+        "y": (cells // size).astype(np.uint32),
+        "routes": routes.astype(np.uint32),
+        "runs": np.rint(runs).astype(np.uint32),
+    }
+
+
+def palette(max_count: int) -> np.ndarray:
+    """RGBA colour of every count up to ``max_count`` on a log scale; 0 is transparent."""
+    # counts are small integers, so colour each possible value once and index into that
+    values = np.arange(max_count + 1)
+    scale = np.log1p(values) / math.log1p(max(1, max_count))
+    stops = [stop for stop, _ in RAMP]
+    colors = np.stack([np.interp(scale, stops, [color[channel] for _, color in RAMP]) for channel in range(4)],
+                      axis=1).astype(np.uint8)
+    colors[0] = 0
+    return colors
+
+
+def tiles(grid: dict) -> Iterator[tuple[int, int, np.ndarray]]:
+    """Yield (tile x, tile y, indexes of the grid's cells in that tile) for every tile with a cell."""
+    tx, ty = grid["x"] // TILE_SIZE, grid["y"] // TILE_SIZE
+    order = np.lexsort((ty, tx))
+    keys = tx[order].astype(np.int64) << 32 | ty[order]
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    for group in np.split(order, bounds):
+        yield int(tx[group[0]]), int(ty[group[0]]), group
+
+
+def clear_tiles(tile_dir: Path) -> None:
+    """Delete the ``<z>/<x>/<y>.png`` tiles of a previous run under ``tile_dir``, and nothing else."""
+    if not tile_dir.is_dir():
+        return
+    for zoom_dir in (path for path in tile_dir.iterdir() if path.is_dir() and path.name.isdigit()):
+        for x_dir in (path for path in zoom_dir.iterdir() if path.is_dir() and path.name.isdigit()):
+            for tile in x_dir.glob("*.png"):
+                tile.unlink()
+            if not any(x_dir.iterdir()):
+                x_dir.rmdir()
+        if not any(zoom_dir.iterdir()):
+            zoom_dir.rmdir()
+
+
+def write_tiles(tile_dir: Path, grid: dict, counts: np.ndarray) -> int:
+    """Write a PNG tile of ``counts`` for every tile with a cell. Returns the number of tiles."""
+    clear_tiles(tile_dir)
+    colors = palette(int(counts.max(initial=0)))
+    written = 0
+    for tx, ty, cells in tiles(grid):
+        rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        rgba[grid["y"][cells] % TILE_SIZE, grid["x"][cells] % TILE_SIZE] = colors[counts[cells]]
+        path = tile_dir / str(grid["zoom"]) / str(tx) / f"{ty}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_png(path, rgba)
+        written += 1
+    return written
+
+
+def write_png(path: Path, rgba: np.ndarray) -> None:
+    """Write an 8-bit RGBA image (height x width x 4) as a PNG."""
+    height, width, _ = rgba.shape
+    # each scanline starts with its filter type; 0 (none) compresses fine for sparse overlays
+    raw = np.concatenate((np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)), axis=1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+                     + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    if not 0 <= args.zoom <= 20:
+        raise SystemExit("--zoom must be between 0 and 20")
+    if not args.gpx:
+        raise SystemExit("No GPX files to rasterize")
+
+    start = time.perf_counter()
+    dates_run = rcr.route_run_dates(rcr.load_schedules())
+    tracks, weights = [], []
+    for path in args.gpx:
+        route = rcr.load_route(path)
+        points = route["track"].points
+        tracks.append((np.array([p.longitude for p in points]), np.array([p.latitude for p in points])))
+        weights.append(len(dates_run[route["id"]]))
+    loaded = time.perf_counter()
+
+    grid = rasterize(tracks, weights, args.zoom)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(args.output_dir / "heatmap.npz", x=grid["x"], y=grid["y"], routes=grid["routes"],
+                        runs=grid["runs"], zoom=args.zoom)
+    tile_counts = {name: write_tiles(args.output_dir / name, grid, grid[name]) for name in ("routes", "runs")}
+
+    west, north = unproject(int(grid["x"].min()), int(grid["y"].min()), args.zoom)
+    east, south = unproject(int(grid["x"].max()) + 1, int(grid["y"].max()) + 1, args.zoom)
+    metadata = {
+        "zoom": args.zoom,
+        "tile_size": TILE_SIZE,
+        "bounds": [west, south, east, north],
+        "cells": len(grid["x"]),
+        "tiles": tile_counts["routes"],
+        "max": {name: int(grid[name].max()) for name in ("routes", "runs")},
+        "tile_urls": {name: f"{name}/{{z}}/{{x}}/{{y}}.png" for name in ("routes", "runs")},
+    }
+    with (args.output_dir / "heatmap.json").open("w", encoding="utf-8") as fh:
+        json.dump(metadata, fh, indent=2)
+        fh.write("\n")
+
+    print(f"Rasterized {len(tracks)} routes into {len(grid['x'])} cells on {tile_counts['routes']} tiles "
+          f"in {time.perf_counter() - loaded:.2f}s "
+          f"(plus {loaded - start:.2f}s reading GPX)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,489 @@
+"""Cut the all-routes GeoJSON aggregate into a static vector tile pyramid.
+
+Tiles are written as ``<output-dir>/<z>/<x>/<y>.pbf`` in the Mapbox Vector Tile
+format (version 2), with one ``routes`` layer whose features carry the route's
+ID and a few other properties, so a MapLibre ``vector`` source pointed at
+``<output-dir>/{z}/{x}/{y}.pbf`` only downloads the tiles in view. At every
+zoom, lines are simplified to the tile grid before being clipped to each tile
+(plus a small buffer so line joins at tile edges render cleanly).
+
+Zoom levels are built in parallel. Rebuilds are incremental: a state file in
+the output directory records each route's content hash and the tiles it
+touched, and only tiles touched by added, changed or removed routes are
+rewritten.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+import gis
+
+LAYER_NAME = "routes"
+STATE_NAME = ".manifest.json"
+
+# MVT geometry commands and protobuf wire types
+MOVE_TO = 1
+LINE_TO = 2
+LINESTRING = 2
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Build a z/x/y vector tile pyramid from a GeoJSON FeatureCollection of routes.",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        metavar="PATH",
+        type=Path,
+        required=True,
+        help="FeatureCollection of route LineStrings (e.g. routes/geojson/aggregates/routes.geojson).",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        metavar="DIR",
+        type=Path,
+        required=True,
+        help="Directory to write <z>/<x>/<y>.pbf tiles to.",
+    )
+    parser.add_argument("--min-zoom", type=int, default=8, help="Lowest zoom level (default: %(default)s).")
+    parser.add_argument("--max-zoom", type=int, default=14, help="Highest zoom level (default: %(default)s).")
+    parser.add_argument(
+        "--extent",
+        type=int,
+        default=4096,
+        help="Tile coordinate extent (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--buffer",
+        type=int,
+        default=64,
+        help="Extra tile units kept around each tile when clipping (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=4.0,
+        help="Simplification tolerance in tile units at every zoom (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--properties",
+        nargs="+",
+        default=["id", "name", "distance_mi"],
+        help="Feature properties to keep in the tiles (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--workers",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Zoom levels built in parallel (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild every tile, ignoring the state from the previous run.",
+    )
+    return parser.parse_args(argv)
+
+
+@dataclass(frozen=True)
+class TileSettings:
+    extent: int
+    buffer: int
+    tolerance: float
+    properties: tuple[str, ...]
+
+    def as_dict(self) -> dict:
+        return {
+            "extent": self.extent,
+            "buffer": self.buffer,
+            "tolerance": self.tolerance,
+            "properties": list(self.properties),
+        }
+
+
+@dataclass(frozen=True)
+class Route:
+    id: str
+    properties: dict
+    # Web Mercator positions normalised to [0, 1) across the world
+    us: tuple[float, ...]
+    vs: tuple[float, ...]
+
+
+def mercator(lon: float, lat: float) -> tuple[float, float]:
+    """Project to normalised Web Mercator, with (0, 0) at the top-left of the world."""
+    sin_lat = math.sin(math.radians(max(-85.0511, min(85.0511, lat))))
+    return (lon + 180.0) / 360.0, 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+
+
+def load_routes(path: Path, property_names: Sequence[str]) -> tuple[list[Route], dict[str, str]]:
+    """Load routes from a FeatureCollection, with a content hash per route ID."""
+    try:
+        with path.open("r", encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (OSError, json.JSONDecodeError) as exc:
+        raise ValueError(f"Failed to read GeoJSON from {path}: {exc}") from exc
+    if data.get("type") != "FeatureCollection":
+        raise ValueError(f"Expected a FeatureCollection in {path}")
+
+    routes: list[Route] = []
+    hashes: dict[str, str] = {}
+    for index, feature in enumerate(data.get("features") or []):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "LineString":
+            raise ValueError(f"Feature #{index} in {path} is not a LineString")
+        properties = feature.get("properties") or {}
+        route_id = properties.get("id")
+        if not isinstance(route_id, str):
+            raise ValueError(f"Feature #{index} in {path} has no string 'id' property")
+        if route_id in hashes:
+            raise ValueError(f"Route ID {route_id!r} appears more than once in {path}")
+        kept = {name: properties[name] for name in property_names if properties.get(name) is not None}
+        projected = [mercator(coord[0], coord[1]) for coord in geometry["coordinates"]]
+        routes.append(Route(route_id, kept, tuple(p[0] for p in projected), tuple(p[1] for p in projected)))
+        digest = hashlib.sha256(json.dumps([kept, geometry["coordinates"]]).encode("utf-8"))
+        hashes[route_id] = digest.hexdigest()
+    return routes, hashes
+
+
+def tile_line(route: Route, zoom: int, settings: TileSettings) -> tuple[list[int], list[int]]:
+    """Route in integer world tile units at ``zoom``, simplified to ``settings.tolerance``."""
+    scale = (1 << zoom) * settings.extent
+    xs = [u * scale for u in route.us]
+    ys = [v * scale for v in route.vs]
+    keep = gis.douglas_peucker(xs, ys, settings.tolerance)
+    line_x: list[int] = []
+    line_y: list[int] = []
+    for x, y, kept in zip(xs, ys, keep):
+        if not kept:
+            continue
+        x, y = round(x), round(y)
+        if line_x and line_x[-1] == x and line_y[-1] == y:
+            continue
+        line_x.append(x)
+        line_y.append(y)
+    return line_x, line_y
+
+
+def covered_tiles(line: tuple[list[int], list[int]], zoom: int, settings: TileSettings) -> set[tuple[int, int]]:
+    """Tiles whose buffered bounds may intersect a segment of ``line``."""
+    xs, ys = line
+    extent, buffer, limit = settings.extent, settings.buffer, (1 << zoom) - 1
+    tiles: set[tuple[int, int]] = set()
+    for i in range(max(1, len(xs) - 1)):
+        j = min(i + 1, len(xs) - 1)
+        x0, x1 = sorted((xs[i], xs[j]))
+        y0, y1 = sorted((ys[i], ys[j]))
+        for tx in range(max(0, (x0 - buffer) // extent), min(limit, (x1 + buffer) // extent) + 1):
+            for ty in range(max(0, (y0 - buffer) // extent), min(limit, (y1 + buffer) // extent) + 1):
+                tiles.add((tx, ty))
+    return tiles
+
+
+def _clip_segment(x0: float, y0: float, x1: float, y1: float,
+                  lo: float, hi: float) -> tuple[float, float, float, float] | None:
+    """Liang-Barsky clipping of a segment to the square [lo, hi] x [lo, hi]."""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x1 - x0, y1 - y0
+    for p, q in ((-dx, x0 - lo), (dx, hi - x0), (-dy, y0 - lo), (dy, hi - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+    return x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy
+
+
+def clip_line(line: tuple[list[int], list[int]], tx: int, ty: int,
+              settings: TileSettings) -> list[list[tuple[int, int]]]:
+    """Clip a world-space line to a buffered tile, returning its parts in tile coordinates."""
+    xs, ys = line
+    ox, oy = tx * settings.extent, ty * settings.extent
+    lo, hi = -settings.buffer, settings.extent + settings.buffer
+    parts: list[list[tuple[int, int]]] = []
+    current: list[tuple[int, int]] = []
+    for i in range(len(xs) - 1):
+        clipped = _clip_segment(xs[i] - ox, ys[i] - oy, xs[i + 1] - ox, ys[i + 1] - oy, lo, hi)
+        if clipped is None:
+            if current:
+                parts.append(current)
+                current = []
+            continue
+        start = (round(clipped[0]), round(clipped[1]))
+        end = (round(clipped[2]), round(clipped[3]))
+        if current and current[-1] != start:
+            parts.append(current)
+            current = []
+        if not current:
+            current.append(start)
+        if current[-1] != end:
+            current.append(end)
+        if end != (xs[i + 1] - ox, ys[i + 1] - oy):
+            # The segment left the tile
+            parts.append(current)
+            current = []
+    if current:
+        parts.append(current)
+    return [part for part in parts if len(part) > 1]
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, wire_type: int, payload: bytes | int | float) -> bytes:
+    key = _varint((number << 3) | wire_type)
+    if wire_type == VARINT:
+        return key + _varint(payload)
+    if wire_type == FIXED64:
+        return key + struct.pack("<d", payload)
+    return key + _varint(len(payload)) + payload
+
+
+def _packed(values: Sequence[int]) -> bytes:
+    return b"".join(_varint(value) for value in values)
+
+
+def encode_geometry(parts: list[list[tuple[int, int]]]) -> list[int]:
+    """MVT command stream for a (multi) line string."""
+    commands: list[int] = []
+    cx = cy = 0
+    for part in parts:
+        commands.append((1 << 3) | MOVE_TO)
+        x, y = part[0]
+        commands += [_zigzag(x - cx), _zigzag(y - cy)]
+        cx, cy = x, y
+        commands.append(((len(part) - 1) << 3) | LINE_TO)
+        for x, y in part[1:]:
+            commands += [_zigzag(x - cx), _zigzag(y - cy)]
+            cx, cy = x, y
+    return commands
+
+
+def _encode_value(value) -> bytes:
+    """Encode a property value as an MVT ``Value`` message."""
+    if isinstance(value, bool):
+        return _field(7, VARINT, int(value))
+    if isinstance(value, int) and value >= 0:
+        return _field(5, VARINT, value)
+    if isinstance(value, (int, float)):
+        return _field(3, FIXED64, float(value))
+    return _field(1, LENGTH_DELIMITED, str(value).encode("utf-8"))
+
+
+def encode_tile(features: list[tuple[int, dict, list[list[tuple[int, int]]]]], extent: int) -> bytes:
+    """Encode ``(feature id, properties, parts)`` tuples as a single-layer vector tile."""
+    keys: dict[str, int] = {}
+    values: dict[tuple[type, object], int] = {}
+    encoded_features = []
+    for feature_id, properties, parts in features:
+        tags: list[int] = []
+        for key, value in properties.items():
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        encoded_features.append(
+            _field(1, VARINT, feature_id)
+            + _field(2, LENGTH_DELIMITED, _packed(tags))
+            + _field(3, VARINT, LINESTRING)
+            + _field(4, LENGTH_DELIMITED, _packed(encode_geometry(parts)))
+        )
+
+    layer = (
+        _field(15, VARINT, 2)
+        + _field(1, LENGTH_DELIMITED, LAYER_NAME.encode("utf-8"))
+        + b"".join(_field(2, LENGTH_DELIMITED, feature) for feature in encoded_features)
+        + b"".join(_field(3, LENGTH_DELIMITED, key.encode("utf-8")) for key in keys)
+        + b"".join(_field(4, LENGTH_DELIMITED, _encode_value(value)) for _, value in values)
+        + _field(5, VARINT, extent)
+    )
+    return _field(3, LENGTH_DELIMITED, layer)
+
+
+def feature_id(route_id: str) -> int:
+    """Numeric feature ID for a route, stable across runs and within JavaScript's safe integers."""
+    return int.from_bytes(hashlib.sha256(route_id.encode("utf-8")).digest()[:6], "big")
+
+
+def tile_path(output_dir: Path, zoom: int, tx: int, ty: int) -> Path:
+    return output_dir / str(zoom) / str(tx) / f"{ty}.pbf"
+
+
+def build_zoom(zoom: int, routes: list[Route], changed: set[str], removed: set[str],
+               old_coverage: dict[str, list[str]], settings: TileSettings,
+               output_dir: Path) -> tuple[int, dict[str, list[str]], int, int]:
+    """Rewrite the tiles at ``zoom`` touched by changed or removed routes.
+
+    ``old_coverage`` maps route IDs to the ``x/y`` tiles they were drawn in by
+    the previous run. Returns the zoom, the new coverage, and the number of
+    tiles written and deleted.
+    """
+    lines: dict[str, tuple[list[int], list[int]]] = {}
+    coverage: dict[str, set[tuple[int, int]]] = {}
+    for route in routes:
+        if route.id in changed:
+            lines[route.id] = tile_line(route, zoom, settings)
+            coverage[route.id] = covered_tiles(lines[route.id], zoom, settings)
+        else:
+            coverage[route.id] = {tuple(map(int, tile.split("/"))) for tile in old_coverage.get(route.id, [])}
+
+    dirty: set[tuple[int, int]] = set()
+    for route_id in changed | removed:
+        dirty.update(tuple(map(int, tile.split("/"))) for tile in old_coverage.get(route_id, []))
+        dirty.update(coverage.get(route_id, ()))
+
+    members: dict[tuple[int, int], list[int]] = {tile: [] for tile in dirty}
+    for index, route in enumerate(routes):
+        for tile in coverage[route.id] & dirty:
+            members[tile].append(index)
+
+    written = deleted = 0
+    for (tx, ty), indexes in sorted(members.items()):
+        features = []
+        for index in indexes:
+            route = routes[index]
+            if route.id not in lines:
+                lines[route.id] = tile_line(route, zoom, settings)
+            parts = clip_line(lines[route.id], tx, ty, settings)
+            if parts:
+                features.append((feature_id(route.id), route.properties, parts))
+            else:
+                coverage[route.id].discard((tx, ty))
+
+        path = tile_path(output_dir, zoom, tx, ty)
+        if features:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(encode_tile(features, settings.extent))
+            written += 1
+        elif path.exists():
+            path.unlink()
+            deleted += 1
+
+    return zoom, {route_id: sorted(f"{tx}/{ty}" for tx, ty in tiles) for route_id, tiles in coverage.items()}, \
+        written, deleted
+
+
+def clear_tiles(output_dir: Path) -> int:
+    """Delete every ``<z>/<x>/<y>.pbf`` tile under ``output_dir``, leaving any other files alone.
+
+    Returns the number of tiles deleted.
+    """
+    deleted = 0
+    if not output_dir.is_dir():
+        return deleted
+    for zoom_dir in output_dir.iterdir():
+        if not (zoom_dir.is_dir() and zoom_dir.name.isdigit()):
+            continue
+        for x_dir in zoom_dir.iterdir():
+            if not (x_dir.is_dir() and x_dir.name.isdigit()):
+                continue
+            for tile in x_dir.glob("*.pbf"):
+                tile.unlink()
+                deleted += 1
+            if not any(x_dir.iterdir()):
+                x_dir.rmdir()
+        if not any(zoom_dir.iterdir()):
+            zoom_dir.rmdir()
+    return deleted
+
+
+def load_state(path: Path) -> dict:
+    if not path.is_file():
+        return {}
+    with path.open("r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    if not 0 <= args.min_zoom <= args.max_zoom:
+        raise SystemExit("Zoom levels must satisfy 0 <= --min-zoom <= --max-zoom")
+    settings = TileSettings(args.extent, args.buffer, args.tolerance, tuple(args.properties))
+
+    try:
+        routes, hashes = load_routes(args.input, settings.properties)
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    state_path = args.output_dir / STATE_NAME
+    state = {} if args.force else load_state(state_path)
+    if state.get("settings") != settings.as_dict():
+        # Different tiling settings change every tile (and a missing state says nothing about the
+        # tiles on disk), so start from scratch without leaving tiles from other zooms or extents
+        state = {}
+        deleted = clear_tiles(args.output_dir)
+        if deleted:
+            print(f"Deleted {deleted} tiles from the previous build")
+    old_hashes: dict[str, str] = state.get("routes", {})
+    old_zooms: dict[str, dict[str, list[str]]] = state.get("zooms", {})
+
+    changed = {route_id for route_id, digest in hashes.items() if old_hashes.get(route_id) != digest}
+    removed = set(old_hashes) - set(hashes)
+    zooms = range(args.min_zoom, args.max_zoom + 1)
+    print(f"{len(changed)} changed and {len(removed)} removed of {len(routes)} routes; "
+          f"building zoom levels {args.min_zoom}-{args.max_zoom}")
+
+    # Zoom levels outside the requested range are left over from an earlier run
+    for zoom in set(old_zooms) - {str(z) for z in zooms}:
+        for tiles in old_zooms[zoom].values():
+            for tile in tiles:
+                tx, ty = tile.split("/")
+                tile_path(args.output_dir, int(zoom), int(tx), int(ty)).unlink(missing_ok=True)
+
+    # Tiles are about to change, so an interrupted run must not leave the old state behind
+    state_path.unlink(missing_ok=True)
+    new_zooms: dict[str, dict[str, list[str]]] = {}
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(zooms)))) as executor:
+        futures = [
+            executor.submit(build_zoom, zoom, routes, changed if str(zoom) in old_zooms else set(hashes),
+                            removed, old_zooms.get(str(zoom), {}), settings, args.output_dir)
+            for zoom in zooms
+        ]
+        for future in futures:
+            zoom, coverage, written, deleted = future.result()
+            new_zooms[str(zoom)] = coverage
+            print(f"  z{zoom}: {written} tiles written, {deleted} removed")
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    with state_path.open("w", encoding="utf-8") as fh:
+        json.dump({"settings": settings.as_dict(), "routes": hashes, "zooms": new_zooms}, fh,
+                  separators=(",", ":"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
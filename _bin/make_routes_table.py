@@ -1,11 +1,12 @@
+import json
 import pathlib
 import sys
-from collections import defaultdict
 
 import gis
 import rcr
 import re
 import os
+import route_similarity
 
 FIELDS = [
     'id',
@@ -111,14 +112,69 @@ def check_route(route):
         warn_rc(route, f"no GPX file at '{gpx_path}'")
 
 
+# Columns of the routes page index: (field, encoding). Repetitive strings are dictionary-encoded as
+# indexes into a shared list, numbers are rounded to the precision the table shows.
+INDEX_COLUMNS = [
+    ('id', 'string'),
+    ('name', 'string'),
+    ('start', 'dict'),
+    ('end', 'dict'),
+    ('type', 'dict'),
+    ('surface', 'dict'),
+    ('distance_mi', 1),
+    ('ascent_m', 0),
+    ('descent_m', 0),
+    ('deprecated', 'bool'),
+    ('neighborhoods', 'dict-list'),
+    ('dates_run', 'list'),
+]
+
+
+def build_index(routes):
+    # Columnar version of the routes table with only the fields the routes page uses: one array per field,
+    # in the same order for every field. Dictionary-encoded columns are {"dict": [...], "codes": [...]}.
+    columns = {}
+    for field, encoding in INDEX_COLUMNS:
+        values = [route.get(field) for route in routes]
+        if encoding == 'dict' or encoding == 'dict-list':
+            dictionary = {}
+            def code(value):
+                return None if value is None else dictionary.setdefault(value, len(dictionary))
+            if encoding == 'dict':
+                codes = [code(value) for value in values]
+            else:
+                codes = [[code(item) for item in value or []] for value in values]
+            columns[field] = {'dict': list(dictionary), 'codes': codes}
+        elif encoding == 'bool':
+            columns[field] = [1 if value else 0 for value in values]
+        elif encoding == 'list':
+            columns[field] = [[str(item) for item in value or []] for value in values]
+        elif encoding == 'string':
+            columns[field] = values
+        else:
+            digits = encoding or None  # round(x, None) gives an int rather than x.0
+            columns[field] = [None if value is None else round(float(value), digits) for value in values]
+    return {'count': len(routes), 'columns': columns}
+
+
 def main():
-    route_path = sys.argv[1:-1]
+    args = sys.argv[1:]
+    # Optional columnar JSON index for the routes page, written next to the YAML table
+    index_path = None
+    if '--index' in args:
+        i = args.index('--index')
+        if i + 1 >= len(args):
+            print("--index needs an output path")
+            exit(1)
+        index_path = pathlib.Path(args[i + 1])
+        del args[i:i + 2]
+    route_path = args[:-1]
     if len (route_path) == 0:
-        print("Usage: make_routes_table.py <route.gpx> ... <output.yml>")
+        print("Usage: make_routes_table.py [--index <index.json>] <route.gpx> ... <output.yml>")
         exit(1)
     elif len(route_path) == 1 and os.path.isdir(route_path[0]):
         route_path = [f for f in pathlib.Path(route_path[0]).glob("*.gpx")]
-    outpath = sys.argv[-1]
+    outpath = args[-1]
     if not outpath.endswith('.yml'):
         print("Output file must be a .yml file")
         exit(1)
@@ -126,14 +182,7 @@ def main():
     schedules = rcr.load_schedules()
     locations = rcr.load_loc_db()
     neighborhood_polygons = rcr.load_neighborhoods()
-    dates_routes_run = defaultdict(list)
-    for schedule in schedules.values():
-        for entry in schedule:
-            if not 'plan' in entry or 'cancelled' in entry:
-                continue
-            for phase in entry['plan']:
-                if 'route_id' in phase and not 'cancelled' in phase:
-                    dates_routes_run[phase['route_id']].append(entry['date'])
+    dates_routes_run = rcr.route_run_dates(schedules)
 
     # ensure all route ids unique
     ids = set()
@@ -197,6 +246,16 @@ def main():
     for route in routes:
         check_route(route)
 
+    # Near-duplicate geometry under different IDs is worth a look, but isn't fatal: some routes are
+    # deliberately the same course run the other way
+    similar = route_similarity.find_similar(
+        {route['id']: [(point.longitude, point.latitude) for point in route['track'].points] for route in routes})
+    for group in route_similarity.clusters(similar):
+        print(f"WARNING (not fatal): routes {', '.join(group)} have nearly identical geometry")
+    similar_by_route = route_similarity.similar_routes(similar)
+    for route in routes:
+        route['similar_routes'] = similar_by_route.get(route['id'], [])
+
     if warnings:
         print("Exiting due to warnings. Please fix and re-run.")
         exit(1)
@@ -259,6 +318,7 @@ def main():
             f.write(f"  end_neighborhood: \"{route['end_neighborhood']}\"\n")
             f.write(f"  neighborhoods: {route['neighborhoods']}\n")
             f.write(f"  coarse_neighborhoods: {route['coarse_neighborhoods']}\n")
+            f.write(f"  similar_routes: {route['similar_routes']}\n")
             if route['notes']:
                 f.write(f"  notes: \"{route['notes']}\"\n")
             else:
@@ -276,6 +336,11 @@ def main():
             f.write(f"  geojson: \"/routes/geojson/{route['id']}.geojson\"\n")
             f.write('\n')
 
+    if index_path:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(build_index(routes), separators=(',', ':')).encode('utf-8')
+        rcr.write_with_variants(index_path, data)
+
 
 if __name__ == '__main__':
     main()
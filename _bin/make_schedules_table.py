@@ -40,6 +40,7 @@ class ScheduleRecord:
     route_count: int
     manual_route_count: int
     unique_date_count: int
+    aggregate_topojson: Path | None = None
     previous_id: str | None = None
     next_id: str | None = None
 
@@ -54,7 +55,7 @@ class ScheduleRecord:
             "label": self.label,
             "year": self.year,
             "season": self.season,
-            "aggregate_geojson": self._public_geojson_path(),
+            "aggregate_geojson": self._public_path(self.aggregate_geojson),
             "start_date": self.start_date,
             "end_date": self.end_date,
             "event_count": self.event_count,
@@ -62,18 +63,21 @@ class ScheduleRecord:
             "route_count": self.route_count,
             "manual_route_count": self.manual_route_count,
         }
+        if self.aggregate_topojson:
+            data["aggregate_topojson"] = self._public_path(self.aggregate_topojson)
         if self.previous_id:
             data["previous_id"] = self.previous_id
         if self.next_id:
             data["next_id"] = self.next_id
         return data
 
-    def _public_geojson_path(self) -> str:
-        """Return the site-relative path to the aggregate GeoJSON."""
+    @staticmethod
+    def _public_path(path: Path) -> str:
+        """Return the site-relative path to an aggregate file."""
         try:
-            rel_path = self.aggregate_geojson.relative_to(rcr.ROOT)
+            rel_path = path.relative_to(rcr.ROOT)
         except ValueError:
-            rel_path = self.aggregate_geojson
+            rel_path = path
         return "/" + rel_path.as_posix()
 
 
@@ -101,8 +105,7 @@ def parse_args(argv: Iterable[str]) -> argparse.Namespace:
 
 
 def load_schedule(path: Path) -> list[dict]:
-    with path.open("r") as handle:
-        data = yaml.safe_load(handle)
+    data = rcr.load_yaml(path)
     if not isinstance(data, list):
         raise ValueError(f"Schedule file '{path}' is not a list.")
     return data
@@ -182,12 +185,15 @@ def build_record(path: Path, aggregate_dir: Path) -> ScheduleRecord:
     aggregate_path = (aggregate_dir / f"{schedule_id}.geojson").resolve()
     if not aggregate_path.exists():
         raise FileNotFoundError(f"Missing aggregate GeoJSON for '{schedule_id}': {aggregate_path}")
+    # The TopoJSON encoding is optional; the schedule map falls back to GeoJSON without it
+    topojson_path = aggregate_path.with_suffix(".topojson")
 
     return ScheduleRecord(
         id=schedule_id,
         year=year,
         season=season,
         aggregate_geojson=aggregate_path,
+        aggregate_topojson=topojson_path if topojson_path.exists() else None,
         start_date=start_date,
         end_date=end_date,
         event_count=len(entries),
@@ -1,11 +1,32 @@
-"""Merge multiple GeoJSON FeatureCollections into a single output file."""
+"""Merge multiple GeoJSON FeatureCollections into a single output file.
+
+With ``--topology`` the merged LineStrings are written as a TopoJSON topology
+instead, so stretches shared between routes are stored only once.
+
+With ``--stream`` the inputs are never turned into Python objects: each file's
+top-level structure is checked with a small tokenizer and the bytes of its
+features are minified and copied straight into the output. Only for inputs
+written by Python's json module (as ``gpx_to_geojson.py`` does) is the result
+byte-for-byte the same as the default merge: strings and numbers are copied as
+spelled, so a hand-edited file keeps ``\\/`` escapes and numbers like ``1.50``
+or ``2e1`` that the default merge would normalize.
+"""
 
 from __future__ import annotations
 
 import argparse
 import json
+import re
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import BinaryIO, Iterable, Iterator, Sequence
+
+import topology
+
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Strings are matched first so whitespace and brackets inside them are left alone
+_WHITESPACE_RE = re.compile(rb"(" + _STRING + rb")|[ \t\n\r]+")
+_TOKEN_RE = re.compile(_STRING + rb"|[{}\[\],:]")
+_CLOSERS = {b"}"[0]: b"{"[0], b"]"[0]: b"["[0]}
 
 
 def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
@@ -41,6 +62,23 @@ def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
         required=True,
         help="Path for the merged GeoJSON FeatureCollection.",
     )
+    parser.add_argument(
+        "--topology",
+        action="store_true",
+        help="Write a TopoJSON topology with shared, delta-encoded arcs instead of GeoJSON.",
+    )
+    parser.add_argument(
+        "--quantization",
+        type=int,
+        default=topology.DEFAULT_QUANTIZATION,
+        help="Grid size per axis for --topology coordinates (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Copy feature bytes into the output without parsing them (GeoJSON output only). "
+             "Numbers and string escapes are kept as spelled in the inputs.",
+    )
     return parser.parse_args(argv)
 
 
@@ -145,6 +183,145 @@ def merge_feature_collections(paths: Iterable[Path]) -> dict:
     return {"type": "FeatureCollection", "features": merged}
 
 
+def minify_json_bytes(data: bytes) -> bytes:
+    """Remove all insignificant whitespace from the JSON document ``data``."""
+    return _WHITESPACE_RE.sub(rb"\1", data)
+
+
+def _top_level_members(data: bytes, path: Path) -> dict[str, tuple[int, int]]:
+    """Return the byte span of each member value of the minified JSON object ``data``.
+
+    Only strings and structural characters are tokenized, which is enough to
+    check that brackets balance and to find where each member starts and ends.
+    """
+    if not data.startswith(b"{"):
+        raise ValueError(f"GeoJSON root must be an object: {path}")
+
+    members: dict[str, tuple[int, int]] = {}
+    stack: list[int] = []
+    key: str | None = None
+    value_start = 0
+    expect_key = False
+    end = -1
+    for match in _TOKEN_RE.finditer(data):
+        token = match.group()
+        char = token[0]
+        depth = len(stack)
+        if char in b"{[":
+            stack.append(char)
+            if depth == 0:
+                expect_key = True
+        elif char in _CLOSERS:
+            if not stack or stack.pop() != _CLOSERS[char]:
+                raise ValueError(f"Failed to decode JSON from {path}: unbalanced {token.decode()!r} "
+                                 f"at byte {match.start()}")
+            if not stack:
+                if key is not None:
+                    members[key] = (value_start, match.start())
+                end = match.end()
+                break
+        elif depth != 1:
+            continue
+        elif char == b","[0]:
+            if key is not None:
+                members[key] = (value_start, match.start())
+            key = None
+            expect_key = True
+        elif char == b":"[0]:
+            value_start = match.end()
+        elif expect_key:
+            key = json.loads(token)
+            expect_key = False
+
+    if end < 0 or data[end:].strip():
+        raise ValueError(f"Failed to decode JSON from {path}: expected a single JSON object")
+    return members
+
+
+def _split_array(data: bytes, start: int, end: int) -> Iterator[tuple[int, int]]:
+    """Yield the byte span of each element of the minified JSON array ``data[start:end]``."""
+    depth = 0
+    element_start = start + 1
+    for match in _TOKEN_RE.finditer(data, start, end):
+        char = match.group()[0]
+        if char in b"{[":
+            depth += 1
+        elif char in b"}]":
+            depth -= 1
+            if depth == 0 and match.start() > element_start:
+                yield element_start, match.start()
+        elif char == b","[0] and depth == 1:
+            yield element_start, match.start()
+            element_start = match.end()
+
+
+def _canonical_feature_bytes(feature: bytes) -> bytes:
+    """Return ``feature`` as ``json.dump`` with compact separators would write it.
+
+    Only non-ASCII text is normalized; numbers and escapes are assumed to be spelled as
+    ``json.dump`` spells them already, which holds for files written by the json module.
+    """
+    if feature.isascii():
+        return feature
+    # json.dump escapes non-ASCII characters, so those features are re-encoded
+    return json.dumps(json.loads(feature), separators=(",", ":")).encode("ascii")
+
+
+def iter_feature_bytes(path: Path) -> Iterator[bytes]:
+    """Yield the minified bytes of each GeoJSON feature in ``path`` without parsing it."""
+    if not path.exists():
+        raise ValueError(f"Input file does not exist: {path}")
+    if not path.is_file():
+        raise ValueError(f"Input path is not a file: {path}")
+
+    data = minify_json_bytes(path.read_bytes())
+    members = _top_level_members(data, path)
+
+    geojson_type = None
+    if "type" in members:
+        start, end = members["type"]
+        if data[start:start + 1] == b'"':
+            geojson_type = json.loads(data[start:end])
+
+    if geojson_type == "FeatureCollection":
+        if "features" not in members or data[members["features"][0]:members["features"][0] + 1] != b"[":
+            raise ValueError(f"'features' must be a list in {path}")
+        for start, end in _split_array(data, *members["features"]):
+            yield _canonical_feature_bytes(data[start:end])
+        return
+    if geojson_type == "Feature":
+        yield _canonical_feature_bytes(data)
+        return
+
+    raise ValueError(
+        f"Expected GeoJSON type 'FeatureCollection' or 'Feature' in {path}, got {geojson_type!r}"
+    )
+
+
+def stream_feature_collections(paths: Iterable[Path], out: BinaryIO) -> int:
+    """Write one FeatureCollection containing every feature in ``paths`` to ``out``.
+
+    Only one input file is held in memory at a time. Returns the number of features written.
+    """
+    return write_feature_bytes((feature for path in paths for feature in iter_feature_bytes(path)), out)
+
+
+def write_feature_bytes(features: Iterable[bytes], out: BinaryIO) -> int:
+    """Write already minified ``features`` to ``out`` as one FeatureCollection.
+
+    Returns the number of features written.
+    """
+    count = 0
+    out.write(b'{"type":"FeatureCollection","features":[')
+    for feature in features:
+        if count:
+            out.write(b",")
+        out.write(feature)
+        count += 1
+    out.write(b"]}\n")
+    return count
+
+
 def write_geojson(data: dict, destination: Path) -> None:
     """Write GeoJSON ``data`` to ``destination`` with minimal whitespace."""
     destination.parent.mkdir(parents=True, exist_ok=True)
@@ -160,7 +337,22 @@ def main(argv: Sequence[str] | None = None) -> int:
         input_paths = resolve_input_paths(args)
         if args.output in input_paths:
             raise ValueError("Output path must not be one of the inputs.")
+        if args.stream:
+            if args.topology:
+                raise ValueError("--stream cannot be combined with --topology.")
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            partial = args.output.with_name(args.output.name + ".partial")
+            try:
+                with partial.open("wb") as fh:
+                    stream_feature_collections(input_paths, fh)
+            except BaseException:
+                partial.unlink(missing_ok=True)
+                raise
+            partial.replace(args.output)
+            return 0
         merged = merge_feature_collections(input_paths)
+        if args.topology:
+            merged = topology.build_topology(merged["features"], quantization=args.quantization)
     except ValueError as exc:
         raise SystemExit(str(exc)) from exc
 
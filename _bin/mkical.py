@@ -1,23 +1,45 @@
 #!/usr/bin/env python3
+"""Generate the club calendars from the schedule YAML.
+
+rcc.ics has the current quarter's weekend runs and the weekday short runs,
+rcc_weekends.ics just the weekend runs. With --history-dir, the weekend runs
+of every quarter in _data/schedules are also written there as all.ics, one
+feed per quarter (quarters/<quarter>.ics) and one per route start location
+(locations/<location>.ics).
+
+Calendars are written one event at a time. Serialized events are cached
+under cache/ical by a hash of their content (everything but DTSTAMP, which
+is filled in on the way out), so a run after editing one schedule only
+serializes the events that changed.
+"""
+import argparse
 import copy
+import hashlib
+import pickle
+from pathlib import Path
 from zoneinfo import ZoneInfo
 
-import yaml
+import icalendar
 from icalendar import Calendar, Event, vText, vDatetime, vUri
 from datetime import datetime, timedelta
 
 from icalendar.cal import Timezone
-from yaml import Loader
 
+import rcr
 
-calHeader = lambda name: \
+EVENT_CACHE = rcr.ROOT / 'cache' / 'ical' / 'events.pickle'
+# events are serialized with this DTSTAMP, replaced by the real one when written
+PLACEHOLDER_DTSTAMP = datetime(2000, 1, 1, tzinfo=ZoneInfo("UTC"))
+
+
+calHeader = lambda name, title='Race Condition Running': \
     [ ('version'         , '2.0')
     , ('prodid'          , '-//Race Condition Running//NONSGML Race Condition Running//EN')
     , ('url'             , f'http://raceconditionrunning.com/{name}.ics')
-    , ('name'            , 'Race Condition Running')
-    , ('x-wr-calname'    , 'Race Condition Running')
-    , ('description'     , 'Race Condition Running')
-    , ('x-wr-caldesc'    , 'Race Condition Running')
+    , ('name'            , title)
+    , ('x-wr-calname'    , title)
+    , ('description'     , title)
+    , ('x-wr-caldesc'    , title)
     , ('timezone-id'     , 'America/Los_Angeles')
     , ('x-wr-timezone'   , 'America/Los_Angeles')
     , ('refresh-interval;value=duration', 'PT12H')
@@ -27,35 +49,24 @@ calHeader = lambda name: \
     ]
 
 
-def main():
-    with open('_data/routes.yml') as f:
-        routes = yaml.load(f, Loader=Loader)
-
-    with open('_data/schedule.yml') as f:
-        sched = yaml.load(f, Loader=Loader)
-
-    def lkup(uid):
-      for r in routes:
-        if r ['id'] == uid:
-          return r
-
-    def dtstart(date, time):
-      time = datetime.strptime(time, '%H:%M')
-      return datetime( date.year
-                     , date.month
-                     , date.day
-                     , time.hour
-                     , time.minute
-                     , 0
-                     , 0
-                     , tzinfo=ZoneInfo("America/Los_Angeles")
-                     )
+def dtstart(date, time):
+  time = datetime.strptime(time, '%H:%M')
+  return datetime( date.year
+                 , date.month
+                 , date.day
+                 , time.hour
+                 , time.minute
+                 , 0
+                 , 0
+                 , tzinfo=ZoneInfo("America/Los_Angeles")
+                 )
 
-    # ics timestamps must be utc
-    now = datetime.now(ZoneInfo("UTC"))
 
+def weekend_events(sched, routes_by_id, now):
+    """Event dicts for the runs (and brunches) of a schedule, and the start location of each."""
     # NOTE: assumes events back-to-back on single day
     weekend_runs = []
+    locations = []
     for run in sched:
         date = datetime.strptime(run['date'], '%Y-%m-%d')
         phases = run['plan']
@@ -67,7 +78,7 @@ def main():
             if 'cancelled' in phase.keys():
                 continue
             if 'route_id' in phase.keys():
-              route = lkup(phase['route_id'])
+              route = routes_by_id[phase['route_id']]
             else:
               route = phase['route']
 
@@ -94,6 +105,7 @@ def main():
                           , 'dtstamp'     : now
                           , 'uid'         : uid
                           })
+            locations.append(route.get('start'))
 
             # add brunch after other phases
             if i == len(phases) - 1 and dist and dist > 0:
@@ -108,8 +120,134 @@ def main():
                               , 'dtstamp'     : now
                               , 'uid'         : buid
                               })
+                locations.append(None)
+    return weekend_runs, locations
+
+
+def make_event(x):
+    e = Event()
+    for k, v in x.items():
+        if isinstance(v, datetime):
+            e.add(k, vDatetime(v))
+        elif isinstance(v, str) and v.startswith('http'):
+            e.add(k, vUri(v))
+        elif k.lower() == 'rrule': # XXX: ugly hack
+            e.add(k, v)
+        else:
+            e.add(k, vText(v))
+    return e
+
+
+class EventCache:
+    """Serialized events by content hash, kept between runs in EVENT_CACHE."""
+
+    def __init__(self, path=EVENT_CACHE):
+        self.path = path
+        self.events = {}
+        self.used = set()
+        self.serialized = 0
+        try:
+            with open(path, 'rb') as f:
+                version, events = pickle.load(f)
+            if version == icalendar.__version__:
+                self.events = events
+        except Exception:
+            pass
+
+    def to_ical(self, x):
+        """Event dict x as iCalendar bytes, with a placeholder DTSTAMP."""
+        key = hashlib.sha1(repr([(k, v) for k, v in x.items() if k != 'dtstamp']).encode()).hexdigest()
+        self.used.add(key)
+        if key not in self.events:
+            self.events[key] = make_event(dict(x, dtstamp=PLACEHOLDER_DTSTAMP)).to_ical()
+            self.serialized += 1
+        return self.events[key]
+
+    def save(self):
+        # only keep the events still in some calendar
+        events = {key: ical for key, ical in self.events.items() if key in self.used}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'wb') as f:
+                pickle.dump((icalendar.__version__, events), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+
+
+def write_calendar(path, header, timezone, runs, cache, now):
+    """Write a calendar of the event dicts in runs, one event at a time."""
+    calendar = Calendar()
+    for (k, v) in header:
+        if v.startswith('http'):
+            calendar.add(k, vUri(v))
+        else:
+            calendar.add(k, vText(v))
+    end = b'END:VCALENDAR\r\n'
+    opening = calendar.to_ical()[:-len(end)]
+    placeholder = b'DTSTAMP:' + vDatetime(PLACEHOLDER_DTSTAMP).to_ical() + b'\r\n'
+    dtstamp = b'DTSTAMP:' + vDatetime(now).to_ical() + b'\r\n'
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(opening)
+        f.write(timezone.to_ical())
+        for x in runs:
+            f.write(cache.to_ical(x).replace(placeholder, dtstamp, 1))
+        f.write(end)
+
+
+def history_timezone(runs):
+    dates = [x['dtstart'].date() for x in runs]
+    return Timezone.from_tzinfo(ZoneInfo("America/Los_Angeles"), first_date=min(dates), last_date=max(dates))
+
+
+def write_history(directory, routes_by_id, cache, now):
+    """Write the all-quarter, per-quarter and per-start-location calendars of weekend runs."""
+    all_runs = []
+    by_location = {}
+    for quarter, sched in rcr.load_schedules().items():
+        valid = []
+        for run in sched:
+            try:
+                datetime.strptime(run['date'], '%Y-%m-%d')
+                valid.append(run)
+            except ValueError:
+                print(f"WARNING (not fatal): skipping {quarter} run on invalid date {run['date']}")
+        runs, locations = weekend_events(valid, routes_by_id, now)
+        if not runs:
+            continue
+        write_calendar(directory / 'quarters' / f'{quarter}.ics',
+                       calHeader(f'calendars/quarters/{quarter}', f'Race Condition Running {quarter}'),
+                       history_timezone(runs), runs, cache, now)
+        all_runs += runs
+        for x, location in zip(runs, locations):
+            if location:
+                by_location.setdefault(location, []).append(x)
+
+    write_calendar(directory / 'all.ics', calHeader('calendars/all', 'Race Condition Running (all runs)'),
+                   history_timezone(all_runs), all_runs, cache, now)
+    for location, runs in sorted(by_location.items()):
+        write_calendar(directory / 'locations' / f'{location}.ics',
+                       calHeader(f'calendars/locations/{location}', f'Race Condition Running from {location}'),
+                       history_timezone(runs), runs, cache, now)
+    return len(all_runs), len(by_location)
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Generate rcc.ics and rcc_weekends.ics from the schedule.")
+    parser.add_argument("--history-dir", type=Path,
+                        help="Also write calendars of every quarter's runs (all, per quarter, per start location) here")
+    args = parser.parse_args()
+
+    routes = rcr.load_yaml(rcr.DATA / 'routes.yml')
+    sched = rcr.load_yaml(rcr.DATA / 'schedule.yml')
+    routes_by_id = {r['id']: r for r in routes}
+
+    # ics timestamps must be utc
+    now = datetime.now(ZoneInfo("UTC"))
+
+    weekend_runs, _ = weekend_events(sched, routes_by_id, now)
+
     # add weekday runs
     weekday_runs = []
     def previous_tuesday(datetime_date):
@@ -181,43 +319,15 @@ def main():
         last_date=next_start
     )
 
-    def add_header_to_calendar(calendar, header):
-        for (k, v) in header:
-            if v.startswith('http'):
-                calendar.add(k, vUri(v))
-            else:
-                calendar.add(k, vText(v))
-
-    def add_runs_to_calendar(calendar, runs):
-        for x in runs:
-            e = Event()
-            for k, v in x.items():
-                if isinstance(v, datetime):
-                    e.add(k, vDatetime(v))
-                elif isinstance(v, str) and v.startswith('http'):
-                    e.add(k, vUri(v))
-                elif k.lower() == 'rrule': # XXX: ugly hack
-                    e.add(k, v)
-                else:
-                    e.add(k, vText(v))
-            calendar.add_component(e)
-
-    full_calendar = Calendar()
-    full_calendar.add_component(timezone)
-    add_header_to_calendar(full_calendar, calHeader("rcc"))
-    add_runs_to_calendar(full_calendar, weekday_runs)
-    add_runs_to_calendar(full_calendar, weekend_runs)
-
-    weekend_only_calendar = Calendar()
-    weekend_only_calendar.add_component(timezone)
-    add_header_to_calendar(weekend_only_calendar, calHeader("rcc_weekends"))
-    add_runs_to_calendar(weekend_only_calendar, weekend_runs)
-
-    with open('rcc.ics', 'wb') as f:
-        f.write(full_calendar.to_ical())
-
-    with open('rcc_weekends.ics', 'wb') as f:
-        f.write(weekend_only_calendar.to_ical())
+    cache = EventCache()
+    write_calendar(Path('rcc.ics'), calHeader("rcc"), timezone, weekday_runs + weekend_runs, cache, now)
+    write_calendar(Path('rcc_weekends.ics'), calHeader("rcc_weekends"), timezone, weekend_runs, cache, now)
+    if args.history_dir:
+        events, locations = write_history(args.history_dir, routes_by_id, cache, now)
+        print(f"Wrote {events} events to {args.history_dir}, with {locations} start location calendars")
+    # counted across every calendar written, rcc.ics and rcc_weekends.ics included
+    print(f"{cache.serialized} of {len(cache.used)} distinct events serialized, the rest reused from {EVENT_CACHE}")
+    cache.save()
 
 
 if __name__ == '__main__':
@@ -1,14 +1,27 @@
+import gzip
+import hashlib
 import json
 import os
 import pathlib
+import pickle
 import re
+import sys
+import time
+from collections import defaultdict
 from typing import List
 
+import brotli
 import gpxpy
 import yaml
 
 from gis import calculate_bounding_box
 
+# the libyaml parser is several times faster, when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+
 
 class GPXParseError(Exception):
     pass
@@ -29,6 +42,11 @@ ROUTES = ROOT / 'routes'
 # These are "raw" routes, not directly served on the site thanks to _ prefix
 ROUTES_GPX =  ROUTES / '_gpx'
 NEIGHBORHOOD_FILE = ROUTES / "neighborhoods.geojson"
+# parsed YAML files, see load_yaml
+YAML_CACHE = ROOT / 'cache' / 'yaml'
+
+# set RCR_PROFILE=1 to print how long each data file takes to load
+PROFILE = bool(os.environ.get('RCR_PROFILE'))
 
 for path in [ROOT, DATA, ROUTES , ROUTES_GPX]:
   if not os.path.isdir(path):
@@ -214,9 +232,79 @@ def schedule_paths() -> List[pathlib.Path]:
     paths = SCHEDULES.glob("*.yml")
     return sorted(paths, key=sort_key)
 
+def load_yaml(path):
+    """Parse a YAML data file, reusing the result of the last parse if the file hasn't changed since.
+
+    Parsed files are pickled under YAML_CACHE, keyed on the file's path and
+    checked against its size and modification time; a missing, stale or
+    unreadable cache entry just means parsing the file again.
+    """
+    path = pathlib.Path(path).resolve()
+    start = time.perf_counter()
+    stat = path.stat()
+    stamp = (stat.st_size, stat.st_mtime_ns, yaml.__version__)
+    cache_path = YAML_CACHE / f"{path.stem}-{hashlib.sha1(str(path).encode()).hexdigest()[:12]}.pickle"
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_stamp, data = pickle.load(f)
+        if cached_stamp == stamp:
+            if PROFILE:
+                print(f"load_yaml: {path.name} from cache in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+            return data
+    except Exception:
+        pass
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.load(f, Loader=YAMLLoader)
+    if PROFILE:
+        print(f"load_yaml: parsed {path.name} in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    try:
+        YAML_CACHE.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a concurrent run never reads half an entry
+        tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((stamp, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return data
+
 def load_schedules() -> dict[str, dict]:
-    schedules = {}
-    for path in schedule_paths():
-        with open(path, 'r') as f:
-            schedules[path.stem] = yaml.safe_load(f)
-    return schedules
\ No newline at end of file
+    return {path.stem: load_yaml(path) for path in schedule_paths()}
+
+def load_warehouse(path=None, update=True):
+    """The SQLite warehouse of routes, locations, neighborhoods and schedules, brought up to date.
+
+    Updating only re-reads source files that changed since the last update;
+    see warehouse.py for the tables and queries.
+    """
+    # imported here: warehouse builds its tables with this module's loaders
+    import warehouse
+    db = warehouse.Warehouse(path or warehouse.DEFAULT_PATH)
+    if update:
+        db.update()
+    return db
+
+def route_run_dates(schedules: dict[str, dict]) -> defaultdict[str, list]:
+    # Dates each route was run, skipping cancelled runs and legs
+    dates_run = defaultdict(list)
+    for schedule in schedules.values():
+        for entry in schedule:
+            if not 'plan' in entry or 'cancelled' in entry:
+                continue
+            for phase in entry['plan']:
+                if 'route_id' in phase and not 'cancelled' in phase:
+                    dates_run[phase['route_id']].append(entry['date'])
+    return dates_run
+
+def encode_variants(data: bytes) -> dict[str, bytes]:
+    """Return the raw payload and its precompressed variants keyed by file suffix."""
+    return {"": data, ".gz": gzip.compress(data, compresslevel=9, mtime=0), ".br": brotli.compress(data, quality=11)}
+
+def write_with_variants(path: pathlib.Path, data: bytes) -> dict[str, int]:
+    """Write ``data`` and its compressed siblings, returning each variant's size."""
+    sizes = {}
+    for suffix, payload in encode_variants(data).items():
+        path.with_name(path.name + suffix).write_bytes(payload)
+        sizes[suffix] = len(payload)
+    return sizes
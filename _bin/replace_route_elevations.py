@@ -1,16 +1,14 @@
 import argparse
+from pathlib import Path
 
 import gpxpy
-import requests
+import numpy as np
 from gpxpy.gpx import GPXTrackPoint
-from joblib import Memory
-import time
 import haversine
 from typing import Callable
-import tqdm
-import sys
 
-cache = Memory("cache", verbose=0).cache
+import elevation
+import rcr
 
 def distance_window_smoothing(
     points: list[GPXTrackPoint],
@@ -63,67 +61,82 @@ def compute_smoothed_elevation(track: list[GPXTrackPoint]) -> list[float]:
     return smoothed
 
 
-@cache
-def query_usgs_elevation(lat, lon, wait_time=0.0):
-    url = f'https://epqs.nationalmap.gov/v1/json'
-    params = {
-        'x': lon,
-        'y': lat,
-        'units': 'Meters',
-    }
-
-    # Use this param to avoid slamming the server
-    time.sleep(wait_time)
-
-    # sometimes the USGS server returns a 200 but with an empty body?!
-    # hypothesis: this is some kind of bad rate limiting
-    resp = requests.get(url, params=params)
-    try:
-        return float(resp.json()['value'])
-    except Exception as e:
-        print(f"Error querying elevation for {lat}, {lon}")
-        print(f"Exception: {e}")
-        print(f"Response code: {resp.status_code} ({resp.reason})")
-        print(f"Response text: {resp.text}")
-        print(f"Response content: {resp.content}")
-        print(f"Consider waiting an hour and increasing --wait")
-        sys.exit(1)
-
 def main():
     parser = argparse.ArgumentParser(description="Replace route elevations files.")
     parser.add_argument("--input", required=True, nargs="+", help="Input GPX file(s).")
     parser.add_argument("--output", required=True, nargs="+", help="Output GPX file(s).")
     parser.add_argument("--overwrite", action="store_true", help="Replace any existing elevation data")
     parser.add_argument("--wait", type=float, default=0.25, help="Wait time between elevation queries (seconds)")
+    parser.add_argument("--dem", nargs="+", type=Path, metavar="PATH",
+                        help="Local DEM tiles (uncompressed GeoTIFF or GridFloat .flt), or directories of them, "
+                             "to sample before falling back to USGS")
+    parser.add_argument("--offline", action="store_true",
+                        help="With --dem, leave points outside every tile unchanged instead of querying USGS")
+    parser.add_argument("--reuse-radius", type=float, default=10.0, metavar="METRES",
+                        help="Interpolate elevations from known samples (other routes' points and past lookups) "
+                             "within this distance instead of looking them up; 0 disables reuse (default: %(default)s)")
+    parser.add_argument("--store", type=Path, default=Path("cache") / "elevation_samples.npz",
+                        help="File of previously looked-up elevations to reuse (default: %(default)s)")
     parser.add_argument("--normalize-after", action="store_true", help="Suppress the normalization reminder (caller will run normalize_gpx.py)")
     args = parser.parse_args()
 
     if len(args.input) != len(args.output):
         raise ValueError("The number of inputs must match the number of outputs.")
+    if args.offline and not args.dem:
+        raise ValueError("--offline needs --dem")
+
+    backends = []
+    if args.dem:
+        try:
+            backends.append(elevation.RasterBackend(args.dem))
+        except elevation.ElevationError as e:
+            raise SystemExit(str(e))
+    if not args.offline:
+        backends.append(elevation.USGSBackend(wait_time=args.wait))
+    backend = elevation.FallbackBackend(backends)
+
+    store = None
+    if args.reuse_radius > 0:
+        store = elevation.ElevationStore(args.reuse_radius)
+        store.load(args.store)
+        # seed with the routes' existing elevations, except those being replaced
+        inputs = {Path(path).resolve() for path in args.input} if args.overwrite else set()
+        store.add_gpx(path for path in rcr.gpx_paths() if path.resolve() not in inputs)
+        saved = sum(store.saved)
 
     is_gpx_modified = False
 
     for inpath, outpath in zip(args.input, args.output):
         # Load GPX
         route = gpxpy.parse(open(inpath, 'r'))
-        # Iterate over all tracks
-        for track in route.tracks:
-            for segment in track.segments:
-                for point in tqdm.tqdm(segment.points):
-                    if not point.elevation or args.overwrite:
-                        point.elevation = query_usgs_elevation(point.latitude, point.longitude, wait_time=args.wait)
-                        is_gpx_modified = True
-
-        # Iterate over all waypoints (pois)
-        for waypoint in route.waypoints:
-            if not waypoint.elevation or args.overwrite:
-                waypoint.elevation = query_usgs_elevation(waypoint.latitude, waypoint.longitude, wait_time=args.wait)
+        # Look up every point that needs an elevation, track points and waypoints (pois), in one batch
+        points = [point for track in route.tracks for segment in track.segments for point in segment.points]
+        points += route.waypoints
+        points = [point for point in points if not point.elevation or args.overwrite]
+        if points:
+            lats = np.array([point.latitude for point in points])
+            lons = np.array([point.longitude for point in points])
+            elevations = store.lookup(lats, lons, backend) if store is not None else backend.elevations(lats, lons)
+            missing = 0
+            for point, value in zip(points, elevations.tolist()):
+                if np.isnan(value):
+                    missing += 1
+                    continue
+                point.elevation = value
                 is_gpx_modified = True
+            if missing:
+                print(f"{inpath}: {missing} of {len(points)} points are outside the DEM tiles and were left unchanged")
 
         # Save GPX
         with open(outpath, 'w') as f:
             f.write(route.to_xml())
 
+    if store is not None and store.lookups:
+        print(f"Reused known elevations for {store.hits} of {store.lookups} points ({store.hit_rate():.0%}) "
+              f"within {args.reuse_radius:g} m")
+        if sum(store.saved) > saved:
+            store.save(args.store)
+
     if is_gpx_modified and not args.normalize_after:
         print("Resulting GPX files will be denormalized. Use `normalize_gpx.py` to fix them before committing.")
 
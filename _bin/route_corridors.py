@@ -0,0 +1,329 @@
+"""Grid index of which routes pass through which part of town.
+
+The all-routes GeoJSON aggregate is rasterized onto a grid of square cells
+(100 m by default) on a local equirectangular projection. Each cell a route
+passes through records the route and the stretch of it, in metres along the
+route, inside the cell (once per pass, so an out-and-back lists a cell
+twice). That answers "which routes pass within 200 m of this corner, and at
+which mile?" or "which routes cross this neighborhood, and where?" with a
+handful of dictionary lookups instead of a scan over every track.
+
+Answers are exact to the cell size: a route counts as near a point if it
+passes through a cell within the radius, so it may be up to a cell diagonal
+further away than asked.
+
+The JSON export lists route IDs once and, per cell key ``"<i>,<j>"``, a flat
+array of (route position, metres along the route where the pass starts,
+length of the pass in metres) triples. A client finds a point's cell with
+the ``origin_latitude`` and ``cell_m`` stored alongside, exactly as
+:func:`CorridorIndex.cell` does.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sys
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import gis
+import rcr
+
+INDEX_VERSION = 1
+DEFAULT_CELL_M = 100.0
+# latitude the projection is true at; distortion within the region we run is well under 1%
+ORIGIN_LATITUDE = 47.6
+
+Cell = tuple[int, int]
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Build the route corridor index, or find routes near a point or in a neighborhood.",
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--input",
+        "-i",
+        metavar="PATH",
+        type=Path,
+        help="FeatureCollection of every route (the all-routes aggregate) to index.",
+    )
+    source.add_argument(
+        "--index",
+        metavar="PATH",
+        type=Path,
+        help="Query a previously written index instead of building one.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        metavar="PATH",
+        type=Path,
+        help="Write the index (and .gz/.br siblings) to PATH.",
+    )
+    parser.add_argument(
+        "--cell-size",
+        type=float,
+        default=DEFAULT_CELL_M,
+        help="Grid cell size in metres (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--near",
+        metavar="LAT,LON",
+        help="List the routes passing near this point, with how far along each route it is.",
+    )
+    parser.add_argument(
+        "--radius",
+        type=float,
+        default=200.0,
+        help="Search radius in metres for --near (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--neighborhood",
+        metavar="NAME",
+        help="List the routes crossing this neighborhood (either its short or long name).",
+    )
+    return parser.parse_args(argv)
+
+
+class CorridorIndex:
+    """Routes per grid cell. Build with :meth:`build` or :meth:`load`."""
+
+    def __init__(self, route_ids: list[str], cells: dict[Cell, list[tuple[int, int, int]]],
+                 cell_m: float = DEFAULT_CELL_M, origin_latitude: float = ORIGIN_LATITUDE):
+        self.route_ids = route_ids
+        # per cell, (route position, start, end) in metres along the route for every pass
+        self.cells = cells
+        self.cell_m = cell_m
+        self.origin_latitude = origin_latitude
+        self.ky = math.radians(1) * gis.EARTH_RADIUS_M
+        self.kx = self.ky * math.cos(math.radians(origin_latitude))
+
+    def project(self, lon: float, lat: float) -> tuple[float, float]:
+        return lon * self.kx, lat * self.ky
+
+    def cell(self, lon: float, lat: float) -> Cell:
+        x, y = self.project(lon, lat)
+        return math.floor(x / self.cell_m), math.floor(y / self.cell_m)
+
+    @classmethod
+    def build(cls, routes: Iterable[tuple[str, Sequence[Sequence[float]]]],
+              cell_m: float = DEFAULT_CELL_M) -> "CorridorIndex":
+        """Index ``(route_id, [[lon, lat, ...], ...])`` pairs."""
+        index = cls([], {}, cell_m)
+        for position, (route_id, coordinates) in enumerate(routes):
+            index.route_ids.append(route_id)
+            for cell, start, end in index.passes(coordinates):
+                index.cells.setdefault(cell, []).append((position, round(start), round(end)))
+        return index
+
+    def passes(self, coordinates: Sequence[Sequence[float]]) -> list[list]:
+        """The cells a line passes through, as [cell, start, end] in metres along the line.
+
+        The line is walked in steps of a quarter cell, so it cannot skip a cell
+        it crosses by more than that. Re-entering a cell within two cells' walk
+        of the last visit (zig-zagging along a cell edge) extends the same pass.
+        """
+        if not coordinates:
+            return []
+        step = self.cell_m / 4
+        rejoin = 2 * self.cell_m
+        out: list[list] = []
+        last_pass: dict[Cell, list] = {}
+        current = None
+        along = 0.0
+        xs, ys = zip(*(self.project(c[0], c[1]) for c in coordinates))
+
+        def visit(cell: Cell, distance: float) -> None:
+            nonlocal current
+            if cell != current:
+                current = cell
+                if cell not in last_pass or distance - last_pass[cell][2] > rejoin:
+                    last_pass[cell] = [cell, distance, distance]
+                    out.append(last_pass[cell])
+            last_pass[cell][2] = distance
+
+        visit((math.floor(xs[0] / self.cell_m), math.floor(ys[0] / self.cell_m)), 0.0)
+        for i in range(1, len(xs)):
+            dx, dy = xs[i] - xs[i - 1], ys[i] - ys[i - 1]
+            length = math.hypot(dx, dy)
+            samples = max(1, math.ceil(length / step))
+            for k in range(1, samples + 1):
+                t = k / samples
+                x, y = xs[i - 1] + t * dx, ys[i - 1] + t * dy
+                visit((math.floor(x / self.cell_m), math.floor(y / self.cell_m)), along + t * length)
+            along += length
+        return out
+
+    def _collect(self, cells: Iterable[Cell]) -> dict[str, list[tuple[int, int]]]:
+        """Route ID -> (start, end) in metres along the route of each pass through ``cells``.
+
+        Passes through neighbouring cells are joined into one; gaps of up to
+        two cells are bridged, so clipping a corner outside the area does not
+        split a pass.
+        """
+        found: dict[int, list[tuple[int, int]]] = {}
+        for cell in cells:
+            for position, start, end in self.cells.get(cell, ()):
+                found.setdefault(position, []).append((start, end))
+        result = {}
+        for position, spans in found.items():
+            spans.sort()
+            joined = [list(spans[0])]
+            for start, end in spans[1:]:
+                if start <= joined[-1][1] + 2 * self.cell_m:
+                    joined[-1][1] = max(joined[-1][1], end)
+                else:
+                    joined.append([start, end])
+            result[self.route_ids[position]] = [tuple(span) for span in joined]
+        return dict(sorted(result.items()))
+
+    def routes_near(self, lat: float, lon: float, radius_m: float = 200.0) -> dict[str, list[tuple[int, int]]]:
+        """Routes passing within about ``radius_m`` of a point.
+
+        Maps each route ID to the (start, end) distances along it, in metres,
+        of every pass near the point.
+        """
+        x, y = self.project(lon, lat)
+        size = self.cell_m
+        ci, cj = math.floor(x / size), math.floor(y / size)
+        reach = math.ceil(radius_m / size)
+        cells = []
+        for i in range(ci - reach, ci + reach + 1):
+            for j in range(cj - reach, cj + reach + 1):
+                # distance from the point to the nearest edge of the cell
+                dx = max(i * size - x, 0.0, x - (i + 1) * size)
+                dy = max(j * size - y, 0.0, y - (j + 1) * size)
+                if dx * dx + dy * dy <= radius_m * radius_m:
+                    cells.append((i, j))
+        return self._collect(cells)
+
+    def routes_in_polygon(self, geometry: list) -> dict[str, list[tuple[int, int]]]:
+        """Routes crossing a MultiPolygon (a list of polygons, each a list of [lon, lat] rings).
+
+        Only the outer ring of each polygon is considered, as in
+        :func:`gis.is_point_in_polygon`. A route crosses the polygon if it
+        passes through a cell whose centre is inside it.
+        """
+        min_x, max_x, min_y, max_y = gis.calculate_bounding_box(geometry)
+        lo_i, lo_j = self.cell(min_x, min_y)
+        hi_i, hi_j = self.cell(max_x, max_y)
+        half = self.cell_m / 2
+        cells = []
+        for i, j in self.cells:
+            if lo_i <= i <= hi_i and lo_j <= j <= hi_j:
+                lon = (i * self.cell_m + half) / self.kx
+                lat = (j * self.cell_m + half) / self.ky
+                if gis.is_point_in_polygon(lon, lat, geometry):
+                    cells.append((i, j))
+        return self._collect(cells)
+
+    def to_json(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "cell_m": self.cell_m,
+            "origin_latitude": self.origin_latitude,
+            "routes": self.route_ids,
+            "cells": {
+                f"{i},{j}": [value for position, start, end in entries for value in (position, start, end - start)]
+                for (i, j), entries in sorted(self.cells.items())
+            },
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "CorridorIndex":
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError("Corridor index was written by a different version of route_corridors.py; rebuild it")
+        cells = {}
+        for key, flat in data["cells"].items():
+            i, j = key.split(",")
+            cells[int(i), int(j)] = [
+                (position, start, start + length)
+                for position, start, length in zip(flat[::3], flat[1::3], flat[2::3])
+            ]
+        return cls(data["routes"], cells, data["cell_m"], data["origin_latitude"])
+
+    @classmethod
+    def load(cls, path: Path) -> "CorridorIndex":
+        with path.open("r", encoding="utf-8") as fh:
+            return cls.from_json(json.load(fh))
+
+
+def load_route_lines(path: Path) -> list[tuple[str, list]]:
+    """(route ID, coordinates) for each LineString feature of a FeatureCollection."""
+    try:
+        with path.open("r", encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (OSError, json.JSONDecodeError) as exc:
+        raise ValueError(f"Failed to read GeoJSON from {path}: {exc}") from exc
+    if data.get("type") != "FeatureCollection":
+        raise ValueError(f"Expected a FeatureCollection in {path}")
+
+    lines = []
+    for index, feature in enumerate(data.get("features") or []):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "LineString":
+            raise ValueError(f"Feature #{index} in {path} is not a LineString")
+        route_id = (feature.get("properties") or {}).get("id")
+        if not isinstance(route_id, str):
+            raise ValueError(f"Feature #{index} in {path} has no string 'id' property")
+        lines.append((route_id, geometry["coordinates"]))
+    return lines
+
+
+def neighborhood_geometry(name: str) -> list:
+    """The MultiPolygon of every neighborhood whose short or long name is ``name``."""
+    wanted = name.casefold()
+    geometry = [
+        polygon
+        for (short_name, long_name), (shape, _bbox) in rcr.load_neighborhoods().items()
+        if wanted in (short_name.casefold(), long_name.casefold())
+        for polygon in shape
+    ]
+    if not geometry:
+        raise ValueError(f"No neighborhood named {name!r} in {rcr.NEIGHBORHOOD_FILE}")
+    return geometry
+
+
+def print_matches(matches: dict[str, list[tuple[int, int]]]) -> None:
+    for route_id, spans in matches.items():
+        miles = ", ".join(f"{start / 1609.344:.1f}-{end / 1609.344:.1f}" for start, end in spans)
+        print(f"{route_id}\tmi {miles}")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.cell_size <= 0:
+        raise SystemExit("--cell-size must be positive")
+
+    try:
+        if args.index:
+            index = CorridorIndex.load(args.index)
+        else:
+            index = CorridorIndex.build(load_route_lines(args.input), args.cell_size)
+
+        if args.output:
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            rcr.write_with_variants(args.output, json.dumps(index.to_json(), separators=(",", ":")).encode("utf-8"))
+            print(f"Indexed {len(index.route_ids)} routes over {len(index.cells)} cells into {args.output}",
+                  file=sys.stderr)
+
+        if args.near:
+            try:
+                lat, lon = (float(value) for value in args.near.split(","))
+            except ValueError:
+                raise ValueError(f"--near expects LAT,LON, got {args.near!r}") from None
+            print_matches(index.routes_near(lat, lon, args.radius))
+        if args.neighborhood:
+            print_matches(index.routes_in_polygon(neighborhood_geometry(args.neighborhood)))
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
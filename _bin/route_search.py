@@ -0,0 +1,391 @@
+"""Build and query an inverted search index over the routes table.
+
+The index is built from ``_data/routes.yml`` (see ``make_routes_table.py``)
+and the location database, and answers queries such as::
+
+  type:loop start:cse distance:5-7
+  green lake ascent:<100
+
+Plain words are matched against route names, IDs, start/end locations (IDs
+and names), neighborhoods, route types and notes. Each word must appear as
+the prefix of a token or, for words of three or more characters, anywhere
+inside one (via trigram postings). Routes whose tokens start with every word
+are listed first. ``field:value`` terms filter on one attribute:
+
+  type, start (from), end (to), neighborhood (in)   prefix of the value
+  distance (mi), ascent (gain)                      a number or range
+
+Ranges are written ``5-7``, ``>=5``, ``<7`` or ``5..7``; a bare number
+matches within half a unit (half a mile, or 25 m of ascent).
+
+Postings are sets of positions in the routes table. In memory they are
+Python ints used as bitsets, so a query is a handful of integer ANDs and
+ORs. On disk each posting list is delta-encoded, and distance and ascent
+are additionally bucketed so range queries only touch a few postings before
+checking the exact values at the bucket edges. The JSON file (plus
+``.gz``/``.br`` siblings) is written by ``make route-search``.
+
+This is a command-line tool: the routes page's filter box doesn't load the
+index and still filters the table with Tabulator.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import rcr
+
+INDEX_VERSION = 1
+# prefixes are indexed up to this length; longer words also need their trigrams to match
+PREFIX_LENGTH = 8
+BUCKET_WIDTHS = {"distance_mi": 1.0, "ascent_m": 50.0}
+
+FIELD_ALIASES = {
+    "type": "type",
+    "start": "start",
+    "from": "start",
+    "end": "end",
+    "to": "end",
+    "neighborhood": "neighborhood",
+    "in": "neighborhood",
+}
+RANGE_ALIASES = {
+    "distance": "distance_mi",
+    "mi": "distance_mi",
+    "ascent": "ascent_m",
+    "gain": "ascent_m",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_NUMBER = r"(\d+(?:\.\d*)?|\.\d+)"
+_RANGE_RE = re.compile(rf"^{_NUMBER}(?:-|\.\.){_NUMBER}$")
+_BOUND_RE = re.compile(rf"^(<=|>=|<|>|=)?{_NUMBER}$")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Lowercase alphanumeric runs of ``text``."""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def normalize(value: str) -> str:
+    """Collapse a field value to its lowercase alphanumerics, e.g. "Green Lake" -> "greenlake"."""
+    return "".join(tokenize(value))
+
+
+def trigrams(token: str) -> set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def parse_range(text: str, width: float) -> tuple[float, float]:
+    """Parse ``5-7``, ``>=5``, ``<7`` or ``5`` into an inclusive (low, high) pair.
+
+    Strict bounds exclude the bound itself; a bare number matches within
+    half of ``width``.
+    """
+    match = _RANGE_RE.match(text)
+    if match:
+        low, high = float(match.group(1)), float(match.group(2))
+        if low > high:
+            raise ValueError(f"Empty range: {text!r}")
+        return low, high
+    match = _BOUND_RE.match(text)
+    if not match:
+        raise ValueError(f"Not a number or range: {text!r}")
+    op, value = match.group(1), float(match.group(2))
+    if op in ("<", "<="):
+        return -math.inf, math.nextafter(value, -math.inf) if op == "<" else value
+    if op in (">", ">="):
+        return math.nextafter(value, math.inf) if op == ">" else value, math.inf
+    if op == "=":
+        return value, value
+    return value - width / 2, value + width / 2
+
+
+def _encode_postings(bits: int) -> list[int]:
+    """Delta-encode the set bit positions of ``bits``."""
+    out = []
+    previous = 0
+    position = 0
+    while bits:
+        if bits & 1:
+            out.append(position - previous)
+            previous = position
+        bits >>= 1
+        position += 1
+    return out
+
+
+def _decode_postings(deltas: Iterable[int]) -> int:
+    bits = 0
+    position = 0
+    for delta in deltas:
+        position += delta
+        bits |= 1 << position
+    return bits
+
+
+def _members(bits: int) -> Iterable[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class RouteSearchIndex:
+    """Inverted index over the routes table. Build with :meth:`build` or :meth:`load`."""
+
+    def __init__(self, ids: list[str], values: dict[str, list[float | None]],
+                 prefixes: dict[str, int], trigram_postings: dict[str, int],
+                 fields: dict[str, dict[str, int]], buckets: dict[str, dict[int, int]]):
+        self.ids = ids
+        self.values = values
+        self.prefixes = prefixes
+        self.trigrams = trigram_postings
+        self.fields = fields
+        self.buckets = buckets
+        self.all = (1 << len(ids)) - 1
+
+    @classmethod
+    def build(cls, routes: Sequence[dict], locations: Sequence[dict] = ()) -> "RouteSearchIndex":
+        """Index ``routes`` (rows of routes.yml), naming start/end points from ``locations``."""
+        location_names = {loc["id"]: loc.get("name") or "" for loc in locations}
+        prefixes: dict[str, int] = {}
+        trigram_postings: dict[str, int] = {}
+        fields: dict[str, dict[str, int]] = {field: {} for field in set(FIELD_ALIASES.values())}
+        buckets: dict[str, dict[int, int]] = {name: {} for name in BUCKET_WIDTHS}
+        values: dict[str, list[float | None]] = {name: [] for name in BUCKET_WIDTHS}
+
+        def add(postings: dict, key: str, bit: int) -> None:
+            postings[key] = postings.get(key, 0) | bit
+
+        for position, route in enumerate(routes):
+            bit = 1 << position
+            start, end = route.get("start") or "", route.get("end") or ""
+            neighborhoods = set(route.get("neighborhoods") or [])
+            neighborhoods.update(filter(None, (route.get("start_neighborhood"), route.get("end_neighborhood"))))
+
+            text = [route.get("name"), route["id"], route.get("type"), route.get("notes"),
+                    start, end, location_names.get(start), location_names.get(end), *neighborhoods]
+            for token in {token for part in text for token in tokenize(part)}:
+                for length in range(1, min(len(token), PREFIX_LENGTH) + 1):
+                    add(prefixes, token[:length], bit)
+                for trigram in trigrams(token):
+                    add(trigram_postings, trigram, bit)
+
+            add(fields["type"], normalize(route.get("type") or ""), bit)
+            for field, location in (("start", start), ("end", end)):
+                for value in (location, location_names.get(location)):
+                    if value:
+                        add(fields[field], normalize(value), bit)
+            for neighborhood in neighborhoods:
+                add(fields["neighborhood"], normalize(neighborhood), bit)
+
+            for name, width in BUCKET_WIDTHS.items():
+                value = route.get(name)
+                if value is not None:
+                    value = round(float(value), 1)
+                    add(buckets[name], math.floor(value / width), bit)
+                values[name].append(value)
+
+        return cls([route["id"] for route in routes], values, prefixes, trigram_postings, fields, buckets)
+
+    def to_json(self) -> dict:
+        """Serializable form of the index; every posting list is delta-encoded."""
+        def encode(postings: dict) -> dict:
+            return {str(key): _encode_postings(bits) for key, bits in sorted(postings.items())}
+
+        return {
+            "version": INDEX_VERSION,
+            "prefix_length": PREFIX_LENGTH,
+            "ids": self.ids,
+            "values": self.values,
+            "prefixes": encode(self.prefixes),
+            "trigrams": encode(self.trigrams),
+            "fields": {field: encode(postings) for field, postings in sorted(self.fields.items())},
+            "buckets": {
+                name: {"width": BUCKET_WIDTHS[name], "postings": encode(postings)}
+                for name, postings in sorted(self.buckets.items())
+            },
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "RouteSearchIndex":
+        if data.get("version") != INDEX_VERSION or data.get("prefix_length") != PREFIX_LENGTH:
+            raise ValueError("Search index was written by a different version of route_search.py; rebuild it")
+        if {name: bucket["width"] for name, bucket in data["buckets"].items()} != BUCKET_WIDTHS:
+            raise ValueError("Search index uses different bucket widths; rebuild it")
+
+        def decode(postings: dict, key=str) -> dict:
+            return {key(k): _decode_postings(deltas) for k, deltas in postings.items()}
+
+        return cls(
+            data["ids"],
+            data["values"],
+            decode(data["prefixes"]),
+            decode(data["trigrams"]),
+            {field: decode(postings) for field, postings in data["fields"].items()},
+            {name: decode(bucket["postings"], int) for name, bucket in data["buckets"].items()},
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "RouteSearchIndex":
+        with path.open("r", encoding="utf-8") as fh:
+            return cls.from_json(json.load(fh))
+
+    def word(self, word: str) -> tuple[int, int]:
+        """Routes matching one plain word: (tokens start with it, tokens contain it)."""
+        prefix = self.prefixes.get(word[:PREFIX_LENGTH], 0)
+        if len(word) < 3:
+            return prefix, prefix
+        contains = self.all
+        for trigram in trigrams(word):
+            contains &= self.trigrams.get(trigram, 0)
+            if not contains:
+                break
+        return prefix & contains, contains
+
+    def field(self, field: str, value: str) -> int:
+        """Routes whose ``field`` has a value starting with ``value``."""
+        value = normalize(value)
+        bits = 0
+        for key, postings in self.fields[field].items():
+            if key.startswith(value):
+                bits |= postings
+        return bits
+
+    def range(self, name: str, low: float, high: float) -> int:
+        """Routes whose ``name`` value lies in [low, high]."""
+        postings = self.buckets[name]
+        if not postings:
+            return 0
+        width = BUCKET_WIDTHS[name]
+        first = max(math.floor(low / width), min(postings)) if low > -math.inf else min(postings)
+        last = min(math.floor(high / width), max(postings)) if high < math.inf else max(postings)
+        inner = edges = 0
+        for bucket in range(first, last + 1):
+            if bucket in (first, last):
+                edges |= postings.get(bucket, 0)
+            else:
+                inner |= postings.get(bucket, 0)
+        values = self.values[name]
+        for position in _members(edges):
+            if low <= values[position] <= high:
+                inner |= 1 << position
+        return inner
+
+    def search(self, words: Iterable[str] = (), *, type: str | None = None,
+               start: str | None = None, end: str | None = None, neighborhood: str | None = None,
+               distance_mi: tuple[float, float] | None = None,
+               ascent_m: tuple[float, float] | None = None) -> list[str]:
+        """Route IDs matching every word and filter, best matches first, otherwise in table order."""
+        prefix = contains = self.all
+        for word in words:
+            for token in tokenize(word):
+                word_prefix, word_contains = self.word(token)
+                prefix &= word_prefix
+                contains &= word_contains
+        filters = self.all
+        for field, value in (("type", type), ("start", start), ("end", end), ("neighborhood", neighborhood)):
+            if value is not None:
+                filters &= self.field(field, value)
+        for name, bounds in (("distance_mi", distance_mi), ("ascent_m", ascent_m)):
+            if bounds is not None:
+                filters &= self.range(name, *bounds)
+
+        best = prefix & filters
+        rest = contains & filters & ~best
+        return [self.ids[position] for bits in (best, rest) for position in _members(bits)]
+
+    def query(self, text: str) -> list[str]:
+        """Run a query string such as ``type:loop start:cse distance:5-7``."""
+        words = []
+        filters: dict = {}
+        for term in text.split():
+            name, sep, value = term.partition(":")
+            name = name.lower()
+            if not sep:
+                words.append(term)
+            elif name in FIELD_ALIASES:
+                filters[FIELD_ALIASES[name]] = value
+            elif name in RANGE_ALIASES:
+                field = RANGE_ALIASES[name]
+                filters[field] = parse_range(value, BUCKET_WIDTHS[field])
+            else:
+                raise ValueError(f"Unknown search field {name!r} in {term!r}")
+        return self.search(words, **filters)
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Build the route search index, or run queries against it.",
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--routes",
+        metavar="PATH",
+        type=Path,
+        default=Path(rcr.DATA) / "routes.yml",
+        help="Routes table to index (default: %(default)s).",
+    )
+    source.add_argument(
+        "--index",
+        metavar="PATH",
+        type=Path,
+        help="Query a previously written index instead of building one.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        metavar="PATH",
+        type=Path,
+        help="Write the index (and .gz/.br siblings) to PATH.",
+    )
+    parser.add_argument(
+        "queries",
+        nargs="*",
+        metavar="QUERY",
+        help='Queries to run, e.g. "type:loop start:cse distance:5-7".',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        if args.index:
+            index = RouteSearchIndex.load(args.index)
+        else:
+            routes = rcr.load_yaml(args.routes) or []
+            index = RouteSearchIndex.build(routes, rcr.load_loc_db())
+    except (OSError, ValueError) as exc:
+        raise SystemExit(str(exc)) from exc
+
+    if args.output:
+        data = json.dumps(index.to_json(), separators=(",", ":")).encode("utf-8")
+        sizes = rcr.write_with_variants(args.output, data)
+        summary = ", ".join(f"{suffix or 'raw'} {size:,} bytes" for suffix, size in sizes.items())
+        print(f"Indexed {len(index.ids)} routes into {args.output} ({summary})")
+
+    for text in args.queries:
+        try:
+            start = time.perf_counter()
+            matches = index.query(text)
+            elapsed = time.perf_counter() - start
+        except ValueError as exc:
+            raise SystemExit(str(exc)) from exc
+        print(f"{text!r}: {len(matches)} routes in {elapsed * 1e6:.0f}us", file=sys.stderr)
+        for route_id in matches:
+            print(route_id)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,275 @@
+"""Find routes whose geometry nearly duplicates another route's.
+
+Comparing every pair of tracks point by point is quadratic in both routes
+and points, so this works in two stages:
+
+1. Candidates. Each route is fingerprinted by the set of grid cells it
+   passes through (its *shingles*, see ``route_corridors.py``), summarized
+   by a MinHash signature. Locality-sensitive hashing over bands of the
+   signature pairs up routes whose cell sets are likely to overlap heavily,
+   without comparing every pair; candidates whose estimated Jaccard
+   similarity is below ``min_jaccard`` are dropped.
+2. Confirmation. Candidate pairs are compared by discrete Fréchet
+   distance between the tracks resampled every ``RESAMPLE_STEP_M`` metres,
+   in both directions so a loop run the other way round still counts.
+   A vectorized row-by-row free-space test rejects most pairs quickly;
+   the exact distance of the pairs within ``max_frechet_m`` is then
+   computed one anti-diagonal at a time with numpy.
+
+Similar pairs are grouped into clusters (connected components).
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Mapping, Sequence
+
+import numpy as np
+
+from route_corridors import CorridorIndex, load_route_lines
+
+SHINGLE_CELL_M = 100.0
+NUM_HASHES = 128
+# 32 bands of 4 rows: pairs with Jaccard similarity 0.6 become candidates ~98% of the time
+BANDS = 32
+MIN_JACCARD = 0.5
+MAX_FRECHET_M = 100.0
+RESAMPLE_STEP_M = 20.0
+# cap on resampled points per route, so very long routes are compared at a coarser step
+MAX_POINTS = 1500
+
+
+@dataclass(frozen=True)
+class Similarity:
+    route_id: str
+    other_id: str
+    jaccard: float
+    frechet_m: float
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Report clusters of routes with nearly identical geometry.",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        metavar="PATH",
+        type=Path,
+        required=True,
+        help="FeatureCollection of every route (the all-routes aggregate).",
+    )
+    parser.add_argument(
+        "--max-frechet",
+        type=float,
+        default=MAX_FRECHET_M,
+        help="Largest discrete Fréchet distance in metres between similar routes (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--min-jaccard",
+        type=float,
+        default=MIN_JACCARD,
+        help="Smallest estimated grid-cell Jaccard similarity of candidate pairs (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def shingles(grid: CorridorIndex, coordinates: Sequence[Sequence[float]]) -> np.ndarray:
+    """Distinct grid cells a [lon, lat] line passes through, packed into 64-bit integers."""
+    cells = {cell for cell, _start, _end in grid.passes(coordinates)}
+    return np.array(sorted(((i & 0xFFFFFFFF) << 32) | (j & 0xFFFFFFFF) for i, j in cells), dtype=np.uint64)
+
+
+def _mix64(z: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer; uint64 arithmetic wraps, which is what we want here
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def minhash_signatures(shingle_sets: Sequence[np.ndarray], num_hashes: int = NUM_HASHES,
+                       seed: int = 0) -> np.ndarray:
+    """One MinHash signature row per shingle set.
+
+    Hash ``k`` of a shingle is the splitmix64 mix of the shingle XOR a random
+    seed. Neighbouring cells have nearly equal keys, so a weaker (affine)
+    hash would pick the same minimum cell for every ``k``.
+    """
+    seeds = np.random.default_rng(seed).integers(0, np.iinfo(np.uint64).max, size=num_hashes,
+                                                 dtype=np.uint64, endpoint=True)
+    signatures = np.full((len(shingle_sets), num_hashes), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for row, values in enumerate(shingle_sets):
+        if len(values):
+            signatures[row] = _mix64(values[:, None] ^ seeds).min(axis=0)
+    return signatures
+
+
+def lsh_candidates(signatures: np.ndarray, bands: int = BANDS) -> set[tuple[int, int]]:
+    """Pairs of rows whose signatures agree on every row of at least one band."""
+    rows = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets: dict[bytes, list[int]] = {}
+        for index, key in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            buckets.setdefault(key.tobytes(), []).append(index)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
+
+
+def resample(grid: CorridorIndex, coordinates: Sequence[Sequence[float]],
+             step_m: float = RESAMPLE_STEP_M, max_points: int = MAX_POINTS) -> np.ndarray:
+    """Projected (x, y) points every ``step_m`` metres along a [lon, lat] line (n x 2, metres)."""
+    points = np.array([grid.project(c[0], c[1]) for c in coordinates], dtype=float)
+    if len(points) < 2:
+        return points
+    along = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))))
+    count = min(max_points, max(2, math.ceil(along[-1] / step_m) + 1))
+    targets = np.linspace(0.0, along[-1], count)
+    return np.column_stack((np.interp(targets, along, points[:, 0]), np.interp(targets, along, points[:, 1])))
+
+
+def _distances(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    return np.hypot(p[:, None, 0] - q[None, :, 0], p[:, None, 1] - q[None, :, 1])
+
+
+def frechet_within(p: np.ndarray, q: np.ndarray, limit: float) -> bool:
+    """Whether the discrete Fréchet distance between ``p`` and ``q`` is at most ``limit``.
+
+    Decides reachability in the free space (pairs of points within
+    ``limit``) one row at a time: a cell is reachable if it is free and
+    reachable from the row above, or from a reachable cell to its left
+    through free cells. Most dissimilar pairs are rejected by their end
+    points, by a point with no partner within ``limit``, or after a few rows.
+    """
+    # the first and last points are always coupled, so check them before building the whole table
+    if np.hypot(*(p[0] - q[0])) > limit or np.hypot(*(p[-1] - q[-1])) > limit:
+        return False
+    free = _distances(p, q) <= limit
+    if not (free.any(axis=1).all() and free.any(axis=0).all()):
+        return False
+    columns = np.arange(free.shape[1])
+    reach = np.logical_and.accumulate(free[0])
+    for row in free[1:]:
+        entered = row & (reach | np.concatenate(([False], reach[:-1])))
+        # carry each entry point rightwards until the next blocked cell
+        run = np.cumsum(~row)
+        last_entry = np.maximum.accumulate(np.where(entered, columns, -1))
+        reach = row & (last_entry >= 0) & (run[np.maximum(last_entry, 0)] == run)
+        if not reach.any():
+            return False
+    return bool(reach[-1])
+
+
+def discrete_frechet(p: np.ndarray, q: np.ndarray) -> float:
+    """Discrete Fréchet distance between two point sequences (n x 2 and m x 2 arrays).
+
+    The coupling table is filled one anti-diagonal at a time: every cell of
+    a diagonal depends only on the previous two, so each diagonal is a few
+    vectorized operations.
+    """
+    n, m = len(p), len(q)
+    distances = _distances(p, q)
+    coupling = np.full((n, m), np.inf)
+    coupling[0, 0] = distances[0, 0]
+    for k in range(1, n + m - 1):
+        i = np.arange(max(0, k - m + 1), min(n, k + 1))
+        j = k - i
+        best = np.full(len(i), np.inf)
+        has_up = i > 0
+        has_left = j > 0
+        both = has_up & has_left
+        best[has_up] = coupling[i[has_up] - 1, j[has_up]]
+        best[has_left] = np.minimum(best[has_left], coupling[i[has_left], j[has_left] - 1])
+        best[both] = np.minimum(best[both], coupling[i[both] - 1, j[both] - 1])
+        coupling[i, j] = np.maximum(best, distances[i, j])
+    return float(coupling[-1, -1])
+
+
+def oriented_frechet(p: np.ndarray, q: np.ndarray, limit: float) -> float:
+    """Fréchet distance between ``p`` and ``q`` taken either way round, or ``inf`` if over ``limit``.
+
+    The exact distance is only computed for orientations already known to
+    be within ``limit``.
+    """
+    best = math.inf
+    for other in (q, q[::-1]):
+        if frechet_within(p, other, limit):
+            best = min(best, discrete_frechet(p, other))
+    return best
+
+
+def find_similar(routes: Mapping[str, Sequence[Sequence[float]]], max_frechet_m: float = MAX_FRECHET_M,
+                 min_jaccard: float = MIN_JACCARD) -> list[Similarity]:
+    """Pairs of similar routes among ``routes`` (route ID -> [lon, lat, ...] positions)."""
+    grid = CorridorIndex([], {}, SHINGLE_CELL_M)
+    route_ids = sorted(routes)
+    shingle_sets = [shingles(grid, routes[route_id]) for route_id in route_ids]
+    signatures = minhash_signatures(shingle_sets)
+
+    similar = []
+    resampled: dict[int, np.ndarray] = {}
+    for x, y in sorted(lsh_candidates(signatures)):
+        jaccard = float(np.mean(signatures[x] == signatures[y]))
+        if jaccard < min_jaccard:
+            continue
+        for index in (x, y):
+            if index not in resampled:
+                resampled[index] = resample(grid, routes[route_ids[index]])
+        frechet = oriented_frechet(resampled[x], resampled[y], max_frechet_m)
+        if frechet <= max_frechet_m:
+            similar.append(Similarity(route_ids[x], route_ids[y], round(jaccard, 2), round(frechet, 1)))
+    return similar
+
+
+def clusters(similar: Sequence[Similarity]) -> list[list[str]]:
+    """Connected groups of similar routes, each sorted, largest first."""
+    parent: dict[str, str] = {}
+
+    def find(route_id: str) -> str:
+        parent.setdefault(route_id, route_id)
+        while parent[route_id] != route_id:
+            parent[route_id] = parent[parent[route_id]]
+            route_id = parent[route_id]
+        return route_id
+
+    for pair in similar:
+        parent[find(pair.route_id)] = find(pair.other_id)
+    groups: dict[str, list[str]] = {}
+    for route_id in parent:
+        groups.setdefault(find(route_id), []).append(route_id)
+    return sorted((sorted(group) for group in groups.values()), key=lambda group: (-len(group), group))
+
+
+def similar_routes(similar: Sequence[Similarity]) -> dict[str, list[str]]:
+    """Route ID -> IDs of the routes similar to it."""
+    out: dict[str, list[str]] = {}
+    for pair in similar:
+        out.setdefault(pair.route_id, []).append(pair.other_id)
+        out.setdefault(pair.other_id, []).append(pair.route_id)
+    return {route_id: sorted(others) for route_id, others in sorted(out.items())}
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        routes = dict(load_route_lines(args.input))
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    similar = find_similar(routes, args.max_frechet, args.min_jaccard)
+    for pair in similar:
+        print(f"{pair.route_id}  {pair.other_id}  jaccard~{pair.jaccard:.2f}  frechet {pair.frechet_m:.0f} m")
+    groups = clusters(similar)
+    print(f"{len(groups)} clusters of similar routes among {len(routes)} routes")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+"""Split photo-urls.json into small chunk files for the photo carousel.
+
+The carousel only shows a handful of photos per page view, so instead of
+fetching the whole URL list it reads a tiny index and then one randomly chosen
+chunk. URLs are deduplicated (keeping first occurrence order) and every output
+file also gets precompressed ``.gz`` and ``.br`` siblings for servers that
+can serve them directly.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Sequence
+
+from rcr import encode_variants, write_with_variants
+
+INDEX_NAME = "index.json"
+# Files this tool writes: the index and numbered chunks, each with its compressed siblings
+OUTPUT_FILE_RE = re.compile(r"^(?:index|\d{3,})\.json(?:\.gz|\.br)?$")
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Shard the photo carousel URL list into fixed-size chunks.",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        metavar="PATH",
+        type=Path,
+        required=True,
+        help="JSON array of photo URLs.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        metavar="DIR",
+        type=Path,
+        required=True,
+        help="Directory to write the index and chunk files to (shards from the previous run are replaced).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=32,
+        help="Number of URLs per chunk (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Report bytes transferred per page view before and after sharding.",
+    )
+    return parser.parse_args(argv)
+
+
+def load_urls(path: Path) -> list[str]:
+    """Return the unique URLs in ``path`` in their original order."""
+    with path.open("r", encoding="utf-8") as fh:
+        urls = json.load(fh)
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        raise ValueError(f"Expected a JSON array of URL strings in {path}")
+    return list(dict.fromkeys(url.strip() for url in urls if url.strip()))
+
+
+def chunk_name(chunk_index: int) -> str:
+    return f"{chunk_index:03d}.json"
+
+
+def clear_shards(output_dir: Path) -> None:
+    """Remove the index and chunk files a previous run wrote to ``output_dir``, and nothing else.
+
+    A non-empty directory without an index wasn't written by this tool, so it is refused outright.
+    """
+    if not output_dir.exists():
+        return
+    if not output_dir.is_dir():
+        raise ValueError(f"{output_dir} is not a directory")
+    entries = list(output_dir.iterdir())
+    if entries and not (output_dir / INDEX_NAME).is_file():
+        raise ValueError(f"{output_dir} is not empty and has no {INDEX_NAME}; refusing to write shards into it")
+    for entry in entries:
+        if entry.is_file() and OUTPUT_FILE_RE.match(entry.name):
+            entry.unlink()
+
+
+def shard(urls: list[str], output_dir: Path, chunk_size: int) -> tuple[dict[str, int], list[dict[str, int]]]:
+    """Write chunk files and the index. Returns (index sizes, per-chunk sizes)."""
+    clear_shards(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    chunk_sizes = []
+    for chunk_index, start in enumerate(range(0, len(urls), chunk_size)):
+        data = json.dumps(urls[start:start + chunk_size], separators=(",", ":")).encode("utf-8")
+        chunk_sizes.append(write_with_variants(output_dir / chunk_name(chunk_index), data))
+
+    # Chunk file names are derived from their position, so the index only needs the count
+    index = {"count": len(urls), "chunk_size": chunk_size, "chunks": len(chunk_sizes)}
+    index_data = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    return write_with_variants(output_dir / INDEX_NAME, index_data), chunk_sizes
+
+
+def report_benchmark(source: Path, index_sizes: dict[str, int], chunk_sizes: list[dict[str, int]]) -> None:
+    """Print bytes transferred per carousel page view, before and after sharding."""
+    before = {suffix: len(payload) for suffix, payload in encode_variants(source.read_bytes()).items()}
+    print("Bytes per page view (first chunk):")
+    print(f"  {'encoding':<10}{'before':>12}{'after':>12}{'saved':>8}")
+    for suffix, label in (("", "identity"), (".gz", "gzip"), (".br", "brotli")):
+        mean_chunk = sum(sizes[suffix] for sizes in chunk_sizes) / max(1, len(chunk_sizes))
+        after = index_sizes[suffix] + mean_chunk
+        saved = 1 - after / before[suffix]
+        print(f"  {label:<10}{before[suffix]:>12,}{after:>12,.0f}{saved:>8.1%}")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.chunk_size < 1:
+        raise SystemExit("--chunk-size must be positive")
+
+    try:
+        urls = load_urls(args.input)
+        index_sizes, chunk_sizes = shard(urls, args.output_dir, args.chunk_size)
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    print(f"Wrote {len(urls)} unique URLs in {len(chunk_sizes)} chunks to {args.output_dir}")
+    if args.benchmark:
+        report_benchmark(args.input, index_sizes, chunk_sizes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
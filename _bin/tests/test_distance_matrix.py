@@ -0,0 +1,154 @@
+"""MatrixClient against a local stand-in for the route matrix endpoint.
+
+The stand-in answers every origin/destination pair with a duration of one
+second per 0.00001 degrees of latitude between them, can be told to fail
+its next few requests, and rejects any request naming an origin at
+``BAD_LAT``.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import distance_matrix
+
+BAD_LAT = 48.0
+SATURDAY_0830 = datetime(2026, 10, 24, 8, 30, tzinfo=distance_matrix.LOCAL_TIMEZONE)
+
+
+def duration(origin, destination):
+    return round(abs(origin[0] - destination[0]) * 100000)
+
+
+class StandIn(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.requests = []  # (origins, destinations) of every request, failed or not
+        self.failures = []  # status codes for the next requests to return
+        self.arrival_times = []  # arrivalTime of every request
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        origins, destinations = ([(w["waypoint"]["location"]["latLng"]["latitude"],
+                                   w["waypoint"]["location"]["latLng"]["longitude"]) for w in body[side]]
+                                 for side in ("origins", "destinations"))
+        with self.server.lock:
+            self.server.requests.append((origins, destinations))
+            self.server.arrival_times.append(body["arrivalTime"])
+            status = self.server.failures.pop(0) if self.server.failures else 200
+        if status == 200 and (len(origins) * len(destinations) > distance_matrix.MAX_ELEMENTS[body["travelMode"]]
+                              or any(lat == BAD_LAT for lat, _ in origins)):
+            status = 400
+        if status != 200:
+            self.send_response(status)
+            self.end_headers()
+            return
+        elements = [{"originIndex": i, "destinationIndex": j, "duration": f"{duration(o, d)}s"}
+                    for i, o in enumerate(origins) for j, d in enumerate(destinations)]
+        data = json.dumps(elements).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MatrixClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn()
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_path = Path(tmp.name) / "distance_matrix.json"
+        patcher = mock.patch.object(distance_matrix, "RETRY_BACKOFF_S", 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.origins = [(47.5 + i * 0.001, -122.3) for i in range(250)]
+        self.destinations = [(47.6, -122.33), (47.65, -122.31), (47.7, -122.35)]
+
+    def client(self):
+        return distance_matrix.MatrixClient(base_url=self.server.url, requests_per_second=0,
+                                            cache_path=self.cache_path)
+
+    def expected(self, origins):
+        return [[duration(o, d) for d in self.destinations] for o in origins]
+
+    def test_batches_under_transit_limit(self):
+        client = self.client()
+        self.assertEqual(client.matrix(self.origins, self.destinations, SATURDAY_0830), self.expected(self.origins))
+        # 33 origins x 3 destinations fit in 100 elements
+        self.assertEqual(client.requests_sent, 8)
+        self.assertEqual(sorted(len(o) for o, _ in self.server.requests), [19] + [33] * 7)
+        self.assertTrue(all(len(o) * len(d) <= 100 for o, d in self.server.requests))
+
+    def test_retries(self):
+        self.server.failures = [429, 503, 500]
+        client = self.client()
+        self.assertEqual(client.matrix(self.origins[:10], self.destinations, SATURDAY_0830),
+                         self.expected(self.origins[:10]))
+        self.assertEqual(client.requests_sent, 4)
+
+    def test_gives_up_after_retries(self):
+        self.server.failures = [503] * (distance_matrix.RETRIES + 1)
+        with self.assertRaises(distance_matrix.DistanceMatrixError):
+            self.client().matrix(self.origins[:10], self.destinations, SATURDAY_0830)
+        self.assertEqual(len(self.server.requests), distance_matrix.RETRIES + 1)
+
+    def test_time_of_week_bucket(self):
+        self.client().matrix(self.origins, self.destinations, SATURDAY_0830)
+        # the next Saturday in the same 15-minute bucket is served from the cache file
+        client = self.client()
+        rows = client.matrix(self.origins, self.destinations, SATURDAY_0830 + timedelta(days=7, minutes=14))
+        self.assertEqual(rows, self.expected(self.origins))
+        self.assertEqual(client.requests_sent, 0)
+        self.assertEqual(client.cache_hits, 750)
+        client.matrix(self.origins[:10], self.destinations, SATURDAY_0830 + timedelta(days=7, minutes=15))
+        self.assertEqual(client.requests_sent, 1)
+
+    def test_local_time(self):
+        client = self.client()
+        client.matrix(self.origins[:10], self.destinations, SATURDAY_0830)
+        # 8:30 in Seattle is 15:30 UTC in October (PDT)
+        self.assertEqual(self.server.arrival_times, ["2026-10-24T15:30:00Z"])
+        self.assertEqual(distance_matrix.time_bucket(SATURDAY_0830), "sat-08:30")
+        # naive times are Seattle time, and any zone lands in the local bucket
+        for when in (datetime(2026, 10, 24, 8, 30), datetime(2026, 10, 24, 15, 30, tzinfo=timezone.utc)):
+            self.assertEqual(client.matrix(self.origins[:10], self.destinations, when), self.expected(self.origins[:10]))
+        self.assertEqual(self.server.arrival_times, ["2026-10-24T15:30:00Z"])
+
+    def test_saves_finished_batches_when_one_fails(self):
+        origins = self.origins[:66] + [(BAD_LAT, -122.3)]
+        with self.assertRaises(distance_matrix.DistanceMatrixError):
+            self.client().matrix(origins, self.destinations, SATURDAY_0830)
+        client = self.client()
+        self.assertEqual(client.matrix(self.origins[:66], self.destinations, SATURDAY_0830),
+                         self.expected(self.origins[:66]))
+        self.assertEqual(client.requests_sent, 0)
+
+    def test_base_url_from_environment(self):
+        with mock.patch.dict(os.environ, {"ROUTES_API_URL": self.server.url}):
+            args = distance_matrix.parse_args(["--arrive", "2026-10-24T08:30-07:00",
+                                               "--origins", "a", "--destinations", "b"])
+        self.assertEqual(args.base_url, self.server.url)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+"""DEM raster sampling and backend fallback in elevation.py.
+
+The rasters are written to a temporary directory by ``write_geotiff`` and
+``write_gridfloat`` below. Every raster holds the plane
+``100 + 2 * col + 3 * row``, which bilinear interpolation reproduces
+exactly, so an elevation can be checked against the fractional pixel
+position of its point. The cell size is a power of two, so pixel positions
+are exact too.
+"""
+
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import elevation
+
+WEST, NORTH = -122.5, 47.75
+CELL = 1 / 1024
+HEIGHT, WIDTH = 20, 40
+NODATA = -9999.0
+
+
+def plane(height=HEIGHT, width=WIDTH):
+    rows, cols = np.mgrid[0:height, 0:width]
+    return (100 + 2 * cols + 3 * rows).astype("<f4")
+
+
+def write_geotiff(path, pixels, pixel_is_point=False, nodata=None, rows_per_strip=3, tile=None):
+    """A little-endian float32 GeoTIFF with its north-west corner (or corner pixel centre) at WEST, NORTH."""
+    height, width = pixels.shape
+    if tile:
+        down, across = -(-height // tile), -(-width // tile)
+        padded = np.zeros((down * tile, across * tile), dtype="<f4")
+        padded[:height, :width] = pixels
+        blocks = [padded[r * tile:(r + 1) * tile, c * tile:(c + 1) * tile].tobytes()
+                  for r in range(down) for c in range(across)]
+    else:
+        blocks = [pixels[r:r + rows_per_strip].tobytes() for r in range(0, height, rows_per_strip)]
+
+    # (tag, field type, values); offsets are filled in once the layout is known
+    entries = [
+        (256, 4, [width]),
+        (257, 4, [height]),
+        (258, 3, [32]),
+        (259, 3, [1]),
+        (277, 3, [1]),
+        (339, 3, [3]),
+        (33550, 12, [CELL, CELL, 0.0]),
+        (33922, 12, [0.0, 0.0, 0.0, WEST, NORTH, 0.0]),
+    ]
+    if tile:
+        entries += [(322, 3, [tile]), (323, 3, [tile]), (324, 4, None), (325, 4, [len(b) for b in blocks])]
+    else:
+        entries += [(273, 4, None), (278, 4, [rows_per_strip]), (279, 4, [len(b) for b in blocks])]
+    if pixel_is_point:
+        entries.append((34735, 3, [1, 1, 0, 1, 1025, 0, 1, 2]))
+    if nodata is not None:
+        entries.append((42113, 2, f"{nodata:g}\0".encode("ascii")))
+    entries.sort(key=lambda entry: entry[0])
+
+    formats = {2: "s", 3: "H", 4: "I", 12: "d"}
+
+    def pack(field_type, values):
+        if field_type == 2:
+            return values
+        return struct.pack(f"<{len(values)}{formats[field_type]}", *values)
+
+    # header, IFD, then the values too long to fit in their entries, then the pixels
+    ifd_size = 2 + 12 * len(entries) + 4
+    extra_size = sum(size for _, t, v in entries if (size := len(pack(t, v or [0] * len(blocks)))) > 4)
+    pixel_offset = 8 + ifd_size + extra_size
+    offsets = [pixel_offset + sum(len(b) for b in blocks[:i]) for i in range(len(blocks))]
+
+    ifd = struct.pack("<H", len(entries))
+    extra = b""
+    for tag, field_type, values in entries:
+        data = pack(field_type, offsets if values is None else values)
+        count = len(data) if field_type == 2 else len(data) // struct.calcsize(formats[field_type])
+        if len(data) <= 4:
+            value = data.ljust(4, b"\0")
+        else:
+            value = struct.pack("<I", 8 + ifd_size + len(extra))
+            extra += data
+        ifd += struct.pack("<HHI", tag, field_type, count) + value
+    ifd += struct.pack("<I", 0)
+    path.write_bytes(b"II" + struct.pack("<HI", 42, 8) + ifd + extra + b"".join(blocks))
+    return path
+
+
+def write_gridfloat(path, pixels, nodata=None):
+    """A GridFloat raster whose north-west corner is at WEST, NORTH."""
+    height, width = pixels.shape
+    header = [f"ncols {width}", f"nrows {height}", f"xllcorner {WEST}", f"yllcorner {NORTH - height * CELL}",
+              f"cellsize {CELL}", "byteorder LSBFIRST"]
+    if nodata is not None:
+        header.append(f"NODATA_value {nodata:g}")
+    path.with_suffix(".hdr").write_text("\n".join(header) + "\n")
+    path.write_bytes(pixels.astype("<f4").tobytes())
+    return path
+
+
+def at(rows, cols, pixel_is_point=False):
+    """(lats, lons) of fractional pixel positions."""
+    half = 0.0 if pixel_is_point else 0.5
+    rows, cols = np.asarray(rows, dtype=float), np.asarray(cols, dtype=float)
+    return NORTH - (rows + half) * CELL, WEST + (cols + half) * CELL
+
+
+def expected(rows, cols):
+    return 100 + 2 * np.asarray(cols, dtype=float) + 3 * np.asarray(rows, dtype=float)
+
+
+class RasterTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def assertSamples(self, tile, rows, cols, pixel_is_point=False):
+        lats, lons = at(rows, cols, pixel_is_point)
+        np.testing.assert_allclose(tile.sample(lats, lons), expected(rows, cols), rtol=0, atol=1e-6)
+
+
+class GeoTiffTest(RasterTestCase):
+    ROWS = [0, 0.5, 2.25, 3, 7.75, 19]
+    COLS = [0, 15.5, 16, 0.25, 39, 20.5]
+
+    def test_striped(self):
+        tile = elevation.load_geotiff(write_geotiff(self.dir / "striped.tif", plane()))
+        self.assertEqual((tile.width, tile.height), (WIDTH, HEIGHT))
+        self.assertIsNone(tile.nodata)
+        self.assertSamples(tile, self.ROWS, self.COLS)
+
+    def test_tiled(self):
+        # 16 x 16 tiles, so the raster's right and bottom tiles are padded
+        tile = elevation.load_geotiff(write_geotiff(self.dir / "tiled.tif", plane(), tile=16))
+        self.assertEqual(tile.pixels.shape, (2, 3, 16, 16))
+        self.assertSamples(tile, self.ROWS, self.COLS)
+
+    def test_pixel_is_point(self):
+        area = elevation.load_geotiff(write_geotiff(self.dir / "area.tif", plane()))
+        point = elevation.load_geotiff(write_geotiff(self.dir / "point.tif", plane(), pixel_is_point=True))
+        # the same tiepoint is a pixel corner in one and a pixel centre in the other
+        self.assertAlmostEqual(point.x0, area.x0 - CELL / 2)
+        self.assertAlmostEqual(point.y0, area.y0 + CELL / 2)
+        self.assertSamples(point, self.ROWS, self.COLS, pixel_is_point=True)
+
+    def test_nodata_neighbour(self):
+        pixels = plane()
+        pixels[5, 5] = NODATA
+        tile = elevation.load_geotiff(write_geotiff(self.dir / "nodata.tif", pixels, nodata=NODATA))
+        self.assertEqual(tile.nodata, NODATA)
+        lats, lons = at([5.5, 4.5, 5, 5], [5.5, 4, 6, 3])
+        samples = tile.sample(lats, lons)
+        self.assertTrue(np.isnan(samples[:2]).all())
+        np.testing.assert_allclose(samples[2:], expected([5, 5], [6, 3]), rtol=0, atol=1e-6)
+
+    def test_out_of_bounds(self):
+        tile = elevation.load_geotiff(write_geotiff(self.dir / "bounds.tif", plane()))
+        # outside the pixel centres, even if still inside the outer half pixel
+        lats, lons = at([-0.25, 0, 19.25, 0, 100], [0, -0.25, 0, 39.25, 100])
+        self.assertTrue(np.isnan(tile.sample(lats, lons)).all())
+
+    def test_compressed(self):
+        path = write_geotiff(self.dir / "compressed.tif", plane())
+        data = bytearray(path.read_bytes())
+        # the compression tag is the fourth IFD entry; its value is 8 bytes into it
+        entry = 8 + 2 + 3 * 12
+        self.assertEqual(struct.unpack_from("<H", data, entry)[0], 259)
+        struct.pack_into("<H", data, entry + 8, 5)
+        path.write_bytes(bytes(data))
+        with self.assertRaises(elevation.ElevationError):
+            elevation.load_geotiff(path)
+
+
+class GridFloatTest(RasterTestCase):
+    def test_sample(self):
+        tile = elevation.load_gridfloat(write_gridfloat(self.dir / "dem.flt", plane()))
+        self.assertSamples(tile, [0, 0.5, 10.75, 19], [0, 39, 20.25, 7])
+
+    def test_nodata_and_bounds(self):
+        pixels = plane()
+        pixels[0, 0] = NODATA
+        tile = elevation.load_gridfloat(write_gridfloat(self.dir / "dem.flt", pixels, nodata=NODATA))
+        lats, lons = at([0.5, 1, 20], [0.5, 1, 1])
+        samples = tile.sample(lats, lons)
+        self.assertTrue(np.isnan(samples[[0, 2]]).all())
+        self.assertAlmostEqual(samples[1], expected(1, 1))
+
+    def test_missing_header(self):
+        path = self.dir / "dem.flt"
+        path.write_bytes(plane().tobytes())
+        with self.assertRaises(elevation.ElevationError):
+            elevation.load_gridfloat(path)
+
+
+class RasterBackendTest(RasterTestCase):
+    def test_first_listed_tile_wins(self):
+        write_geotiff(self.dir / "a.tif", plane())
+        write_gridfloat(self.dir / "b.flt", plane() + 1000)
+        backend = elevation.RasterBackend([self.dir / "b.flt", self.dir / "a.tif"])
+        lats, lons = at([1, 100], [1, 1])
+        samples = backend.elevations(lats, lons)
+        self.assertAlmostEqual(samples[0], expected(1, 1) + 1000)
+        self.assertTrue(np.isnan(samples[1]))
+
+    def test_directory(self):
+        write_geotiff(self.dir / "a.tif", plane())
+        (self.dir / "notes.txt").write_text("not a raster")
+        backend = elevation.RasterBackend([self.dir])
+        self.assertEqual([tile.path.name for tile in backend.tiles], ["a.tif"])
+
+
+class Recorder(elevation.ElevationBackend):
+    """Answers the points listed in ``known`` (lat -> elevation) and records what it was asked."""
+
+    def __init__(self, known):
+        self.known = known
+        self.calls = []
+
+    def elevations(self, lats, lons):
+        self.calls.append(lats.tolist())
+        return np.array([self.known.get(lat, np.nan) for lat in lats.tolist()], dtype=float)
+
+
+class FallbackBackendTest(unittest.TestCase):
+    def test_order(self):
+        first = Recorder({1.0: 10.0, 2.0: 20.0})
+        second = Recorder({2.0: -1.0, 3.0: 30.0})
+        third = Recorder({4.0: 40.0})
+        lats = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        out = elevation.FallbackBackend([first, second, third]).elevations(lats, np.zeros(5))
+        np.testing.assert_array_equal(out, [10.0, 20.0, 30.0, 40.0, np.nan])
+        # each backend is only asked for what the ones before it could not answer
+        self.assertEqual(first.calls, [[1.0, 2.0, 3.0, 4.0, 5.0]])
+        self.assertEqual(second.calls, [[3.0, 4.0, 5.0]])
+        self.assertEqual(third.calls, [[4.0, 5.0]])
+
+    def test_stops_when_answered(self):
+        first = Recorder({1.0: 10.0})
+        second = Recorder({})
+        out = elevation.FallbackBackend([first, second]).elevations(np.array([1.0]), np.zeros(1))
+        np.testing.assert_array_equal(out, [10.0])
+        self.assertEqual(second.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
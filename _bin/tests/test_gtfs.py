@@ -0,0 +1,86 @@
+"""RAPTOR searches in gtfs.py against a three-trip feed.
+
+``fixtures/gtfs/three_trips`` runs on Saturdays only:
+
+* rail r1: Beacon Hill 07:50 -> U District 08:05
+* rail r2: Beacon Hill 08:10 -> U District 08:25
+* bus b1: U District bay 2 08:10 -> Green Lake 08:20
+
+Bay 2 is ~111 m from the rail stop, so r1 connects to b1 on foot and r2
+misses it.
+"""
+
+import datetime as dt
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import gis
+import gtfs
+
+FEED = Path(__file__).parent / "fixtures" / "gtfs" / "three_trips"
+SATURDAY = dt.date(2026, 10, 24)
+hms = gtfs.parse_time
+
+
+class FeedTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.feed = gtfs.load_feed([FEED], SATURDAY)
+        cls.stop = {stop_id.split(":", 1)[1]: i for i, stop_id in enumerate(cls.feed.stop_ids)}
+        u, u2 = cls.stop["U"], cls.stop["U2"]
+        cls.transfer = int(np.ceil(gis.haversine_m(cls.feed.stop_lat[u], cls.feed.stop_lon[u],
+                                                   cls.feed.stop_lat[[u2]], cls.feed.stop_lon[[u2]])[0]
+                                   / gtfs.WALK_SPEED_MPS))
+
+    def point(self, stop_id):
+        stop = self.stop[stop_id]
+        return float(self.feed.stop_lat[stop]), float(self.feed.stop_lon[stop])
+
+
+class EarliestArrivalTest(FeedTestCase):
+    def test_transfer_on_foot(self):
+        best = gtfs.earliest_arrival(self.feed, {self.stop["B"]: hms("07:45:00")})
+        self.assertEqual(best[self.stop["B"]], hms("07:45:00"))
+        self.assertEqual(best[self.stop["U"]], hms("08:05:00"))
+        self.assertEqual(best[self.stop["U2"]], hms("08:05:00") + self.transfer)
+        self.assertEqual(best[self.stop["G"]], hms("08:20:00"))
+
+    def test_max_rounds(self):
+        best = gtfs.earliest_arrival(self.feed, {self.stop["B"]: hms("07:45:00")}, max_rounds=1)
+        self.assertEqual(best[self.stop["U"]], hms("08:05:00"))
+        self.assertEqual(best[self.stop["G"]], gtfs.UNREACHED)
+
+    def test_later_trip_misses_connection(self):
+        best = gtfs.earliest_arrival(self.feed, {self.stop["B"]: hms("07:51:00")})
+        self.assertEqual(best[self.stop["U"]], hms("08:25:00"))
+        self.assertEqual(best[self.stop["G"]], gtfs.UNREACHED)
+
+    def test_no_service(self):
+        with self.assertRaises(gtfs.GTFSError):
+            gtfs.load_feed([FEED], SATURDAY + dt.timedelta(days=1))
+
+
+class TravelTimesTest(FeedTestCase):
+    def test_latest_departure(self):
+        origins = {"beacon": self.point("B"), "udistrict": self.point("U"), "bay2": self.point("U2")}
+        times = gtfs.travel_times(self.feed, origins, self.point("G"), hms("08:30:00"))
+        # leave Beacon Hill on r1 at 07:50, U District in time to walk to b1 at 08:10
+        self.assertEqual(times, {
+            "beacon": hms("08:30:00") - hms("07:50:00"),
+            "udistrict": hms("08:30:00") - hms("08:10:00") + self.transfer,
+            "bay2": hms("08:30:00") - hms("08:10:00"),
+        })
+
+    def test_too_early(self):
+        times = gtfs.travel_times(self.feed, {"beacon": self.point("B")}, self.point("G"), hms("08:19:00"))
+        self.assertEqual(times, {"beacon": None})
+
+    def test_walk_only(self):
+        times = gtfs.travel_times(self.feed, {"udistrict": self.point("U")}, self.point("U2"), hms("06:00:00"))
+        self.assertEqual(times, {"udistrict": self.transfer})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""Encode LineString features as a TopoJSON topology with shared arcs.
+
+Many of our routes run along the same streets and trails, so an aggregate
+FeatureCollection repeats the same coordinates once per route. A topology
+stores each shared stretch once as an *arc* and describes every route as a
+list of arc references, following the TopoJSON specification:
+
+  https://github.com/topojson/topojson-specification
+
+Coordinates are quantized onto an integer grid covering the bounding box and
+each arc is delta-encoded, which keeps the numbers short. Elevations are not
+part of the topology; pages that need them should use the per-route GeoJSON.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+Point = tuple[int, int]
+
+DEFAULT_QUANTIZATION = 100_000
+
+
+class TopologyError(ValueError):
+    """Raised when features cannot be encoded as a topology."""
+
+
+def _line_coordinates(feature: dict) -> list[list[float]]:
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") != "LineString":
+        raise TopologyError(
+            f"Only LineString features can be encoded, got {geometry.get('type')!r} "
+            f"(feature {feature.get('properties', {}).get('id')!r})"
+        )
+    return geometry["coordinates"]
+
+
+def _bbox(lines: Iterable[list[list[float]]]) -> tuple[float, float, float, float]:
+    x0 = y0 = float("inf")
+    x1 = y1 = float("-inf")
+    for line in lines:
+        for coord in line:
+            x, y = coord[0], coord[1]
+            x0, x1 = min(x0, x), max(x1, x)
+            y0, y1 = min(y0, y), max(y1, y)
+    return x0, y0, x1, y1
+
+
+def _quantize(line: list[list[float]], x0: float, y0: float, kx: float, ky: float) -> list[Point]:
+    """Quantize a line onto the grid, dropping consecutive duplicates."""
+    out: list[Point] = []
+    for coord in line:
+        point = (round((coord[0] - x0) / kx), round((coord[1] - y0) / ky))
+        if not out or out[-1] != point:
+            out.append(point)
+    if len(out) == 1:
+        # Arcs need at least two positions; keep degenerate lines drawable
+        out.append(out[0])
+    return out
+
+
+def _find_junctions(lines: list[list[Point]]) -> set[Point]:
+    """Points where lines meet, split, or end.
+
+    A point is a junction if it is the end of a line, or if it is reached from
+    different neighbours in different places. Where two lines share a stretch,
+    each interior point has the same pair of neighbours (in either direction),
+    so the stretch between junctions is identical in both lines.
+    """
+    junctions: set[Point] = set()
+    neighbours: dict[Point, frozenset[Point]] = {}
+    for line in lines:
+        junctions.add(line[0])
+        junctions.add(line[-1])
+        for i in range(1, len(line) - 1):
+            point = line[i]
+            pair = frozenset((line[i - 1], line[i + 1]))
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+def _cut(line: list[Point], junctions: set[Point]) -> list[list[Point]]:
+    """Split ``line`` into arcs at every junction."""
+    arcs = []
+    start = 0
+    for i in range(1, len(line)):
+        if line[i] in junctions or i == len(line) - 1:
+            arcs.append(line[start:i + 1])
+            start = i
+    return arcs
+
+
+def _delta_encode(arc: list[Point]) -> list[list[int]]:
+    encoded = [list(arc[0])]
+    for (px, py), (x, y) in zip(arc, arc[1:]):
+        encoded.append([x - px, y - py])
+    return encoded
+
+
+def build_topology(features: list[dict], object_name: str = "routes",
+                   quantization: int = DEFAULT_QUANTIZATION) -> dict:
+    """Encode LineString ``features`` as a TopoJSON topology with shared, delta-encoded arcs."""
+    if quantization < 2:
+        raise TopologyError("quantization must be at least 2")
+    lines = [_line_coordinates(feature) for feature in features]
+    if not any(lines):
+        return {
+            "type": "Topology",
+            "objects": {object_name: {"type": "GeometryCollection", "geometries": []}},
+            "arcs": [],
+        }
+
+    x0, y0, x1, y1 = _bbox(lines)
+    kx = (x1 - x0) / (quantization - 1) or 1.0
+    ky = (y1 - y0) / (quantization - 1) or 1.0
+    quantized = [_quantize(line, x0, y0, kx, ky) for line in lines]
+    junctions = _find_junctions(quantized)
+
+    arcs: list[list[Point]] = []
+    arc_index: dict[tuple[Point, ...], int] = {}
+    geometries = []
+    for feature, line in zip(features, quantized):
+        refs = []
+        for arc in _cut(line, junctions):
+            key = tuple(arc)
+            if key in arc_index:
+                refs.append(arc_index[key])
+                continue
+            reversed_key = key[::-1]
+            if reversed_key in arc_index:
+                # TopoJSON encodes a reversed arc i as its one's complement
+                refs.append(~arc_index[reversed_key])
+                continue
+            arc_index[key] = len(arcs)
+            refs.append(len(arcs))
+            arcs.append(arc)
+
+        geometry = {"type": "LineString", "arcs": refs}
+        properties = feature.get("properties")
+        if properties is not None:
+            if "id" in properties:
+                geometry["id"] = properties["id"]
+            geometry["properties"] = properties
+        geometries.append(geometry)
+
+    return {
+        "type": "Topology",
+        "bbox": [x0, y0, x1, y1],
+        "transform": {"scale": [kx, ky], "translate": [x0, y0]},
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": [_delta_encode(arc) for arc in arcs],
+    }
@@ -1,15 +1,15 @@
+import argparse
 import os
-import typing
 from datetime import datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
 
-import requests
 import rcr
-import haversine
 import csv
-import joblib
+import distance_matrix
 import gis
+import gtfs
 
-cache = joblib.Memory("cache").cache
 GOOGLE_MAPS_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY")
 
 MAX_REACHABILITY = 3
@@ -26,16 +26,13 @@ TRANSPORT_FILES = {
     "Bus": rcr.ROUTES / "_transit_data/bus.csv",
 }
 
-STOPS = {}
+# stops of each system with a spatial index over them, in order of preference
+SYSTEM_STOPS = {}
 for system_name, file_name in TRANSPORT_FILES.items():
     with open(file_name, "r") as f:
-        system = csv.DictReader(f, dialect="unix")
-        for loc in system:
-            STOPS[loc['stop_name']] = {
-                'lon': float(loc['stop_lon']),
-                'lat': float(loc['stop_lat']),
-                'system': system_name,
-            }
+        stops = [(stop['stop_name'], float(stop['stop_lat']), float(stop['stop_lon']))
+                 for stop in csv.DictReader(f, dialect="unix")]
+    SYSTEM_STOPS[system_name] = (stops, gis.PointIndex([(lat, lon) for _, lat, lon in stops]))
 
 for critical_loc in CRITICAL_LOC_NAMES:
     for loc in locs:
@@ -43,73 +40,89 @@ for critical_loc in CRITICAL_LOC_NAMES:
             CRITICAL_LOCS.append((loc["id"], loc['lat'], loc['lon']))
 
 
-# determine if this stop is "close enough"
-def near_enough(p1, p2, threshold=0.3): #0.3 miles or 6 minutes of walking
-    return haversine.haversine(p1, p2, unit=haversine.Unit.MILES) < threshold
-
-@cache
-def query_routes(start: tuple[float, float], destinations: typing.Iterable[tuple[float, float]], arrive_time, mode="TRANSIT"):
-    orig = [{"waypoint": { "location": {"latLng": {"latitude": start[0], "longitude": start[1]}}}}]
-    dest = [{"waypoint": { "location": {"latLng": {"latitude": d[0], "longitude": d[1]}}}} for d in destinations]
-    epoch_time_next_saturday = arrive_time.isoformat() + 'Z'
-
-    response = requests.post(f"https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix",
-                            json={
-                                    "destinations": dest,
-                                    "origins": orig,
-                                    "travelMode": mode,
-                                    "arrivalTime": epoch_time_next_saturday},
-                             headers={"Content-Type": "application/json",
-                                      "X-Goog-Api-Key": GOOGLE_MAPS_API_KEY,
-                             "X-Goog-FieldMask": "originIndex,destinationIndex,duration,condition"}
-                             )
-    response_json = response.json()
-
-    if response.status_code == 200:
-        distance_sec = []
-        for dest in sorted(response_json, key=lambda x: x["destinationIndex"]):
-            if "duration" in dest:
-                distance_sec.append(int(dest["duration"][:-1]))
-            else:
-                distance_sec.append(None)
-        return distance_sec
-
-    raise Exception(f"Error in query_routes: {response.status_code} {response_json}")
-
-# Calculate the number of days to the next Saturday (weekday 5)
-days_to_saturday = (5 - datetime.today().weekday() + 7) % 7
-next_saturday = datetime.today() + timedelta(days=days_to_saturday)
-next_saturday = next_saturday.replace(hour=8, minute=30, second=0, microsecond=0)
-
-for loc in locs:
-    id = loc["id"]
-    print(f"Processing {id}")
-    # match to nearest stop
-    transit_choice = f"Bus or Drive"
-    for stop_name, stop_dict in STOPS.items():
-        if near_enough((loc["lat"], loc["lon"]), (stop_dict['lat'], stop_dict['lon'])):
-            transit_choice = f"{stop_dict['system']} to {stop_name} stop"
-            break
-    loc["transit"] = transit_choice
-
-    # Tag with neighborhood
-    for (n_name, n_coarse_name), (n_shape, bbox) in neighborhoods.items():
-        if gis.is_point_in_bbox(loc["lon"], loc["lat"], bbox) and gis.is_point_in_polygon(loc["lon"], loc["lat"], n_shape):
-            loc["neighborhood"] = n_name
-            break
-
-    # determine reachability
-    query_locations = [stop[1:] for stop in CRITICAL_LOCS if stop[0] != id]
-    distance_sec = query_routes((loc["lat"], loc["lon"]), query_locations, next_saturday)
-
-    reachability = MAX_REACHABILITY
-    # Mark bad reachability if there is a missing value
-    if distance_sec and all(distance_sec):
-        avg_distance_mins = sum(distance_sec) / len(distance_sec) /60
-        max_distance_mins = max(distance_sec)/60
-        reachability = min(reachability, 1 + int(max_distance_mins/(30)))
-    print(list(zip([stop[0] for stop in CRITICAL_LOCS if stop[0] != id], distance_sec)))
-    print(f"Reachability: {reachability}")
-    loc["reachability"] = reachability
-
-rcr.save_loc_db(locs)
+# a stop is "close enough" within 0.3 miles, or 6 minutes of walking
+NEAR_ENOUGH_M = 0.3 * 1609.344
+
+def transit_choices(locs):
+    # nearest stop of the first system (light rail before bus) with one close enough, for every location
+    choices = [None] * len(locs)
+    for system_name, (stops, index) in SYSTEM_STOPS.items():
+        nearest = index.nearest_all([(loc["lat"], loc["lon"]) for loc in locs], NEAR_ENOUGH_M)
+        for i, stop in enumerate(nearest):
+            if choices[i] is None and stop is not None:
+                choices[i] = f"{system_name} to {stops[stop[1]][0]} stop"
+    return [choice or "Bus or Drive" for choice in choices]
+
+def next_saturday_morning():
+    # 8:30 on the next Saturday (weekday 5), Seattle time, whatever zone this runs in
+    today = datetime.now(ZoneInfo("America/Los_Angeles"))
+    days_to_saturday = (5 - today.weekday() + 7) % 7
+    next_saturday = today + timedelta(days=days_to_saturday)
+    return next_saturday.replace(hour=8, minute=30, second=0, microsecond=0)
+
+def google_travel_times(arrive_time):
+    # one route matrix for every location to every critical location, batched and cached by the client
+    client = distance_matrix.MatrixClient(GOOGLE_MAPS_API_KEY,
+                                          os.environ.get("ROUTES_API_URL", distance_matrix.ROUTES_URL))
+    matrix = client.matrix([(loc["lat"], loc["lon"]) for loc in locs],
+                           [(lat, lon) for _name, lat, lon in CRITICAL_LOCS], arrive_time)
+    print(f"Routes API: {client.requests_sent} requests, {client.cache_hits} cached durations")
+    rows = {loc["id"]: row for loc, row in zip(locs, matrix)}
+    def travel_times(loc):
+        return [seconds for (name, _lat, _lon), seconds in zip(CRITICAL_LOCS, rows[loc["id"]]) if name != loc["id"]]
+    return travel_times
+
+def gtfs_travel_times(arrive_time, feeds=None):
+    # one RAPTOR search per critical location, over the GTFS feeds fetch_transit_data.sh downloads
+    feed = gtfs.load_feed(feeds or gtfs.feed_paths(), arrive_time.date())
+    arrive_by = arrive_time.hour * 3600 + arrive_time.minute * 60
+    origins = {loc["id"]: (loc["lat"], loc["lon"]) for loc in locs}
+    by_destination = {name: gtfs.travel_times(feed, origins, (lat, lon), arrive_by)
+                      for name, lat, lon in CRITICAL_LOCS}
+    def travel_times(loc):
+        return [by_destination[name][loc["id"]] for name, _lat, _lon in CRITICAL_LOCS if name != loc["id"]]
+    return travel_times
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the transit, neighborhood and reachability of every location.")
+    parser.add_argument("--backend", choices=["google", "gtfs"], default="google",
+                        help="Where travel times come from: the Google Routes API (needs GOOGLE_MAPS_API_KEY), "
+                             "or the GTFS feeds in routes/_transit_data/gtfs, offline (default: %(default)s)")
+    parser.add_argument("--gtfs", nargs="+", type=Path, metavar="PATH",
+                        help="GTFS feed directories or zip files to use with --backend gtfs")
+    args = parser.parse_args()
+
+    arrive_time = next_saturday_morning()
+    if args.backend == "gtfs":
+        travel_times = gtfs_travel_times(arrive_time, args.gtfs)
+    else:
+        travel_times = google_travel_times(arrive_time)
+
+    for loc, transit_choice in zip(locs, transit_choices(locs)):
+        id = loc["id"]
+        print(f"Processing {id}")
+        loc["transit"] = transit_choice
+
+        # Tag with neighborhood
+        for (n_name, n_coarse_name), (n_shape, bbox) in neighborhoods.items():
+            if gis.is_point_in_bbox(loc["lon"], loc["lat"], bbox) and gis.is_point_in_polygon(loc["lon"], loc["lat"], n_shape):
+                loc["neighborhood"] = n_name
+                break
+
+        # determine reachability
+        distance_sec = travel_times(loc)
+
+        reachability = MAX_REACHABILITY
+        # Mark bad reachability if there is a missing value
+        if distance_sec and all(distance_sec):
+            avg_distance_mins = sum(distance_sec) / len(distance_sec) /60
+            max_distance_mins = max(distance_sec)/60
+            reachability = min(reachability, 1 + int(max_distance_mins/(30)))
+        print(list(zip([stop[0] for stop in CRITICAL_LOCS if stop[0] != id], distance_sec)))
+        print(f"Reachability: {reachability}")
+        loc["reachability"] = reachability
+
+    rcr.save_loc_db(locs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+"""SQLite warehouse of routes, track points, locations, neighborhoods and schedules.
+
+Scripts that need to join routes with schedules or find tracks near a point
+otherwise re-parse every GPX file and schedule YAML each run. The warehouse
+keeps all of it in one SQLite database (``cache/warehouse.sqlite`` by
+default), updated incrementally: each source file's size and modification
+time are recorded, and an update only deletes and re-inserts the rows of
+files that changed, were added or were removed.
+
+Tables:
+
+  routes             one row per route GPX: the fields of ``rcr.load_route``,
+                     the rest of its metadata as JSON
+  track_points       every track point, in order (``route_id``, ``seq``)
+  track_points_rtree R-tree over the points, by ``track_points.id``
+  routes_rtree       R-tree over route bounding boxes, by ``routes.rowid``
+  locations          ``locations.geojson``
+  neighborhoods      ``neighborhoods.geojson``, geometry as GeoJSON
+  neighborhoods_rtree R-tree over neighborhood bounding boxes
+  runs               one row per schedule entry, with its quarter
+  phases             one row per plan phase of a run
+
+Use ``rcr.load_warehouse()`` to get an up-to-date :class:`Warehouse`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sqlite3
+import time
+from pathlib import Path
+from typing import Sequence
+
+import haversine
+
+import gis
+import rcr
+
+DEFAULT_PATH = rcr.ROOT / "cache" / "warehouse.sqlite"
+# bump when the schema changes; an older database is rebuilt from scratch
+SCHEMA_VERSION = 1
+SEASON_ORDER = {"winter": 1, "spring": 2, "summer": 3, "autumn": 4}
+
+SCHEMA = """
+CREATE TABLE sources (path TEXT PRIMARY KEY, kind TEXT NOT NULL, size INTEGER, mtime_ns INTEGER);
+CREATE TABLE routes (
+    id TEXT PRIMARY KEY, source TEXT NOT NULL, name TEXT, type TEXT, start TEXT, "end" TEXT,
+    distance_mi REAL, ascent_m REAL, descent_m REAL, deprecated TEXT, metadata TEXT
+);
+CREATE INDEX routes_source ON routes (source);
+CREATE VIRTUAL TABLE routes_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE track_points (id INTEGER PRIMARY KEY, route_id TEXT NOT NULL, seq INTEGER, lat REAL, lon REAL, ele REAL);
+CREATE INDEX track_points_route ON track_points (route_id, seq);
+CREATE VIRTUAL TABLE track_points_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE locations (id TEXT PRIMARY KEY, name TEXT, lat REAL, lon REAL, neighborhood TEXT, properties TEXT);
+CREATE TABLE neighborhoods (id INTEGER PRIMARY KEY, s_hood TEXT, l_hood TEXT, geometry TEXT);
+CREATE VIRTUAL TABLE neighborhoods_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE runs (
+    id INTEGER PRIMARY KEY, quarter TEXT NOT NULL, quarter_order INTEGER, seq INTEGER, date TEXT,
+    cancelled TEXT, organized_event INTEGER
+);
+CREATE INDEX runs_quarter ON runs (quarter);
+CREATE INDEX runs_date ON runs (date);
+CREATE TABLE phases (
+    run_id INTEGER NOT NULL, seq INTEGER, time TEXT, route_id TEXT, name TEXT, distance_mi REAL,
+    cancelled TEXT, notes TEXT
+);
+CREATE INDEX phases_run ON phases (run_id);
+CREATE INDEX phases_route ON phases (route_id);
+"""
+
+# route fields with their own column; everything else but the track goes into metadata
+ROUTE_COLUMNS = ("name", "type", "start", "end", "distance_mi", "ascent_m", "descent_m", "deprecated")
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Create and parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Build or update the SQLite warehouse of routes, locations, neighborhoods and schedules.",
+    )
+    parser.add_argument(
+        "--db",
+        metavar="PATH",
+        type=Path,
+        default=DEFAULT_PATH,
+        help="Database file (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Rebuild every table from scratch instead of updating changed files only.",
+    )
+    return parser.parse_args(argv)
+
+
+def quarter_order(quarter: str) -> int:
+    """Sort key of a quarter ID like ``25-autumn``, as in ``rcr.schedule_paths``."""
+    year, season = quarter.split("-")
+    return int(year) * 10 + SEASON_ORDER[season]
+
+
+def _relative(path: Path) -> str:
+    return str(Path(path).resolve().relative_to(rcr.ROOT))
+
+
+def _cancelled(entry: dict) -> str | None:
+    return str(entry["cancelled"]) if "cancelled" in entry else None
+
+
+class Warehouse:
+    """An open warehouse database, with the queries scripts need."""
+
+    def __init__(self, path: Path = DEFAULT_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._create()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> Warehouse:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _create(self) -> None:
+        with self.conn:
+            # virtual tables first: dropping one drops its shadow tables too
+            tables = [row[0] for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+            virtual = [row[0] for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")]
+            for name in virtual + [name for name in tables if name not in virtual]:
+                self.conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # -- updating -------------------------------------------------------------
+
+    def update(self, rebuild: bool = False) -> list[str]:
+        """Bring the tables up to date with the source files; returns the sources that changed."""
+        if rebuild:
+            self._create()
+        current = {_relative(path): "route" for path in rcr.gpx_paths()}
+        current.update({_relative(path): "schedule" for path in rcr.schedule_paths()})
+        current[_relative(rcr.LOC_DB)] = "locations"
+        current[_relative(rcr.NEIGHBORHOOD_FILE)] = "neighborhoods"
+        known = {row["path"]: (row["kind"], row["size"], row["mtime_ns"])
+                 for row in self.conn.execute("SELECT * FROM sources")}
+
+        changed = []
+        with self.conn:
+            for source, (kind, _size, _mtime) in known.items():
+                if source not in current:
+                    self._delete(kind, source)
+                    self.conn.execute("DELETE FROM sources WHERE path = ?", (source,))
+                    changed.append(source)
+            for source, kind in sorted(current.items()):
+                stat = (rcr.ROOT / source).stat()
+                if known.get(source) == (kind, stat.st_size, stat.st_mtime_ns):
+                    continue
+                self._delete(kind, source)
+                getattr(self, f"_insert_{kind}")(source)
+                self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                                  (source, kind, stat.st_size, stat.st_mtime_ns))
+                changed.append(source)
+        return changed
+
+    def _delete(self, kind: str, source: str) -> None:
+        if kind == "route":
+            routes = "SELECT id FROM routes WHERE source = ?"
+            self.conn.execute("DELETE FROM track_points_rtree WHERE id IN "
+                              f"(SELECT id FROM track_points WHERE route_id IN ({routes}))", (source,))
+            self.conn.execute(f"DELETE FROM track_points WHERE route_id IN ({routes})", (source,))
+            self.conn.execute("DELETE FROM routes_rtree WHERE id IN (SELECT rowid FROM routes WHERE source = ?)",
+                              (source,))
+            self.conn.execute("DELETE FROM routes WHERE source = ?", (source,))
+        elif kind == "schedule":
+            quarter = Path(source).stem
+            self.conn.execute("DELETE FROM phases WHERE run_id IN (SELECT id FROM runs WHERE quarter = ?)", (quarter,))
+            self.conn.execute("DELETE FROM runs WHERE quarter = ?", (quarter,))
+        elif kind == "locations":
+            self.conn.execute("DELETE FROM locations")
+        elif kind == "neighborhoods":
+            self.conn.execute("DELETE FROM neighborhoods_rtree")
+            self.conn.execute("DELETE FROM neighborhoods")
+
+    def _insert_route(self, source: str) -> None:
+        route = rcr.load_route(rcr.ROOT / source)
+        metadata = {key: value for key, value in route.items()
+                    if key not in ROUTE_COLUMNS and key not in ("id", "track", "path")}
+        cursor = self.conn.execute(
+            "INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (route["id"], source, *(route[column] for column in ROUTE_COLUMNS), json.dumps(metadata, default=str)))
+        points = [(point.latitude, point.longitude, point.elevation) for point in route["track"].points]
+        if not points:
+            return
+        lats = [lat for lat, _lon, _ele in points]
+        lons = [lon for _lat, lon, _ele in points]
+        self.conn.execute("INSERT INTO routes_rtree VALUES (?, ?, ?, ?, ?)",
+                          (cursor.lastrowid, min(lats), max(lats), min(lons), max(lons)))
+        first = self.conn.execute("SELECT coalesce(max(id), 0) + 1 FROM track_points").fetchone()[0]
+        self.conn.executemany("INSERT INTO track_points VALUES (?, ?, ?, ?, ?, ?)",
+                              ((first + seq, route["id"], seq, lat, lon, ele)
+                               for seq, (lat, lon, ele) in enumerate(points)))
+        self.conn.executemany("INSERT INTO track_points_rtree VALUES (?, ?, ?, ?, ?)",
+                              ((first + seq, lat, lat, lon, lon) for seq, (lat, lon, _ele) in enumerate(points)))
+
+    def _insert_schedule(self, source: str) -> None:
+        quarter = Path(source).stem
+        for seq, entry in enumerate(rcr.load_yaml(rcr.ROOT / source) or []):
+            cursor = self.conn.execute(
+                "INSERT INTO runs (quarter, quarter_order, seq, date, cancelled, organized_event)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (quarter, quarter_order(quarter), seq, str(entry["date"]), _cancelled(entry),
+                 int(bool(entry.get("organized-event")))))
+            for phase_seq, phase in enumerate(entry.get("plan") or []):
+                route = phase.get("route") or {}
+                self.conn.execute(
+                    "INSERT INTO phases VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cursor.lastrowid, phase_seq, phase.get("time"), phase.get("route_id"), route.get("name"),
+                     phase.get("distance_mi", route.get("distance_mi")), _cancelled(phase), phase.get("notes")))
+
+    def _insert_locations(self, source: str) -> None:
+        self.conn.executemany(
+            "INSERT INTO locations VALUES (?, ?, ?, ?, ?, ?)",
+            ((loc["id"], loc.get("name"), loc["lat"], loc["lon"], loc.get("neighborhood"), json.dumps(loc))
+             for loc in rcr.load_loc_db()))
+
+    def _insert_neighborhoods(self, source: str) -> None:
+        for id, ((s_hood, l_hood), (shape, bbox)) in enumerate(rcr.load_neighborhoods().items(), start=1):
+            self.conn.execute("INSERT INTO neighborhoods VALUES (?, ?, ?, ?)", (id, s_hood, l_hood, json.dumps(shape)))
+            min_lon, max_lon, min_lat, max_lat = bbox
+            self.conn.execute("INSERT INTO neighborhoods_rtree VALUES (?, ?, ?, ?, ?)",
+                              (id, min_lat, max_lat, min_lon, max_lon))
+
+    # -- queries --------------------------------------------------------------
+
+    def route(self, route_id: str) -> dict | None:
+        """A route's fields (without its track), or None."""
+        row = self.conn.execute("SELECT * FROM routes WHERE id = ?", (route_id,)).fetchone()
+        return self._route(row) if row else None
+
+    def routes(self) -> list[dict]:
+        return [self._route(row) for row in self.conn.execute("SELECT * FROM routes ORDER BY id")]
+
+    @staticmethod
+    def _route(row: sqlite3.Row) -> dict:
+        route = {key: row[key] for key in row.keys() if key != "metadata"}
+        route.update(json.loads(row["metadata"]))
+        return route
+
+    def track(self, route_id: str) -> list[tuple[float, float, float | None]]:
+        """(lat, lon, ele) of a route's track points, in order."""
+        return [tuple(row) for row in self.conn.execute(
+            "SELECT lat, lon, ele FROM track_points WHERE route_id = ? ORDER BY seq", (route_id,))]
+
+    def route_ends(self) -> dict[str, tuple[str, str]]:
+        """Route ID -> (start, end) location IDs.
+
+        Routes without a start or end in their metadata get the location
+        nearest their first or last track point, as in the routes table.
+        """
+        locations = [dict(row) for row in self.conn.execute("SELECT id, lat, lon FROM locations")]
+        ends = {}
+        for row in self.conn.execute(
+                'SELECT routes.id, routes.start, routes."end", first.lat, first.lon, last.lat, last.lon FROM routes'
+                " JOIN track_points AS first ON first.route_id = routes.id AND first.seq = 0"
+                " JOIN track_points AS last ON last.route_id = routes.id"
+                " AND last.seq = (SELECT max(seq) FROM track_points WHERE route_id = routes.id)"):
+            route_id, start, end, first_lat, first_lon, last_lat, last_lon = row
+            ends[route_id] = (start or gis.get_nearest_loc(locations, first_lat, first_lon)[0],
+                              end or gis.get_nearest_loc(locations, last_lat, last_lon)[0])
+        return ends
+
+    def route_run_dates(self) -> dict[str, list[str]]:
+        """Route ID -> dates it was run, as ``rcr.route_run_dates`` computes from the schedules."""
+        dates_run: dict[str, list[str]] = {}
+        for route_id, date in self.conn.execute(
+                "SELECT phases.route_id, runs.date FROM phases JOIN runs ON runs.id = phases.run_id"
+                " WHERE phases.route_id IS NOT NULL AND runs.cancelled IS NULL AND phases.cancelled IS NULL"
+                " ORDER BY runs.quarter_order, runs.seq, phases.seq"):
+            dates_run.setdefault(route_id, []).append(date)
+        return dates_run
+
+    def runs_of_route(self, route_id: str) -> list[dict]:
+        """Quarter, date and start time of every run of a route, cancelled or not."""
+        return [dict(row) for row in self.conn.execute(
+            "SELECT runs.quarter, runs.date, phases.time, coalesce(phases.cancelled, runs.cancelled) AS cancelled"
+            " FROM phases JOIN runs ON runs.id = phases.run_id WHERE phases.route_id = ?"
+            " ORDER BY runs.quarter_order, runs.seq, phases.seq", (route_id,))]
+
+    def routes_near(self, lat: float, lon: float, radius_m: float) -> dict[str, float]:
+        """Route ID -> distance in metres of its nearest track point, for routes with a point within ``radius_m``."""
+        dlat = math.degrees(radius_m / gis.EARTH_RADIUS_M)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        nearest: dict[str, float] = {}
+        for route_id, point_lat, point_lon in self.conn.execute(
+                "SELECT track_points.route_id, track_points.lat, track_points.lon FROM track_points_rtree"
+                " JOIN track_points ON track_points.id = track_points_rtree.id"
+                " WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?",
+                (lat + dlat, lat - dlat, lon + dlon, lon - dlon)):
+            distance = haversine.haversine((lat, lon), (point_lat, point_lon), unit=haversine.Unit.METERS)
+            if distance <= radius_m and distance < nearest.get(route_id, math.inf):
+                nearest[route_id] = distance
+        return dict(sorted(nearest.items(), key=lambda item: item[1]))
+
+    def routes_in_bbox(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> list[str]:
+        """IDs of routes whose bounding box overlaps the given one."""
+        return [row[0] for row in self.conn.execute(
+            "SELECT routes.id FROM routes_rtree JOIN routes ON routes.rowid = routes_rtree.id"
+            " WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ? ORDER BY routes.id",
+            (max_lat, min_lat, max_lon, min_lon))]
+
+    def neighborhoods_at(self, lat: float, lon: float) -> list[tuple[str, str]]:
+        """(small, large) names of the neighborhoods containing a point."""
+        return [(row["s_hood"], row["l_hood"]) for row in self.conn.execute(
+            "SELECT neighborhoods.* FROM neighborhoods_rtree JOIN neighborhoods USING (id)"
+            " WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?", (lat, lat, lon, lon))
+            if gis.is_point_in_polygon(lon, lat, json.loads(row["geometry"]))]
+
+    def location(self, location_id: str) -> dict | None:
+        row = self.conn.execute("SELECT properties FROM locations WHERE id = ?", (location_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = parse_args(argv)
+    start = time.perf_counter()
+    try:
+        with Warehouse(args.db) as warehouse:
+            changed = warehouse.update(rebuild=args.rebuild)
+            counts = {table: warehouse.conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                      for table in ("routes", "track_points", "locations", "neighborhoods", "runs", "phases")}
+    except (OSError, ValueError, sqlite3.Error, rcr.GPXParseError, rcr.GPXFormatError) as exc:
+        raise SystemExit(str(exc)) from exc
+
+    print(f"Updated {len(changed)} changed source files in {time.perf_counter() - start:.2f}s: "
+          + ", ".join(f"{count:,} {table}" for table, count in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -25,8 +25,16 @@ export class ElevationProfile extends HTMLElement {
         this.render();
     }
 
+    // Full route coordinates; points are spaced by index
     set elevationData(data) {
-        this.data = data.map(d => ({ lat: d[0], lng: d[1], ele: d[2] }));
+        this.data = data.map((d, i) => ({ x: i, lat: d[0], lng: d[1], ele: d[2] }));
+        this.render();
+    }
+
+    // Precomputed profile from gpx_to_geojson.py --profile-dir: parallel arrays of distance
+    // along the route (d, metres) and elevation (e, metres), so points are spaced by distance
+    set profile(profile) {
+        this.data = profile.d.map((x, i) => ({ x, ele: profile.e[i] }));
         this.render();
     }
 
@@ -51,7 +59,7 @@ export class ElevationProfile extends HTMLElement {
     this.svg = d3.select(this.querySelector('svg g'));
 
     const x = d3.scaleLinear()
-    .domain([0, this.data.length - 1])
+    .domain([0, this.data.length ? this.data[this.data.length - 1].x : 0])
     .range([0, this.width]);
 
     const y = d3.scaleLinear()
@@ -59,7 +67,7 @@ export class ElevationProfile extends HTMLElement {
     .range([this.height, 0]);
 
     const area = d3.area()
-    .x((d, i) => x(i))
+    .x(d => x(d.x))
     .y0(this.height)
     .y1(d => y(d.ele));
 